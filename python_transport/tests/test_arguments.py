@@ -184,6 +184,7 @@ def test_defaults():
     parse.add_gateway_config()
     parse.add_filtering_config()
     parse.add_buffering_settings()
+    parse.add_downlink_settings()
 
     sys.argv = [sys.argv[0]]
     settings = parse.settings()
@@ -203,13 +204,25 @@ def test_defaults():
     assert settings.buffering_max_buffered_packets == 0
     assert settings.buffering_max_delay_without_publish == 0
     assert settings.buffering_minimal_sink_cost == 0
+    assert settings.buffering_sink_cost_control is False
+    assert settings.buffering_sink_cost_max_step == 16
     assert settings.gateway_id is None
     assert settings.gateway_model is None
     assert settings.gateway_version is None
+    assert settings.gateway_config_read_timeout_s == 10
+    assert settings.gateway_config_max_age_s == 30
+    assert settings.gateway_scratchpad_chunks_dir is None
+    assert settings.gateway_scratchpad_chunks_ttl_s == 3600
+    assert settings.gateway_publish_statistics is False
+    assert settings.uplink_ring is False
     assert settings.ignored_endpoints_filter is None
     assert settings.whitened_endpoints_filter is None
     assert settings.mqtt_cert_reqs == "CERT_REQUIRED"
     assert settings.mqtt_tls_version == "PROTOCOL_TLSv1_2"
+    assert settings.downlink_max_schedule_delay_s == 3600
+    assert settings.downlink_scheduler_tick_ms == 10
+    assert settings.downlink_duplicate_window_s == 0
+    assert settings.downlink_credit_wait_s == 0
 
 
 def test_type_conversion():
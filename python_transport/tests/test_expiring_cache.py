@@ -0,0 +1,68 @@
+from wirepas_gateway.utils import expiring_cache
+from wirepas_gateway.utils.expiring_cache import ExpiringCache
+
+
+def test_hits_and_misses():
+    cache = ExpiringCache(10)
+    assert cache.get_or_add("a", 1) == (False, 1)
+    assert cache.get_or_add("a", 2) == (True, 1)
+    assert cache.get_or_add("b", 3) == (False, 3)
+    assert cache.stats() == {"hits": 1, "misses": 2, "entries": 2}
+
+
+def test_expiry(monkeypatch):
+    now = [100.0]
+    monkeypatch.setattr(expiring_cache, "monotonic", lambda: now[0])
+
+    cache = ExpiringCache(10)
+    cache.get_or_add("a", 1)
+    now[0] += 5
+    cache.get_or_add("b", 2)
+    # A hit doesn't extend the life of the entry
+    assert cache.get_or_add("a", 3) == (True, 1)
+
+    now[0] += 6
+    assert cache.get_or_add("a", 4) == (False, 4)
+    assert cache.get_or_add("b", 5) == (True, 2)
+
+    now[0] += 10
+    assert cache.get_or_add("c", 6) == (False, 6)
+    assert len(cache) == 1
+
+
+def test_update_keeps_insertion_time(monkeypatch):
+    now = [0.0]
+    monkeypatch.setattr(expiring_cache, "monotonic", lambda: now[0])
+
+    cache = ExpiringCache(10)
+    cache.get_or_add("a", None)
+    now[0] += 8
+    cache.update("a", 1)
+    assert cache.get_or_add("a", None) == (True, 1)
+
+    now[0] += 3
+    assert cache.get_or_add("a", None) == (False, None)
+
+    # Update of a missing key is ignored
+    cache.update("b", 2)
+    assert cache.get_or_add("b", None) == (False, None)
+
+
+def test_remove():
+    cache = ExpiringCache(10)
+    cache.get_or_add("a", None)
+    cache.remove("a")
+    cache.remove("b")
+    assert cache.get_or_add("a", 1) == (False, 1)
+    assert cache.stats() == {"hits": 0, "misses": 2, "entries": 1}
+
+
+def test_max_entries():
+    cache = ExpiringCache(10, max_entries=2)
+    for key in ("a", "b", "c"):
+        cache.get_or_add(key, key)
+
+    assert len(cache) == 2
+    # Oldest one was dropped
+    assert cache.get_or_add("a", None) == (False, None)
+    assert cache.get_or_add("c", None) == (True, "c")
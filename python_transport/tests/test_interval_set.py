@@ -0,0 +1,53 @@
+from wirepas_gateway.utils import IntervalSet
+
+
+def test_merge_overlapping_and_touching():
+    intervals = IntervalSet()
+    intervals.add(10, 20)
+    intervals.add(30, 40)
+    assert intervals.intervals() == [(10, 20), (30, 40)]
+    assert intervals.covered == 20
+
+    # Touching one is merged
+    intervals.add(20, 25)
+    assert intervals.intervals() == [(10, 25), (30, 40)]
+
+    # Bridging both
+    intervals.add(22, 32)
+    assert intervals.intervals() == [(10, 40)]
+    assert intervals.covered == 30
+    assert len(intervals) == 1
+
+
+def test_add_covered_area():
+    intervals = IntervalSet([(0, 100)])
+    intervals.add(10, 20)
+    intervals.add(0, 100)
+    assert intervals.intervals() == [(0, 100)]
+    assert intervals.covered == 100
+
+
+def test_add_empty():
+    intervals = IntervalSet()
+    intervals.add(5, 5)
+    intervals.add(6, 2)
+    assert len(intervals) == 0
+    assert intervals.covered == 0
+
+
+def test_add_covering_several():
+    intervals = IntervalSet([(50, 60), (10, 20), (30, 40)])
+    assert intervals.intervals() == [(10, 20), (30, 40), (50, 60)]
+
+    intervals.add(0, 55)
+    assert intervals.intervals() == [(0, 60)]
+    assert intervals.covered == 60
+
+
+def test_missing():
+    intervals = IntervalSet([(10, 20), (30, 40)])
+    assert intervals.missing(0, 50) == [(0, 10), (20, 30), (40, 50)]
+    assert intervals.missing(15, 35) == [(20, 30)]
+    assert intervals.missing(10, 20) == []
+    assert intervals.missing(20, 30) == [(20, 30)]
+    assert IntervalSet().missing(0, 8) == [(0, 8)]
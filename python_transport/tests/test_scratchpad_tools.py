@@ -0,0 +1,133 @@
+import json
+import os
+import struct
+import threading
+import time
+
+from wirepas_gateway.utils import (
+    PartialScratchpad,
+    SCRATCHPAD_HEADER_FORMAT,
+    SCRATCHPAD_TAG,
+    get_scratchpad_crc,
+)
+
+
+def test_get_scratchpad_crc():
+    header = SCRATCHPAD_TAG + struct.pack(
+        SCRATCHPAD_HEADER_FORMAT, 100, 0x1234, 1, 0, 0, 0
+    )
+    assert get_scratchpad_crc(header + b"\x00" * 10) == 0x1234
+    assert get_scratchpad_crc(header[:-1]) is None
+    assert get_scratchpad_crc(b"\x00" * len(header)) is None
+
+
+def test_persist_and_reload(tmp_path):
+    directory = str(tmp_path)
+    scratchpad = PartialScratchpad.create("sink0", 12, 100, directory)
+    scratchpad.write(0, b"a" * 10)
+    scratchpad.write(50, b"b" * 20)
+    scratchpad.crc = 0x4321
+    scratchpad.save()
+    # Reception is interrupted by a restart
+    scratchpad.file.close()
+
+    resumed = PartialScratchpad.load("sink0", directory, 3600)
+    assert resumed is not None
+    assert resumed.seq == 12
+    assert resumed.total_size == 100
+    assert resumed.crc == 0x4321
+    assert resumed.missing() == [(10, 50), (70, 100)]
+
+    resumed.write(10, b"c" * 40)
+    resumed.write(70, b"d" * 30)
+    assert resumed.is_complete()
+
+    resumed.file.seek(0)
+    assert resumed.file.read() == b"a" * 10 + b"c" * 40 + b"b" * 20 + b"d" * 30
+
+    resumed.close()
+    assert os.listdir(directory) == []
+
+
+def test_load_expired(tmp_path):
+    directory = str(tmp_path)
+    scratchpad = PartialScratchpad.create("sink0", 1, 10, directory)
+    scratchpad.last_update = time.time() - 100
+    scratchpad.save()
+    scratchpad.file.close()
+
+    assert PartialScratchpad.load("sink0", directory, 10) is None
+    assert os.listdir(directory) == []
+
+
+def test_load_invalid_description(tmp_path):
+    directory = str(tmp_path)
+    PartialScratchpad.create("sink0", 1, 10, directory).file.close()
+    with open(os.path.join(directory, "sink0.json"), "w") as f:
+        f.write("{")
+
+    assert PartialScratchpad.load("sink0", directory, 3600) is None
+    assert PartialScratchpad.load("sink1", directory, 3600) is None
+    assert os.listdir(directory) == []
+
+
+def test_purge_expired(tmp_path):
+    directory = str(tmp_path)
+    PartialScratchpad.create("old", 1, 10, directory).file.close()
+    PartialScratchpad.create("new", 1, 10, directory).file.close()
+    tmp_file = os.path.join(directory, "left.tmp")
+    open(tmp_file, "w").close()
+
+    past = time.time() - 100
+    for path in (os.path.join(directory, "old.json"), tmp_file):
+        os.utime(path, (past, past))
+
+    PartialScratchpad.purge_expired(directory, 10)
+    assert sorted(os.listdir(directory)) == ["new.json", "new.scratchpad"]
+
+
+def test_concurrent_saves(tmp_path):
+    directory = str(tmp_path)
+    scratchpad = PartialScratchpad.create("sink0", 1, 1000, directory)
+
+    threads = [threading.Thread(target=scratchpad.save) for _ in range(20)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    with open(os.path.join(directory, "sink0.json")) as f:
+        assert json.load(f)["total_size"] == 1000
+    assert not [name for name in os.listdir(directory) if name.endswith(".tmp")]
+    scratchpad.close()
+
+
+def test_without_directory():
+    scratchpad = PartialScratchpad.create("sink0", 1, 4)
+    scratchpad.write(0, b"ab")
+    assert not scratchpad.is_complete()
+    scratchpad.write(2, b"cd")
+    assert scratchpad.is_complete()
+    assert PartialScratchpad.load("sink0", None, 3600) is None
+    scratchpad.close()
+
+
+def test_key_stays_in_directory(tmp_path):
+    directory = tmp_path / "chunks"
+    directory.mkdir()
+    for key in ("../outside", "all@sink0,sink1", ".."):
+        scratchpad = PartialScratchpad.create(key, 1, 10, str(directory))
+        scratchpad.file.close()
+        resumed = PartialScratchpad.load(key, str(directory), 3600)
+        assert resumed.key == key
+        resumed.file.close()
+
+    assert sorted(os.listdir(str(tmp_path))) == ["chunks"]
+    assert len(os.listdir(str(directory))) == 6
+
+    past = time.time() - 100
+    for name in os.listdir(str(directory)):
+        path = os.path.join(str(directory), name)
+        os.utime(path, (past, past))
+    PartialScratchpad.purge_expired(str(directory), 10)
+    assert os.listdir(str(directory)) == []
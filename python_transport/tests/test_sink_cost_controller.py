@@ -0,0 +1,43 @@
+import pytest
+
+from wirepas_gateway.utils import SinkCostController
+
+
+def test_cost_step_clamped():
+    controller = SinkCostController(
+        10, 100, 0, maximum_cost=200, smoothing=1, max_step=16
+    )
+
+    # Full load targets the maximum cost, reached by steps
+    costs = [controller.update(100, 0, t) for t in range(20)]
+    assert costs[:3] == [26, 42, 58]
+    assert costs[-1] == 200
+    assert all(b - a <= 16 for a, b in zip([10] + costs, costs))
+
+    # Back to an empty queue, cost decreases by steps too
+    assert controller.update(0, 0, 20) == 184
+    assert controller.update(0, 0, 21) == 168
+
+
+def test_cost_within_bounds():
+    controller = SinkCostController(
+        10, 100, 0, maximum_cost=50, smoothing=1, max_step=100
+    )
+    assert controller.update(1000, 0, 0) == 50
+    assert controller.update(0, 0, 1) == 10
+    assert controller.is_settled()
+
+
+def test_waiting_time_load():
+    controller = SinkCostController(
+        0, 0, 10, maximum_cost=100, smoothing=1, max_step=100
+    )
+    assert controller.update(1, 5, 0) == 50
+    assert controller.update(1, 20, 1) == 100
+
+
+def test_wrong_parameters():
+    with pytest.raises(ValueError):
+        SinkCostController(0, 10, 10, smoothing=0)
+    with pytest.raises(ValueError):
+        SinkCostController(0, 10, 10, max_step=0)
@@ -0,0 +1,85 @@
+import pytest
+
+from wirepas_gateway.utils import TimerWheel
+
+
+def test_expiry_order():
+    wheel = TimerWheel(0.25, slots=8, now=0)
+    wheel.add("b", 0.6, "B")
+    wheel.add("a", 0.3, "A")
+    wheel.add("c", 1.1, "C")
+
+    assert wheel.pop_expired(0.25) == []
+    assert wheel.pop_expired(0.5) == [("a", 0.3, "A")]
+    assert wheel.pop_expired(1.25) == [("b", 0.6, "B"), ("c", 1.1, "C")]
+    assert len(wheel) == 0
+
+
+def test_never_expires_early():
+    wheel = TimerWheel(1, slots=8, now=0)
+    wheel.add("a", 2.5, None)
+    assert wheel.pop_expired(2.9) == []
+    assert [key for key, _, _ in wheel.pop_expired(3)] == ["a"]
+
+
+def test_expiry_across_wraps():
+    # 8 slots of 1s: an item 20s ahead shares its slot for 2 turns
+    wheel = TimerWheel(1, slots=8, now=0)
+    wheel.add("far", 20, None)
+    wheel.add("near", 4, None)
+
+    assert [key for key, _, _ in wheel.pop_expired(4)] == ["near"]
+    assert wheel.pop_expired(12) == []
+    assert "far" in wheel
+    assert wheel.pop_expired(19) == []
+    assert [key for key, _, _ in wheel.pop_expired(20)] == ["far"]
+
+
+def test_expiry_after_full_turn():
+    wheel = TimerWheel(1, slots=8, now=0)
+    wheel.add("a", 3, None)
+    wheel.add("b", 30, None)
+    wheel.add("c", 45, None)
+
+    # More than a turn elapsed at once, every slot is checked
+    assert [key for key, _, _ in wheel.pop_expired(31)] == ["a", "b"]
+    assert [key for key, _, _ in wheel.pop_expired(100)] == ["c"]
+
+
+def test_past_deadline():
+    wheel = TimerWheel(1, slots=8, now=10)
+    wheel.add("late", 2, None)
+    assert [key for key, _, _ in wheel.pop_expired(10)] == ["late"]
+
+
+def test_cancel():
+    wheel = TimerWheel(1, slots=8, now=0)
+    wheel.add("a", 5, "A")
+    with pytest.raises(KeyError):
+        wheel.add("a", 6, "A")
+
+    assert wheel.cancel("a") == "A"
+    assert wheel.cancel("a") is None
+    assert wheel.pop_expired(10) == []
+
+
+def test_next_expiration():
+    wheel = TimerWheel(1, slots=8, now=0)
+    assert wheel.next_expiration() is None
+
+    wheel.add("far", 20, None)
+    # Only next turns are planned, check again after the current one
+    assert wheel.next_expiration() == 8
+
+    wheel.add("near", 2.5, None)
+    assert wheel.next_expiration() == 3
+
+    wheel.pop_expired(16)
+    assert wheel.next_expiration() == 20
+
+
+def test_wrong_dimension():
+    with pytest.raises(ValueError):
+        TimerWheel(0)
+    with pytest.raises(ValueError):
+        TimerWheel(1, slots=0)
@@ -0,0 +1,207 @@
+# Copyright 2019 Wirepas Ltd licensed under Apache License, Version 2.0
+#
+# See file LICENSE for full license details.
+
+from concurrent.futures import Future
+
+from gi.repository import Gio, GLib
+
+DBUS_PROPERTIES_IFACE = "org.freedesktop.DBus.Properties"
+
+# Use the default dbus timeout
+DBUS_DEFAULT_TIMEOUT_MS = -1
+
+
+class AsyncProxy:
+    """
+    Issue non blocking calls to the object behind a pydbus proxy
+
+    Each call returns a concurrent.futures.Future, so several calls can be
+    in flight at the same time and their round trips overlap.
+
+    Replies are dispatched by the GLib main loop (cf BusClient.run). If this
+    loop is not running, or if the call is done from the main loop itself
+    where waiting on the future would dead lock, the call is done
+    synchronously and an already completed future is returned.
+    """
+
+    def __init__(self, proxy):
+        self._con = proxy._bus.con
+        self._bus_name = proxy._bus_name
+        self._path = proxy._path
+
+    @staticmethod
+    def _is_main_loop_serving():
+        context = GLib.MainContext.default()
+        if context.acquire():
+            # Nobody else is iterating the main context, or we are the one
+            context.release()
+            return False
+        return True
+
+    def call(self, iface, method, in_sig="()", args=(), out_sig=None, fds=None):
+        """ Call a method
+
+        Args:
+            iface: interface of the method
+            method: name of the method
+            in_sig: signature of the parameters, as a tuple (ie "(uy)")
+            args: parameters of the method
+            out_sig: signature of the returned values, as a tuple
+            fds: file descriptors to pass with the call. A "h" parameter is
+                 the index of its fd in this list. They are duplicated, so
+                 caller keeps the ownership
+
+        Returns: A Future giving the unpacked returned tuple or raising a GLib.Error
+        """
+        future = Future()
+        future.set_running_or_notify_cancel()
+
+        try:
+            parameters = GLib.Variant(in_sig, tuple(args))
+        except (OverflowError, TypeError) as e:
+            future.set_exception(e)
+            return future
+
+        reply_type = GLib.VariantType.new(out_sig) if out_sig is not None else None
+
+        if fds is not None:
+            return self._call_with_fds(
+                future, iface, method, parameters, reply_type, fds
+            )
+
+        if not self._is_main_loop_serving():
+            try:
+                ret = self._con.call_sync(
+                    self._bus_name,
+                    self._path,
+                    iface,
+                    method,
+                    parameters,
+                    reply_type,
+                    0,
+                    DBUS_DEFAULT_TIMEOUT_MS,
+                    None,
+                )
+                future.set_result(ret.unpack())
+            except GLib.Error as e:
+                future.set_exception(e)
+            return future
+
+        def on_reply(con, result, _):
+            try:
+                future.set_result(con.call_finish(result).unpack())
+            except GLib.Error as e:
+                future.set_exception(e)
+
+        self._con.call(
+            self._bus_name,
+            self._path,
+            iface,
+            method,
+            parameters,
+            reply_type,
+            0,
+            DBUS_DEFAULT_TIMEOUT_MS,
+            None,
+            on_reply,
+            None,
+        )
+        return future
+
+    def _call_with_fds(self, future, iface, method, parameters, reply_type, fds):
+        fd_list = Gio.UnixFDList.new()
+        try:
+            for fd in fds:
+                # Appended fd is a duplicate owned by the list
+                fd_list.append(fd)
+        except GLib.Error as e:
+            future.set_exception(e)
+            return future
+
+        if not self._is_main_loop_serving():
+            try:
+                ret, _ = self._con.call_with_unix_fd_list_sync(
+                    self._bus_name,
+                    self._path,
+                    iface,
+                    method,
+                    parameters,
+                    reply_type,
+                    0,
+                    DBUS_DEFAULT_TIMEOUT_MS,
+                    fd_list,
+                    None,
+                )
+                future.set_result(ret.unpack())
+            except GLib.Error as e:
+                future.set_exception(e)
+            return future
+
+        def on_reply(con, result, _):
+            try:
+                ret, _ = con.call_with_unix_fd_list_finish(result)
+                future.set_result(ret.unpack())
+            except GLib.Error as e:
+                future.set_exception(e)
+
+        self._con.call_with_unix_fd_list(
+            self._bus_name,
+            self._path,
+            iface,
+            method,
+            parameters,
+            reply_type,
+            0,
+            DBUS_DEFAULT_TIMEOUT_MS,
+            fd_list,
+            None,
+            on_reply,
+            None,
+        )
+        return future
+
+    def get_property(self, iface, name):
+        """ Read a property
+
+        Returns: A Future giving the property value or raising a GLib.Error
+        """
+        return _chain(
+            self.call(DBUS_PROPERTIES_IFACE, "Get", "(ss)", (iface, name), "(v)"),
+            lambda ret: ret[0],
+        )
+
+    def get_properties(self, iface, names):
+        """ Read several properties at once
+
+        All the reads are in flight at the same time.
+
+        Returns: A dict of property name to Future
+        """
+        return {name: self.get_property(iface, name) for name in names}
+
+
+def completed_future(result=None, exception=None):
+    """ Get a future already completed with a result or an exception """
+    future = Future()
+    future.set_running_or_notify_cancel()
+    if exception is not None:
+        future.set_exception(exception)
+    else:
+        future.set_result(result)
+    return future
+
+
+def _chain(future, transform):
+    """ Get a future of the transformation of another future result """
+    chained = Future()
+    chained.set_running_or_notify_cancel()
+
+    def on_done(done):
+        try:
+            chained.set_result(transform(done.result()))
+        except Exception as e:  # pylint: disable=broad-except
+            chained.set_exception(e)
+
+    future.add_done_callback(on_done)
+    return chained
@@ -6,6 +6,19 @@
 
 #define PY_SSIZE_T_CLEAN
 #include <Python.h>
+#include <errno.h>
+#include <fcntl.h>
+#include <limits.h>
+#include <poll.h>
+#include <pthread.h>
+#include <stdbool.h>
+#include <stdint.h>
+#include <string.h>
+#include <time.h>
+#include <unistd.h>
+#include <sys/eventfd.h>
+#include <sys/mman.h>
+#include <sys/stat.h>
 #include <systemd/sd-bus.h>
 
 /** \brief  Dbus bus instance*/
@@ -14,11 +27,158 @@ static sd_bus * m_bus = NULL;
 /** \brief  Callback set by Python code to be called on message reception */
 static PyObject * m_message_callback = NULL;
 
-/** \brief  Callback called when a packet is received from bus */
-static int on_packet_received(sd_bus_message * m, void * userdata, sd_bus_error * ret_error)
+/**
+ * \brief  Shared memory layout of an uplink ring
+ * \note   Must match sink_service/source/uplink_ring.h
+ */
+#define UPLINK_RING_MAGIC 0x57505552 /* "WPUR" */
+#define UPLINK_RING_VERSION 1
+
+typedef struct
 {
-    PyGILState_STATE gstate;
+    uint32_t magic;
+    uint32_t version;
+    uint64_t size;
+    uint64_t dropped;
+    uint64_t head __attribute__((aligned(64)));
+    uint64_t tail __attribute__((aligned(64)));
+} uplink_ring_header_t;
+
+typedef struct __attribute__((packed))
+{
+    uint64_t timestamp_ms;
+    uint32_t src_addr;
+    uint32_t dst_addr;
+    uint32_t travel_time;
+    uint16_t data_size;
+    uint8_t src_ep;
+    uint8_t dst_ep;
+    uint8_t qos;
+    uint8_t hop_count;
+} uplink_ring_record_t;
+
+/** \brief  Max number of sinks read through a ring */
+#define MAX_UPLINK_RINGS 10
+
+/** \brief  Uplink ring opened on a sink */
+typedef struct
+{
+    /** Well known name of the sink, NULL if slot is free */
+    char * name;
+    /** Unique name of the sink, given as sender to the callback */
+    char * sender;
+    int event_fd;
+    uplink_ring_header_t * header;
+    const uint8_t * data;
+    size_t map_size;
+    /** Dropped packets already reported */
+    uint64_t dropped;
+} uplink_ring_t;
+
+static uplink_ring_t m_rings[MAX_UPLINK_RINGS];
+
+/** \brief  Ring attach or detach request from Python, served by event loop */
+typedef struct ring_request
+{
+    char * name;
+    bool attach;
+    struct ring_request * next;
+} ring_request_t;
+
+static ring_request_t * m_ring_requests = NULL;
+
+/** \brief  Protects ring requests list */
+static pthread_mutex_t m_ring_requests_mutex = PTHREAD_MUTEX_INITIALIZER;
+
+/** \brief  Eventfd to wake up event loop when a ring request is queued */
+static int m_control_fd = -1;
+
+/** \brief  Buffer to read packet bytes from a ring */
+static uint8_t m_ring_buffer[UINT16_MAX];
+
+/**
+ * \brief  Give a received packet to the Python callback
+ * \note   GIL must be held
+ * \return 0 if handled, 1 if callback failed
+ */
+static int call_message_callback(const char * sender,
+                                 uint64_t timestamp_ms,
+                                 uint32_t src_addr,
+                                 uint32_t dst_addr,
+                                 uint8_t src_ep,
+                                 uint8_t dst_ep,
+                                 uint32_t travel_time,
+                                 uint8_t qos,
+                                 uint8_t hop_count,
+                                 const void * bytes_arr,
+                                 size_t size)
+{
+    PyObject * arglist;
+    PyObject * result;
+
+    if (m_message_callback == NULL)
+    {
+        return 0;
+    }
+
+    arglist = Py_BuildValue("(sLIIBBIBBy#)",
+                            sender,
+                            timestamp_ms,
+                            src_addr,
+                            dst_addr,
+                            src_ep,
+                            dst_ep,
+                            travel_time,
+                            qos,
+                            hop_count,
+                            (const char *) bytes_arr,
+                            size);
+
+    if (arglist == NULL)
+    {
+        PyErr_Print();
+        return 1;
+    }
+
+    result = PyObject_Call(m_message_callback, arglist, NULL);
+    Py_DECREF(arglist);
+
+    if (result == NULL)
+    {
+        PyErr_Print();
+        return 1;
+    }
 
+    Py_DECREF(result);
+
+    return 0;
+}
+
+/**
+ * \brief  Check if packets of a sink are read through a ring
+ * \note   Rings are only updated from the event loop, as signals are handled
+ */
+static bool is_read_through_ring(const char * sender)
+{
+    for (size_t i = 0; i < MAX_UPLINK_RINGS; i++)
+    {
+        if (m_rings[i].sender != NULL && strcmp(m_rings[i].sender, sender) == 0)
+        {
+            return true;
+        }
+    }
+    return false;
+}
+
+/**
+ * \brief  Read a packet from a MessageReceived signal or a MessagesReceived item
+ *         and give it to the Python callback
+ * \note   GIL must be held
+ * \return 0 if handled, 1 if callback failed, a negative error if packet
+ *         cannot be read
+ */
+static int handle_packet(sd_bus_message * m, const char * sender)
+{
     int r;
     uint32_t src_addr, dst_addr, travel_time;
     uint8_t qos, src_ep, dst_ep, hop_count;
@@ -52,49 +212,457 @@ static int on_packet_received(sd_bus_message * m, void * userdata, sd_bus_error
         return r;
     }
 
-    /* Call registered callback */
-    if (m_message_callback != NULL)
+    return call_message_callback(sender,
+                                 timestamp_ms,
+                                 src_addr,
+                                 dst_addr,
+                                 src_ep,
+                                 dst_ep,
+                                 travel_time,
+                                 qos,
+                                 hop_count,
+                                 bytes_arr,
+                                 size);
+}
+
+/** \brief  Callback called when a packet is received from bus */
+static int on_packet_received(sd_bus_message * m, void * userdata, sd_bus_error * ret_error)
+{
+    PyGILState_STATE gstate;
+    const char * sender = sd_bus_message_get_sender(m);
+    int r;
+
+    /* Sink still sends signals for other clients, packet is in the ring */
+    if (is_read_through_ring(sender))
+    {
+        return 0;
+    }
+
+    /* Get the GIL. It is needed as wa are dealing with Python objects */
+    gstate = PyGILState_Ensure();
+    r = handle_packet(m, sender);
+    PyGILState_Release(gstate);
+
+    return r > 0 ? -1 : r;
+}
+
+/** \brief  Callback called when a batch of packets is received from bus */
+static int on_packets_received(sd_bus_message * m, void * userdata, sd_bus_error * ret_error)
+{
+    PyGILState_STATE gstate;
+    const char * sender = sd_bus_message_get_sender(m);
+    int r;
+
+    /* Sink still sends signals for other clients, packets are in the ring */
+    if (is_read_through_ring(sender))
+    {
+        return 0;
+    }
+
+    r = sd_bus_message_enter_container(m, 'a', "(tuuyyuyyay)");
+    if (r < 0)
+    {
+        printf("C_extension: Cannot read packets array\n");
+        return r;
+    }
+
+    /* GIL is taken once for the whole batch */
+    gstate = PyGILState_Ensure();
+    while ((r = sd_bus_message_enter_container(m, 'r', "tuuyyuyyay")) > 0)
+    {
+        /* A packet with a failing callback doesn't prevent the next ones */
+        r = handle_packet(m, sender);
+        if (r < 0)
+        {
+            break;
+        }
+
+        r = sd_bus_message_exit_container(m);
+        if (r < 0)
+        {
+            break;
+        }
+    }
+    PyGILState_Release(gstate);
+
+    if (r < 0)
+    {
+        printf("C_extension: Cannot read packets %d\n", r);
+        return r;
+    }
+
+    return sd_bus_message_exit_container(m);
+}
+
+/**
+ * \brief  Copy bytes from ring data area, wrapping at its end
+ */
+static void ring_copy(uplink_ring_t * ring, uint64_t position, void * dst, size_t len)
+{
+    size_t size = ring->header->size;
+    size_t offset = position & (size - 1);
+    size_t first = size - offset;
+
+    if (first > len)
+    {
+        first = len;
+    }
+
+    memcpy(dst, ring->data + offset, first);
+    memcpy((uint8_t *) dst + first, ring->data, len - first);
+}
+
+static void close_ring(uplink_ring_t * ring)
+{
+    if (ring->header != NULL)
+    {
+        munmap(ring->header, ring->map_size);
+        ring->header = NULL;
+    }
+    if (ring->event_fd >= 0)
+    {
+        close(ring->event_fd);
+        ring->event_fd = -1;
+    }
+    free(ring->name);
+    ring->name = NULL;
+    free(ring->sender);
+    ring->sender = NULL;
+}
+
+static uplink_ring_t * find_ring(const char * name)
+{
+    for (size_t i = 0; i < MAX_UPLINK_RINGS; i++)
+    {
+        if (m_rings[i].name != NULL && strcmp(m_rings[i].name, name) == 0)
+        {
+            return &m_rings[i];
+        }
+    }
+    return NULL;
+}
+
+/** \brief  Give all the packets written in a ring to the Python callback */
+static void consume_ring(uplink_ring_t * ring)
+{
+    PyGILState_STATE gstate;
+    uplink_ring_record_t record;
+    uint64_t count, head, tail, dropped;
+
+    if (read(ring->event_fd, &count, sizeof(count)) < 0 && errno != EAGAIN)
+    {
+        printf("C_extension: Cannot read ring event %d\n", errno);
+    }
+
+    dropped = __atomic_load_n(&ring->header->dropped, __ATOMIC_RELAXED);
+    if (dropped != ring->dropped)
+    {
+        printf("C_extension: %llu packets dropped in uplink ring of %s\n",
+               (unsigned long long) (dropped - ring->dropped),
+               ring->name);
+        ring->dropped = dropped;
+    }
+
+    head = __atomic_load_n(&ring->header->head, __ATOMIC_ACQUIRE);
+    tail = __atomic_load_n(&ring->header->tail, __ATOMIC_RELAXED);
+
+    /* GIL is taken once for all the packets available */
+    gstate = PyGILState_Ensure();
+    while (head - tail >= sizeof(record))
+    {
+        ring_copy(ring, tail, &record, sizeof(record));
+        if (head - tail < sizeof(record) + record.data_size)
+        {
+            printf("C_extension: Corrupted uplink ring of %s\n", ring->name);
+            tail = head;
+            break;
+        }
+        ring_copy(ring, tail + sizeof(record), m_ring_buffer, record.data_size);
+        tail += sizeof(record) + record.data_size;
+
+        /* Give room back to the sink before the callback */
+        __atomic_store_n(&ring->header->tail, tail, __ATOMIC_RELEASE);
+
+        call_message_callback(ring->sender,
+                              record.timestamp_ms,
+                              record.src_addr,
+                              record.dst_addr,
+                              record.src_ep,
+                              record.dst_ep,
+                              record.travel_time,
+                              record.qos,
+                              record.hop_count,
+                              m_ring_buffer,
+                              record.data_size);
+    }
+    PyGILState_Release(gstate);
+
+    __atomic_store_n(&ring->header->tail, tail, __ATOMIC_RELEASE);
+}
+
+/** \brief  Called with the answer of an OpenUplinkRing call */
+static int on_ring_opened(sd_bus_message * m, void * userdata, sd_bus_error * ret_error)
+{
+    char * name = userdata;
+    const sd_bus_error * error = sd_bus_message_get_error(m);
+    uplink_ring_t * ring;
+    uplink_ring_header_t * header;
+    struct stat st;
+    int mem_fd, event_fd;
+    int r;
+
+    if (error != NULL)
+    {
+        /* Sink keeps sending signals */
+        printf("C_extension: No uplink ring for %s: %s\n", name, error->message);
+        free(name);
+        return 0;
+    }
+
+    r = sd_bus_message_read(m, "hh", &mem_fd, &event_fd);
+    if (r < 0)
+    {
+        printf("C_extension: Cannot read uplink ring of %s\n", name);
+        free(name);
+        return 0;
+    }
+
+    /* Replace the ring of a restarted sink */
+    ring = find_ring(name);
+    if (ring == NULL)
+    {
+        for (size_t i = 0; i < MAX_UPLINK_RINGS && ring == NULL; i++)
+        {
+            if (m_rings[i].name == NULL)
+            {
+                ring = &m_rings[i];
+            }
+        }
+    }
+    if (ring == NULL)
+    {
+        printf("C_extension: Too many uplink rings for %s\n", name);
+        free(name);
+        return 0;
+    }
+    close_ring(ring);
+
+    if (fstat(mem_fd, &st) < 0 || (size_t) st.st_size < sizeof(uplink_ring_header_t))
     {
-        /* Get the GIL. It is needed as wa are dealing with Python objects */
-        gstate = PyGILState_Ensure();
+        printf("C_extension: Invalid uplink ring of %s\n", name);
+        free(name);
+        return 0;
+    }
 
-        PyObject * arglist;
-        PyObject * result;
+    header = mmap(NULL, st.st_size, PROT_READ | PROT_WRITE, MAP_SHARED, mem_fd, 0);
+    if (header == MAP_FAILED)
+    {
+        printf("C_extension: Cannot map uplink ring of %s %d\n", name, errno);
+        free(name);
+        return 0;
+    }
+
+    if (header->magic != UPLINK_RING_MAGIC || header->version != UPLINK_RING_VERSION
+        || header->size == 0 || (header->size & (header->size - 1)) != 0
+        || header->size > st.st_size - sizeof(uplink_ring_header_t))
+    {
+        printf("C_extension: Unsupported uplink ring of %s\n", name);
+        munmap(header, st.st_size);
+        free(name);
+        return 0;
+    }
+
+    /* Fds are owned by the message */
+    ring->event_fd = fcntl(event_fd, F_DUPFD_CLOEXEC, 3);
+    if (ring->event_fd < 0)
+    {
+        printf("C_extension: Cannot get uplink ring event of %s %d\n", name, errno);
+        munmap(header, st.st_size);
+        free(name);
+        return 0;
+    }
+
+    ring->header = header;
+    ring->data = (const uint8_t *) header + sizeof(uplink_ring_header_t);
+    ring->map_size = st.st_size;
+    ring->dropped = __atomic_load_n(&header->dropped, __ATOMIC_RELAXED);
+    ring->sender = strdup(sd_bus_message_get_sender(m));
+    ring->name = name;
+
+    printf("C_extension: Uplink ring opened for %s\n", name);
+
+    /* Packets may already be there */
+    consume_ring(ring);
+
+    return 0;
+}
+
+/** \brief  Serve the ring requests queued from Python */
+static void serve_ring_requests()
+{
+    ring_request_t * req;
+    uplink_ring_t * ring;
+    uint64_t count;
+    int r;
 
-        arglist = Py_BuildValue("(sLIIBBIBBy#)",
-                                sd_bus_message_get_sender(m),
-                                timestamp_ms,
-                                src_addr,
-                                dst_addr,
-                                src_ep,
-                                dst_ep,
-                                travel_time,
-                                qos,
-                                hop_count,
-                                (const char *) bytes_arr,
-                                size);
+    if (read(m_control_fd, &count, sizeof(count)) < 0 && errno != EAGAIN)
+    {
+        printf("C_extension: Cannot read control event %d\n", errno);
+    }
 
-        if (arglist == NULL)
+    for (;;)
+    {
+        pthread_mutex_lock(&m_ring_requests_mutex);
+        req = m_ring_requests;
+        if (req != NULL)
         {
-            PyErr_Print();
-            PyGILState_Release(gstate);
-            return -1;
+            m_ring_requests = req->next;
         }
+        pthread_mutex_unlock(&m_ring_requests_mutex);
 
-        result = PyObject_Call(m_message_callback, arglist, NULL);
+        if (req == NULL)
+        {
+            break;
+        }
 
-        if (result == NULL)
+        if (req->attach)
+        {
+            /* Name is owned by the call until answered */
+            r = sd_bus_call_method_async(m_bus,
+                                         NULL,
+                                         req->name,
+                                         "/com/wirepas/sink",
+                                         "com.wirepas.sink.data1",
+                                         "OpenUplinkRing",
+                                         on_ring_opened,
+                                         req->name,
+                                         "");
+            if (r < 0)
+            {
+                printf("C_extension: Cannot open uplink ring of %s %d\n", req->name, r);
+                free(req->name);
+            }
+        }
+        else
         {
-            PyErr_Print();
-            Py_DECREF(arglist);
-            PyGILState_Release(gstate);
-            return -1;
+            ring = find_ring(req->name);
+            if (ring != NULL)
+            {
+                close_ring(ring);
+            }
+            free(req->name);
         }
 
-        Py_DECREF(arglist);
-        Py_DECREF(result);
+        free(req);
+    }
+}
+
+static int queue_ring_request(const char * name, bool attach)
+{
+    const uint64_t one = 1;
+    ring_request_t * req;
+    ring_request_t ** it;
+
+    req = malloc(sizeof(ring_request_t));
+    if (req == NULL)
+    {
+        return -ENOMEM;
+    }
+
+    req->name = strdup(name);
+    if (req->name == NULL)
+    {
+        free(req);
+        return -ENOMEM;
+    }
+    req->attach = attach;
+    req->next = NULL;
+
+    /* Keep requests order, a sink may be detached then attached again */
+    pthread_mutex_lock(&m_ring_requests_mutex);
+    for (it = &m_ring_requests; *it != NULL; it = &(*it)->next)
+        ;
+    *it = req;
+    pthread_mutex_unlock(&m_ring_requests_mutex);
 
-        PyGILState_Release(gstate);
+    if (write(m_control_fd, &one, sizeof(one)) < 0)
+    {
+        return -errno;
+    }
+
+    return 0;
+}
+
+/**
+ * \brief  Wait for bus, ring requests or rings events and serve them
+ * \note   Bus messages are processed by the caller
+ */
+static int wait_events()
+{
+    struct pollfd fds[2 + MAX_UPLINK_RINGS];
+    uplink_ring_t * polled[MAX_UPLINK_RINGS];
+    struct timespec now;
+    uint64_t timeout_us, now_us, delay_ms;
+    int timeout_ms = -1;
+    nfds_t n = 0;
+    int r;
+
+    r = sd_bus_get_events(m_bus);
+    if (r < 0)
+    {
+        return r;
+    }
+    fds[n].fd = sd_bus_get_fd(m_bus);
+    fds[n].events = r;
+    n++;
+
+    fds[n].fd = m_control_fd;
+    fds[n].events = POLLIN;
+    n++;
+
+    for (size_t i = 0; i < MAX_UPLINK_RINGS; i++)
+    {
+        if (m_rings[i].header != NULL)
+        {
+            polled[n - 2] = &m_rings[i];
+            fds[n].fd = m_rings[i].event_fd;
+            fds[n].events = POLLIN;
+            n++;
+        }
+    }
+
+    r = sd_bus_get_timeout(m_bus, &timeout_us);
+    if (r < 0)
+    {
+        return r;
+    }
+    if (r > 0 && timeout_us != UINT64_MAX)
+    {
+        /* Timeout is absolute on monotonic clock */
+        clock_gettime(CLOCK_MONOTONIC, &now);
+        now_us = (uint64_t) now.tv_sec * 1000000 + now.tv_nsec / 1000;
+        delay_ms = timeout_us > now_us ? (timeout_us - now_us + 999) / 1000 : 0;
+        timeout_ms = delay_ms > INT_MAX ? INT_MAX : (int) delay_ms;
+    }
+
+    r = poll(fds, n, timeout_ms);
+    if (r < 0)
+    {
+        return errno == EINTR ? 0 : -errno;
+    }
+
+    /* Rings first, as requests may close them */
+    for (nfds_t i = 2; i < n; i++)
+    {
+        if (fds[i].revents & POLLIN)
+        {
+            consume_ring(polled[i - 2]);
+        }
+    }
+
+    if (fds[1].revents & POLLIN)
+    {
+        serve_ring_requests();
     }
 
     return 0;
@@ -125,8 +693,8 @@ static PyObject * infiniteEventsLoop(PyObject * self, PyObject * args)
         if (r > 0)
             continue;
 
-        /* Wait for the next request to process */
-        r = sd_bus_wait(m_bus, (uint64_t) -1);
+        /* Wait for the next request to process or packets in rings */
+        r = wait_events();
         if (r < 0)
         {
             printf("C_extension: Cannot wait %d\n", r);
@@ -168,6 +736,11 @@ static PyObject * setCallback(PyObject * self, PyObject * args)
                          interface='com.wirepas.sink.data1', \
                          member='MessageReceived'";
 
+    /* Create the matching rule to get all MessagesReceived signals */
+    char batch_match_rule[] = "type='signal', \
+                               interface='com.wirepas.sink.data1', \
+                               member='MessagesReceived'";
+
     /* Listen for message signals */
     r = sd_bus_add_match(m_bus, NULL, match_rule, on_packet_received, NULL);
 
@@ -176,15 +749,72 @@ static PyObject * setCallback(PyObject * self, PyObject * args)
         return Py_None;
     }
 
+    /* Listen for batched message signals, sent instead if sink batches them */
+    r = sd_bus_add_match(m_bus, NULL, batch_match_rule, on_packets_received, NULL);
+
+    if (r < 0)
+    {
+        return Py_None;
+    }
+
     return result;
 }
 
+/**
+ * \brief   Function to read packets of a sink through an uplink ring
+ * \note    Sink keeps sending signals if it doesn't support it
+ */
+static PyObject * attachUplinkRing(PyObject * self, PyObject * args)
+{
+    const char * name;
+    int r;
+
+    if (!PyArg_ParseTuple(args, "s:attachUplinkRing", &name))
+    {
+        return NULL;
+    }
+
+    r = queue_ring_request(name, true);
+    if (r < 0)
+    {
+        errno = -r;
+        return PyErr_SetFromErrno(PyExc_OSError);
+    }
+
+    Py_RETURN_NONE;
+}
+
+/**
+ * \brief   Function to release the uplink ring of a sink
+ */
+static PyObject * detachUplinkRing(PyObject * self, PyObject * args)
+{
+    const char * name;
+    int r;
+
+    if (!PyArg_ParseTuple(args, "s:detachUplinkRing", &name))
+    {
+        return NULL;
+    }
+
+    r = queue_ring_request(name, false);
+    if (r < 0)
+    {
+        errno = -r;
+        return PyErr_SetFromErrno(PyExc_OSError);
+    }
+
+    Py_RETURN_NONE;
+}
+
 /**
  * \brief   Interface of our C module
  */
 static PyMethodDef myMethods[] = {
     {"setCallback", setCallback, METH_VARARGS, "Initialize the callback"},
     {"infiniteEventLoop", infiniteEventsLoop, METH_NOARGS, "Infinite Event loop"},
+    {"attachUplinkRing", attachUplinkRing, METH_VARARGS, "Read a sink through an uplink ring"},
+    {"detachUplinkRing", detachUplinkRing, METH_VARARGS, "Release the uplink ring of a sink"},
     {NULL, NULL, 0, NULL}};
 
 /**
@@ -213,5 +843,16 @@ PyMODINIT_FUNC PyInit_dbusCExtension(void)
         return Py_None;
     }
 
+    for (size_t i = 0; i < MAX_UPLINK_RINGS; i++)
+    {
+        m_rings[i].event_fd = -1;
+    }
+
+    m_control_fd = eventfd(0, EFD_NONBLOCK | EFD_CLOEXEC);
+    if (m_control_fd < 0)
+    {
+        return Py_None;
+    }
+
     return PyModule_Create(&dbusCExtension);
 }
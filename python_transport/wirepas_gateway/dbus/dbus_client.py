@@ -7,7 +7,7 @@ from threading import Thread
 from pydbus import SystemBus
 import dbusCExtension
 from gi.repository import GLib, GObject
-from .sink_manager import SinkManager
+from .sink_manager import SinkManager, DBUS_SINK_PREFIX
 
 
 class DbusEventHandler(Thread):
@@ -45,7 +45,7 @@ class BusClient:
     of dbus
     """
 
-    def __init__(self, c_extension=True, ignored_ep_filter=None):
+    def __init__(self, c_extension=True, ignored_ep_filter=None, uplink_ring=False):
 
         # Main loop for events
         self.loop = GLib.MainLoop()
@@ -56,18 +56,28 @@ class BusClient:
         # Manage sink list
         self.sink_manager = SinkManager(
             bus=self.bus,
-            on_new_sink_cb=self.on_sink_connected,
-            on_sink_removal_cb=self.on_sink_disconnected,
+            on_new_sink_cb=self._on_sink_connected,
+            on_sink_removal_cb=self._on_sink_disconnected,
             on_stack_started=self.on_stack_started,
             on_stack_stopped=self.on_stack_stopped,
+            on_config_changed=self.on_sink_config_changed,
         )
 
         self.ignore_ep_filter = ignored_ep_filter
 
+        # Packets are read through shared memory rings instead of signals
+        self.uplink_ring = uplink_ring and c_extension
+        if uplink_ring and not c_extension:
+            logging.warning("Uplink ring is not used without c extension")
+
         # Register for packet on Dbus
         if c_extension:
             logging.info("Starting dbus client with c extension")
             self.c_extension_thread = DbusEventHandler(self._on_data_received_c)
+            if self.uplink_ring:
+                # Sinks already there when sink manager was created
+                for sink in self.sink_manager.get_sinks():
+                    dbusCExtension.attachUplinkRing(DBUS_SINK_PREFIX + sink.sink_id)
         else:
             logging.info("Starting dbus client without c extension")
             # Subscribe to all massages received from any sink (no need for
@@ -77,9 +87,25 @@ class BusClient:
                 object="/com/wirepas/sink",
                 signal_fired=self._on_data_received,
             )
+            # Sent instead of MessageReceived by sinks batching packets
+            self.bus.subscribe(
+                signal="MessagesReceived",
+                object="/com/wirepas/sink",
+                signal_fired=self._on_batch_received,
+            )
 
             self.c_extension_thread = None
 
+    def _on_sink_connected(self, name):
+        if self.uplink_ring:
+            dbusCExtension.attachUplinkRing(DBUS_SINK_PREFIX + name)
+        self.on_sink_connected(name)
+
+    def _on_sink_disconnected(self, name):
+        if self.uplink_ring:
+            dbusCExtension.detachUplinkRing(DBUS_SINK_PREFIX + name)
+        self.on_sink_disconnected(name)
+
     def _on_data_received_c(
         self,
         sender,
@@ -117,6 +143,15 @@ class BusClient:
     def _on_data_received(self, sender, object, iface, signal, params):
         # pylint: disable=unused-argument
         # pylint: disable=redefined-builtin
+        self._handle_packet(sender, params)
+
+    def _on_batch_received(self, sender, object, iface, signal, params):
+        # pylint: disable=unused-argument
+        # pylint: disable=redefined-builtin
+        for packet in params[0]:
+            self._handle_packet(sender, packet)
+
+    def _handle_packet(self, sender, params):
         # filter out endpoint
         if self.ignore_ep_filter is not None and params[4] in self.ignore_ep_filter:
             logging.debug("Message received on ep %s filtered out", params[4])
@@ -195,6 +230,9 @@ class BusClient:
     def on_stack_stopped(self, name):
         pass
 
+    def on_sink_config_changed(self, name):
+        pass
+
     def on_start_client(self):
         pass
 
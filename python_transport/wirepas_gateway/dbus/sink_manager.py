@@ -2,36 +2,142 @@
 #
 # See file LICENSE for full license details.
 
+import functools
 import logging
+import os
+import threading
 import wirepas_mesh_messaging as wmm
+from concurrent.futures import Future, ThreadPoolExecutor, wait
 
 from gi.repository import GLib
+from .async_proxy import AsyncProxy, completed_future, DBUS_PROPERTIES_IFACE
 from .return_code import ReturnCode
 
 
 DBUS_SINK_PREFIX = "com.wirepas.sink."
 
+CONFIG_IFACE = "com.wirepas.sink.config1"
+DATA_IFACE = "com.wirepas.sink.data1"
+OTAP_IFACE = "com.wirepas.sink.otap1"
+
+# Properties read to build the sink config, per interface
+CONFIG_PROPERTIES = [
+    "StackStatus",
+    "NodeAddress",
+    "NodeRole",
+    "NetworkAddress",
+    "NetworkChannel",
+    "ChannelMap",
+    "ACRangeMax",
+    "ACRangeMin",
+    "ACRangeMaxCur",
+    "ACRangeMinCur",
+    "ChRangeMax",
+    "ChRangeMin",
+    "MaxMtu",
+    "HwMagic",
+    "StackProfile",
+    "FirmwareVersion",
+    "AppConfigMaxSize",
+    "AuthenticationKeySet",
+    "CipherKeySet",
+]
+
+# Config properties that are constant until the next stack restart
+STATIC_CONFIG_PROPERTIES = [
+    "ACRangeMax",
+    "ACRangeMin",
+    "ChRangeMax",
+    "ChRangeMin",
+    "MaxMtu",
+    "HwMagic",
+    "StackProfile",
+    "FirmwareVersion",
+    "AppConfigMaxSize",
+]
+
+OTAP_PROPERTIES = [
+    "StoredStatus",
+    "StoredType",
+    "StoredSeq",
+    "StoredCrc",
+    "StoredLen",
+    "ProcessedSeq",
+    "ProcessedCrc",
+    "ProcessedLen",
+    "FirmwareAreaId",
+]
+
+
+def _invalidates_config(method):
+    """ Decorator for Sink methods that may modify the sink config """
+
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        try:
+            return method(self, *args, **kwargs)
+        finally:
+            # Done once the change is applied, so a read in between
+            # cannot be cached as up to date
+            self._invalidate_config()
+
+    return wrapper
+
 
 class Sink:
-    def __init__(self, bus, proxy, sink_id, unique_name, on_stack_started, on_stack_stopped):
+    def __init__(
+        self,
+        bus,
+        proxy,
+        sink_id,
+        unique_name,
+        on_stack_started,
+        on_stack_stopped,
+        on_config_changed=None,
+    ):
 
         self.proxy = proxy
+        self.async_proxy = AsyncProxy(proxy)
         self.sink_id = sink_id
         self.network_address = None
         self.on_stack_started = on_stack_started
         self.on_stack_stopped = on_stack_stopped
+        self.on_config_changed = on_config_changed
         self.bus = bus
         self.unique_name = unique_name
         self._on_started_handle = None
         self._on_stopped_handle = None
+        self._on_properties_changed_handle = None
+        self._on_downlink_level_changed_handle = None
         self._last_config_dict = None
+        # Static property name to value, read once per stack boot
+        self._static_config = {}
+        # Assume sink service can give full config until proven otherwise
+        self._full_config_supported = True
+        # Same for scratchpad upload through a file descriptor
+        self._upload_fd_supported = True
+        # Config cache is only trusted if sink service notifies changes
+        self._properties_changed_supported = False
+        # Incremented each time the sink config may have changed
+        self._config_version = 0
+        # Version of the config when _last_config_dict was read
+        self._cached_config_version = None
+        # Downlink queue state as last signaled by the sink service (only
+        # tracked if it sends level changes)
+        self._downlink_credit = threading.Condition()
+        self._downlink_level_supported = False
+        # Set once a level change is received, so it is not overwritten by
+        # the initial state read after subscribing
+        self._downlink_level_seen = False
+        self._downlink_occupancy = 0
+        self._downlink_limit = 0
 
     def register_for_stack_started(self):
         # Use the subscribe directly to be able to specify the sender
         self._on_started_handle = self.bus.subscribe(
             signal="StackStarted",
             object="/com/wirepas/sink",
-            iface="com.wirepas.sink.config1",
+            iface=CONFIG_IFACE,
             sender=self.unique_name,
             signal_fired=self._on_stack_started,
         )
@@ -45,7 +151,7 @@ class Sink:
         self._on_stopped_handle = self.bus.subscribe(
             signal="StackStopped",
             object="/com/wirepas/sink",
-            iface="com.wirepas.sink.config1",
+            iface=CONFIG_IFACE,
             sender=self.unique_name,
             signal_fired=self._on_stack_stopped,
         )
@@ -54,6 +160,115 @@ class Sink:
         if self._on_stopped_handle is not None:
             self._on_stopped_handle.unsubscribe()
 
+    def register_for_properties_changed(self):
+        # Use the subscribe directly to be able to specify the sender
+        self._on_properties_changed_handle = self.bus.subscribe(
+            signal="PropertiesChanged",
+            object="/com/wirepas/sink",
+            iface=DBUS_PROPERTIES_IFACE,
+            sender=self.unique_name,
+            signal_fired=self._on_properties_changed,
+        )
+
+        # Older sink services do not notify changes, so config cannot be cached
+        try:
+            introspection = self.proxy.Introspect()
+            self._properties_changed_supported = 'value="invalidates"' in introspection
+        except GLib.Error:
+            logging.error("Cannot introspect sink %s", self.sink_id)
+
+        if not self._properties_changed_supported:
+            logging.info(
+                "Sink service of %s doesn't notify config changes", self.sink_id
+            )
+
+    def unregister_from_properties_changed(self):
+        if self._on_properties_changed_handle is not None:
+            self._on_properties_changed_handle.unsubscribe()
+
+    def register_for_downlink_level_changed(self):
+        # Use the subscribe directly to be able to specify the sender
+        self._on_downlink_level_changed_handle = self.bus.subscribe(
+            signal="DownlinkQueueLevelChanged",
+            object="/com/wirepas/sink",
+            iface=DATA_IFACE,
+            sender=self.unique_name,
+            signal_fired=self._on_downlink_level_changed,
+        )
+
+        # Initial state, signal is only sent on changes
+        try:
+            introspection = self.proxy.Introspect()
+            if "DownlinkQueueLevelChanged" not in introspection:
+                logging.info(
+                    "Sink service of %s doesn't notify downlink level", self.sink_id
+                )
+                return
+
+            limit = self.proxy.DownlinkQueueLimit
+            occupancy = self.proxy.DownlinkQueueOccupancy
+            with self._downlink_credit:
+                if not self._downlink_level_seen:
+                    self._downlink_limit = limit
+                    self._downlink_occupancy = occupancy
+                self._downlink_level_supported = True
+                self._downlink_credit.notify_all()
+        except GLib.Error:
+            logging.error("Cannot get downlink level of sink %s", self.sink_id)
+
+    def unregister_from_downlink_level_changed(self):
+        if self._on_downlink_level_changed_handle is not None:
+            self._on_downlink_level_changed_handle.unsubscribe()
+
+        # Nobody should wait for a sink that is gone
+        with self._downlink_credit:
+            self._downlink_level_supported = False
+            self._downlink_level_seen = False
+            self._downlink_credit.notify_all()
+
+    def _invalidate_config(self):
+        self._config_version += 1
+        if self.on_config_changed is not None:
+            self.on_config_changed(self.sink_id)
+
+    def _invalidate_static_config(self):
+        # Sink service reads them again at each stack boot (an otap may
+        # have changed them)
+        self._static_config = {}
+
+    @staticmethod
+    def _update_static_config(static_config, prefetched):
+        # static_config is the cache in use when the reads were issued, so
+        # values read before an invalidation never end up in the new cache
+        for name in STATIC_CONFIG_PROPERTIES:
+            if name in static_config or name not in prefetched:
+                continue
+
+            future = prefetched[name]
+            if future.done() and future.exception() is None:
+                static_config[name] = future.result()
+
+    def wait_downlink_credit(self, timeout_s):
+        """
+        Wait until the sink downlink queue can accept a message
+
+        State is the one notified by the sink service, so no DBus call is
+        done. If the sink service doesn't notify it or doesn't limit its
+        queue, it returns immediately.
+
+        Args:
+            timeout_s: max time to wait
+
+        Returns: True if there is room in the queue, False on timeout
+        """
+        with self._downlink_credit:
+            return self._downlink_credit.wait_for(
+                lambda: not self._downlink_level_supported
+                or self._downlink_limit == 0
+                or self._downlink_occupancy < self._downlink_limit,
+                timeout_s,
+            )
+
     def get_network_address(self, force=False):
         if self.network_address is None or force:
             # Network address is not known or must be updated
@@ -64,7 +279,7 @@ class Sink:
 
         return self.network_address
 
-    def send_data(
+    def send_data_async(
         self,
         dst,
         src_ep,
@@ -75,8 +290,16 @@ class Sink:
         is_unack_csma_ca=False,
         hop_limit=0,
     ):
-        try:
-            res = self.proxy.SendMessage(
+        """
+        Send data without waiting for the sink service answer
+
+        Returns: A Future giving the GatewayResultCode of the request
+        """
+        future = self.async_proxy.call(
+            DATA_IFACE,
+            "SendMessage",
+            "(uyyuybyay)",
+            (
                 # For some reason on some arch, uint32 are not correctly handled
                 dst & 0xFFFFFFFF,
                 src_ep,
@@ -86,37 +309,196 @@ class Sink:
                 is_unack_csma_ca,
                 hop_limit,
                 data,
-            )
-            if res != 0:
-                error = ReturnCode.error_from_dbus_return_code(res)
-                logging.error("Cannot send message %s err=%s", error.name, res)
-                return error
-        except GLib.Error as e:
-            logging.error("Fail to send message: %s", str(e))
-            error = ReturnCode.error_from_dbus_exception(str(e))
-            logging.error("Cannot send message %s", error.name)
-            return error
-        except OverflowError:
-            # It may happens as protobuf has bigger container value
-            logging.error("Invalid range value")
-            return wmm.GatewayResultCode.GW_RES_INVALID_PARAM
+            ),
+            "(u)",
+        )
 
-        return wmm.GatewayResultCode.GW_RES_OK
+        result = Future()
+        result.set_running_or_notify_cancel()
+
+        def on_done(done):
+            try:
+                res = done.result()[0]
+                if res != 0:
+                    error = ReturnCode.error_from_dbus_return_code(res)
+                    logging.error("Cannot send message %s err=%s", error.name, res)
+                    result.set_result(error)
+                    return
+            except GLib.Error as e:
+                logging.error("Fail to send message: %s", str(e))
+                error = ReturnCode.error_from_dbus_exception(str(e))
+                logging.error("Cannot send message %s", error.name)
+                result.set_result(error)
+                return
+            except (OverflowError, TypeError):
+                # It may happens as protobuf has bigger container value
+                logging.error("Invalid range value")
+                result.set_result(wmm.GatewayResultCode.GW_RES_INVALID_PARAM)
+                return
+
+            result.set_result(wmm.GatewayResultCode.GW_RES_OK)
+
+        future.add_done_callback(on_done)
+        return result
+
+    def send_data(
+        self,
+        dst,
+        src_ep,
+        dst_ep,
+        qos,
+        initial_time,
+        data,
+        is_unack_csma_ca=False,
+        hop_limit=0,
+    ):
+        return self.send_data_async(
+            dst,
+            src_ep,
+            dst_ep,
+            qos,
+            initial_time,
+            data,
+            is_unack_csma_ca,
+            hop_limit,
+        ).result()
+
+    def get_downlink_occupancy(self):
+        """
+        Get the occupancy of the sink downlink queue
+
+        State is the one notified by the sink service, so no DBus call is
+        done.
+
+        Returns: Ratio between queued messages and queue limit (0 if the
+                 sink service doesn't limit its queue) or None if the sink
+                 service doesn't notify it
+        """
+        with self._downlink_credit:
+            if not self._downlink_level_supported:
+                return None
+
+            if self._downlink_limit == 0:
+                # Queue occupancy is not limited
+                return 0
+
+            return self._downlink_occupancy / self._downlink_limit
 
     def _on_stack_started(self, sender, object, iface, signal, params):
         # pylint: disable=unused-argument
         # pylint: disable=redefined-builtin
         # Force update of network address in case remote api modify it
         self.get_network_address(True)
+        self._invalidate_static_config()
+        self._invalidate_config()
 
         self.on_stack_started(self.sink_id)
 
     def _on_stack_stopped(self, sender, object, iface, signal, params):
+        self._invalidate_static_config()
+        self._invalidate_config()
         self.on_stack_stopped(self.sink_id)
 
-    def _get_param(self, dic, key, attribute):
+    def _on_downlink_level_changed(self, sender, object, iface, signal, params):
+        # pylint: disable=unused-argument
+        # pylint: disable=redefined-builtin
+        level, occupancy, limit = params
+        logging.debug(
+            "Downlink level of %s is %d (%d/%d)", self.sink_id, level, occupancy, limit
+        )
+        with self._downlink_credit:
+            self._downlink_occupancy = occupancy
+            self._downlink_limit = limit
+            self._downlink_level_supported = True
+            self._downlink_level_seen = True
+            self._downlink_credit.notify_all()
+
+    def _on_properties_changed(self, sender, object, iface, signal, params):
+        # pylint: disable=unused-argument
+        # pylint: disable=redefined-builtin
+        logging.debug(
+            "Properties of %s changed on %s: %s",
+            params[0],
+            self.sink_id,
+            list(params[1].keys()) + list(params[2]),
+        )
+        self._invalidate_config()
+
+    def _get_attribute(self, attribute, prefetched=None):
+        try:
+            return self._static_config[attribute]
+        except KeyError:
+            pass
+
+        # Use the read already in flight if any
+        if prefetched is not None and attribute in prefetched:
+            return prefetched[attribute].result()
+
+        return getattr(self.proxy, attribute)
+
+    def _prefetch_config(self):
+        # Issue all the reads at once so their round trips overlap
+        static_config = self._static_config
+        prefetched = self.async_proxy.get_properties(
+            CONFIG_IFACE,
+            [name for name in CONFIG_PROPERTIES if name not in static_config],
+        )
+        prefetched.update(
+            self.async_proxy.get_properties(OTAP_IFACE, OTAP_PROPERTIES)
+        )
+        prefetched["GetAppConfig"] = self.async_proxy.call(
+            CONFIG_IFACE, "GetAppConfig", out_sig="(yqay)"
+        )
+        prefetched["GetConfigDataContent"] = self.async_proxy.call(
+            CONFIG_IFACE, "GetConfigDataContent", out_sig="(a(qay))"
+        )
+        return prefetched
+
+    def _get_full_config(self):
+        """
+        Get all the config values in a single call to the sink service
+
+        Returns: A dict of value name to completed Future (same format as
+                 _prefetch_config) or None if it cannot be read this way
+        """
+        if not self._full_config_supported:
+            return None
+
         try:
-            dic[key] = getattr(self.proxy, attribute)
+            (values,) = self.async_proxy.call(
+                CONFIG_IFACE, "GetFullConfig", out_sig="(a{sv})"
+            ).result()
+        except GLib.Error as e:
+            if "UnknownMethod" in str(e):
+                logging.info("Sink service of %s has no GetFullConfig", self.sink_id)
+                self._full_config_supported = False
+            else:
+                logging.error("Cannot get full config: %s", str(e))
+            return None
+
+        def value_future(name, transform=lambda v: v):
+            try:
+                return completed_future(transform(values[name]))
+            except KeyError:
+                # Value couldn't be read by sink service
+                return completed_future(
+                    exception=GLib.Error("{} not available".format(name))
+                )
+
+        prefetched = {}
+        for name in CONFIG_PROPERTIES + OTAP_PROPERTIES:
+            prefetched[name] = value_future(name)
+        prefetched["GetAppConfig"] = value_future("AppConfig")
+        prefetched["GetTargetScratchpad"] = value_future("TargetScratchpad")
+        # Content is not given if not supported by node, same as empty
+        prefetched["GetConfigDataContent"] = completed_future(
+            (values.get("ConfigDataContent", []),)
+        )
+        return prefetched
+
+    def _get_param(self, dic, key, attribute, prefetched=None):
+        try:
+            dic[key] = self._get_attribute(attribute, prefetched)
         except  GLib.Error:
             if key != "channel_map":
                 # Warning and not an error as normal behavior if not set
@@ -125,11 +507,11 @@ class Sink:
         except AttributeError :
             logging.warning("Attribute %s doesn't exist", key)
 
-    def _get_pair_params(self, dic, key1, att1, key2, att2):
+    def _get_pair_params(self, dic, key1, att1, key2, att2, prefetched=None):
         # Some settings are only relevant if the both can be retrieved
         try:
-            att1_val = getattr(self.proxy, att1)
-            att2_val = getattr(self.proxy, att2)
+            att1_val = self._get_attribute(att1, prefetched)
+            att2_val = self._get_attribute(att2, prefetched)
         except GLib.Error:
             logging.debug("Cannot get one of the pair value (%s-%s)", key1, key2)
             return
@@ -138,42 +520,63 @@ class Sink:
         dic[key2] = att2_val
 
     def read_config(self):
+        # Taken before the reads so a change during them is not missed
+        version = self._config_version
+        if (
+            self._properties_changed_supported
+            and self._cached_config_version == version
+            and self._last_config_dict is not None
+        ):
+            # Nothing changed since last read
+            return self._last_config_dict.copy(), False
+
         config = {}
         config["sink_id"] = self.sink_id
         partial = False
 
+        static_config = self._static_config
+        p = self._get_full_config()
+        if p is None:
+            p = self._prefetch_config()
+
         # Should always be available
         try:
-            config["started"] = (self.proxy.StackStatus & 0x01) == 0
+            config["started"] = (self._get_attribute("StackStatus", p) & 0x01) == 0
         except GLib.Error as e:
             error = ReturnCode.error_from_dbus_exception(str(e))
             logging.error("Cannot get Stack state: %s", error.name)
 
-        self._get_param(config, "node_address", "NodeAddress")
-        self._get_param(config, "node_role", "NodeRole")
-        self._get_param(config, "network_address", "NetworkAddress")
-        self._get_param(config, "network_channel", "NetworkChannel")
-        self._get_param(config, "channel_map", "ChannelMap")
-        self._get_pair_params(config, "max_ac", "ACRangeMax", "min_ac", "ACRangeMin")
+        self._get_param(config, "node_address", "NodeAddress", p)
+        self._get_param(config, "node_role", "NodeRole", p)
+        self._get_param(config, "network_address", "NetworkAddress", p)
+        self._get_param(config, "network_channel", "NetworkChannel", p)
+        self._get_param(config, "channel_map", "ChannelMap", p)
         self._get_pair_params(
-            config, "max_ac_cur", "ACRangeMaxCur", "min_ac_cur", "ACRangeMinCur"
+            config, "max_ac", "ACRangeMax", "min_ac", "ACRangeMin", p
         )
-        self._get_pair_params(config, "max_ch", "ChRangeMax", "min_ch", "ChRangeMin")
-        self._get_param(config, "max_mtu", "MaxMtu")
-        self._get_param(config, "hw_magic", "HwMagic")
-        self._get_param(config, "stack_profile", "StackProfile")
-        self._get_param(config, "firmware_version", "FirmwareVersion")
-        self._get_param(config, "app_config_max_size", "AppConfigMaxSize")
+        self._get_pair_params(
+            config, "max_ac_cur", "ACRangeMaxCur", "min_ac_cur", "ACRangeMinCur", p
+        )
+        self._get_pair_params(
+            config, "max_ch", "ChRangeMax", "min_ch", "ChRangeMin", p
+        )
+        self._get_param(config, "max_mtu", "MaxMtu", p)
+        self._get_param(config, "hw_magic", "HwMagic", p)
+        self._get_param(config, "stack_profile", "StackProfile", p)
+        self._get_param(config, "firmware_version", "FirmwareVersion", p)
+        self._get_param(config, "app_config_max_size", "AppConfigMaxSize", p)
 
         try:
-            are_keys_set = self.proxy.AuthenticationKeySet and self.proxy.CipherKeySet
+            are_keys_set = self._get_attribute(
+                "AuthenticationKeySet", p
+            ) and self._get_attribute("CipherKeySet", p)
 
             config["are_keys_set"] = are_keys_set
         except GLib.Error:
             logging.error("Cannot get key status")
 
         try:
-            seq, diag, data = self.proxy.GetAppConfig()
+            seq, diag, data = p["GetAppConfig"].result()
             config["app_config_seq"] = seq
             config["app_config_diag"] = diag
             config["app_config_data"] = bytearray(data)
@@ -183,10 +586,12 @@ class Sink:
             logging.warning("Cannot get App Config")
 
         # Get config data items
-        config["configuration_data_content"] = self._get_configuration_data_content()
+        config["configuration_data_content"] = self._get_configuration_data_content(p)
 
         # Add scratchpad related info
-        self.get_scratchpad_status(config)
+        self.get_scratchpad_status(config, p)
+
+        self._update_static_config(static_config, p)
 
         if self._last_config_dict is not None:
             for key, value in self._last_config_dict.items():
@@ -196,13 +601,66 @@ class Sink:
                     partial = True
 
         self._last_config_dict = config.copy()
+        # Values taken from cache must be read again next time
+        self._cached_config_version = None if partial else version
 
         return config, partial
 
-    def _get_configuration_data_content(self):
+    def get_cached_config(self):
+        """
+        Get the config of the last read_config without reading the sink
+
+        Returns: The config dict or None if never read
+        """
+        last_config = self._last_config_dict
+        if last_config is None:
+            return None
+
+        return last_config.copy()
+
+    def get_statistics_async(self):
+        """
+        Request the traffic counters of the sink service without waiting
+
+        Returns: A Future giving a dict of counter name to value or None if
+                 they cannot be read
+        """
+        statistics = Future()
+        statistics.set_running_or_notify_cancel()
+
+        def on_done(call):
+            try:
+                (result,) = call.result()
+            except GLib.Error as e:
+                if "UnknownMethod" in str(e):
+                    logging.debug(
+                        "Sink service of %s has no statistics", self.sink_id
+                    )
+                else:
+                    logging.error("Cannot get statistics: %s", str(e))
+                result = None
+            statistics.set_result(result)
+
+        self.async_proxy.call(
+            DATA_IFACE, "GetStatistics", out_sig="(a{sv})"
+        ).add_done_callback(on_done)
+        return statistics
+
+    def get_statistics(self):
+        """
+        Get the traffic counters of the sink service
+
+        Returns: A dict of counter name to value or None if they cannot be read
+        """
+        return self.get_statistics_async().result()
+
+    def _get_configuration_data_content(self, prefetched=None):
         cdc_items = []
         try:
-            cdc_items = self.proxy.GetConfigDataContent()
+            if prefetched is not None and "GetConfigDataContent" in prefetched:
+                (cdc_items,) = prefetched["GetConfigDataContent"].result()
+            else:
+                cdc_items = self.proxy.GetConfigDataContent()
         except GLib.Error:
             logging.error("Cannot get config data content")
 
@@ -304,6 +762,7 @@ class Sink:
 
         return wmm.GatewayResultCode.GW_RES_OK
 
+    @_invalidates_config
     def write_config(self, config):
         # Force the node address if used
         try:
@@ -428,7 +887,7 @@ class Sink:
             else:
                 logging.error("Cannot set sink cost for sink {} ({})".format(self.sink_id, res))
 
-    def get_scratchpad_status(self, out_d=None):
+    def get_scratchpad_status(self, out_d=None, prefetched=None):
         if out_d is None:
             d = {}
         else:
@@ -442,7 +901,7 @@ class Sink:
             ]
         )
         try:
-            status = self.proxy.StoredStatus
+            status = self._get_attribute("StoredStatus", prefetched)
             d["stored_status"] = dbus_to_gateway_satus[status]
         except GLib.Error:
             # Exception raised when getting attribute (probably not set)
@@ -460,31 +919,31 @@ class Sink:
             ]
         )
         try:
-            stored_type = self.proxy.StoredType
+            stored_type = self._get_attribute("StoredType", prefetched)
             d["stored_type"] = dbus_to_gateway_type[stored_type]
         except GLib.Error:
             # Exception raised when getting attribute (probably not set)
             logging.error("Cannot get stored type in config")
 
         stored = {}
-        self._get_param(stored, "seq", "StoredSeq")
-        self._get_param(stored, "crc", "StoredCrc")
-        self._get_param(stored, "len", "StoredLen")
+        self._get_param(stored, "seq", "StoredSeq", prefetched)
+        self._get_param(stored, "crc", "StoredCrc", prefetched)
+        self._get_param(stored, "len", "StoredLen", prefetched)
         if stored:
             d["stored_scratchpad"] = stored
 
         processed = {}
-        self._get_param(processed, "seq", "ProcessedSeq")
-        self._get_param(processed, "crc", "ProcessedCrc")
-        self._get_param(processed, "len", "ProcessedLen")
+        self._get_param(processed, "seq", "ProcessedSeq", prefetched)
+        self._get_param(processed, "crc", "ProcessedCrc", prefetched)
+        self._get_param(processed, "len", "ProcessedLen", prefetched)
         if processed:
             d["processed_scratchpad"] = processed
 
-        self._get_param(d, "firmware_area_id", "FirmwareAreaId")
+        self._get_param(d, "firmware_area_id", "FirmwareAreaId", prefetched)
 
         read_target_scratchpad = False
         try:
-            stack_version = self.proxy.FirmwareVersion
+            stack_version = self._get_attribute("FirmwareVersion", prefetched)
             # Read Target only if firmware is greater than 5.1
             read_target_scratchpad = stack_version[0] > 5 or (stack_version[0] == 5 and stack_version[1] > 0)
         except GLib.Error:
@@ -493,7 +952,10 @@ class Sink:
         if read_target_scratchpad:
             # Target scratchpad should be supported (except if dualmcu is too old)
             try:
-                seq, crc, action, param = self.proxy.GetTargetScratchpad()
+                if prefetched is not None and "GetTargetScratchpad" in prefetched:
+                    seq, crc, action, param = prefetched["GetTargetScratchpad"].result()
+                else:
+                    seq, crc, action, param = self.proxy.GetTargetScratchpad()
                 target_and_action = {}
                 target_and_action["action"] = wmm.ScratchpadAction(
                     action + 1
@@ -527,6 +989,7 @@ class Sink:
 
         return d
 
+    @_invalidates_config
     def process_scratchpad(self):
         ret = wmm.GatewayResultCode.GW_RES_OK
         restart = False
@@ -554,6 +1017,7 @@ class Sink:
 
         return ret
 
+    @_invalidates_config
     def upload_scratchpad(self, seq, file):
         ret = wmm.GatewayResultCode.GW_RES_OK
         restart = False
@@ -589,6 +1053,108 @@ class Sink:
 
         return ret
 
+    def is_scratchpad_stored(self, seq, crc, length):
+        """
+        Check if a scratchpad is already stored on the sink
+
+        Args:
+            seq: sequence the scratchpad is uploaded with
+            crc: crc of the scratchpad (None if unknown)
+            length: size of the scratchpad
+
+        Returns: True if the stored scratchpad has the same seq, crc and length
+        """
+        if crc is None:
+            return False
+
+        # Values are kept by sink service, reading them doesn't reach the node
+        stored = self.async_proxy.get_properties(
+            OTAP_IFACE, ["StoredSeq", "StoredCrc", "StoredLen"]
+        )
+        try:
+            return (
+                stored["StoredSeq"].result() == seq
+                and stored["StoredCrc"].result() == crc
+                and stored["StoredLen"].result() == length
+            )
+        except GLib.Error:
+            logging.debug("Cannot get stored scratchpad of %s", self.sink_id)
+            return False
+
+    def _upload_scratchpad_file(self, seq, file):
+        if self._upload_fd_supported:
+            try:
+                self.async_proxy.call(
+                    OTAP_IFACE,
+                    "UploadScratchpadFd",
+                    "(yh)",
+                    (seq, 0),
+                    "()",
+                    fds=[file.fileno()],
+                ).result()
+                return
+            except GLib.Error as e:
+                if "UnknownMethod" not in str(e):
+                    raise
+                logging.info(
+                    "Sink service of %s has no UploadScratchpadFd", self.sink_id
+                )
+                self._upload_fd_supported = False
+
+        # Older sink service, scratchpad must be given in the call.
+        # File position is not used as file may be shared between sinks
+        fd = file.fileno()
+        self.proxy.UploadScratchpad(seq, os.pread(fd, os.fstat(fd).st_size, 0))
+
+    @_invalidates_config
+    def upload_scratchpad_file(self, seq, file):
+        """
+        Upload a scratchpad stored in a file
+
+        The file descriptor is given to the sink service that reads it, so
+        scratchpad is neither copied in a DBus message nor read in memory
+        (except with sink services not supporting it).
+
+        Args:
+            seq: sequence of the scratchpad
+            file: a file object opened in binary mode with the scratchpad
+                  from its beginning to its end
+        """
+        ret = wmm.GatewayResultCode.GW_RES_OK
+        restart = False
+        try:
+            # Stop the stack if not already stopped
+            if self.proxy.StackStatus == 0:
+                self.proxy.SetStackState(False)
+                restart = True
+        except GLib.Error:
+            logging.error("Sink in invalid state")
+            return wmm.GatewayResultCode.GW_RES_INVALID_SINK_STATE
+
+        try:
+            self._upload_scratchpad_file(seq, file)
+            logging.info(
+                "Scratchpad loaded with seq %d on sink %s", seq, self.sink_id
+            )
+        except GLib.Error as e:
+            ret = ReturnCode.error_from_dbus_exception(str(e))
+            logging.error("Cannot upload local scratchpad: %s", ret.name)
+        except (OverflowError, TypeError):
+            # It may happens as protobuf has bigger container value
+            ret = wmm.GatewayResultCode.GW_RES_INVALID_PARAM
+            logging.error("Invalid range value")
+
+        if restart:
+            try:
+                # Restart sink if we stopped it for this request
+                self.proxy.SetStackState(True)
+            except GLib.Error as e:
+                ret = ReturnCode.error_from_dbus_exception(str(e))
+                logging.error("Could not restore sink's state: %s", ret.name)
+
+        return ret
+
+    @_invalidates_config
     def clear_local_scratchpad(self):
         ret = wmm.GatewayResultCode.GW_RES_OK
         restart = False
@@ -618,6 +1184,7 @@ class Sink:
 
         return ret
 
+    @_invalidates_config
     def set_target_scratchpad(self, action, target_seq, target_crc, param):
         ret = wmm.GatewayResultCode.GW_RES_OK
 
@@ -676,6 +1243,7 @@ class Sink:
 
         return ret
 
+    @_invalidates_config
     def set_configuration_data_item(self, endpoint, payload):
         try:
             self.proxy.SetConfigDataItem(endpoint, payload)
@@ -715,8 +1283,17 @@ class Sink:
 class SinkManager:
     "Helper class to manage the Sink list"
 
+    # Maximum number of sink configs read at the same time
+    MAX_PARALLEL_CONFIG_READS = 8
+
     def __init__(
-        self, bus, on_new_sink_cb, on_sink_removal_cb, on_stack_started, on_stack_stopped
+        self,
+        bus,
+        on_new_sink_cb,
+        on_sink_removal_cb,
+        on_stack_started,
+        on_stack_stopped,
+        on_config_changed=None,
     ):
 
         self.sinks = {}
@@ -728,6 +1305,12 @@ class SinkManager:
         self.rm_cb = None
         self.stack_started_cb = on_stack_started
         self.stack_stopped_cb = on_stack_stopped
+        self.config_changed_cb = on_config_changed
+
+        self._config_reader = ThreadPoolExecutor(
+            max_workers=self.MAX_PARALLEL_CONFIG_READS,
+            thread_name_prefix="ConfigReader",
+        )
 
         bus_monitor = self.bus.get("org.freedesktop.DBus")
 
@@ -766,10 +1349,13 @@ class SinkManager:
             unique_name=unique_name,
             on_stack_started=self.stack_started_cb,
             on_stack_stopped=self.stack_stopped_cb,
+            on_config_changed=self.config_changed_cb,
         )
 
         sink.register_for_stack_started()
         sink.register_for_stack_stopped()
+        sink.register_for_properties_changed()
+        sink.register_for_downlink_level_changed()
 
         self.sinks[short_name] = sink
 
@@ -785,6 +1371,8 @@ class SinkManager:
             sink = self.sinks.pop(short_name)
             sink.unregister_from_stack_started()
             sink.unregister_from_stack_stopped()
+            sink.unregister_from_properties_changed()
+            sink.unregister_from_downlink_level_changed()
 
             # Remove Sink to association list
             for k, v in self.sender_to_name.items():
@@ -842,3 +1430,70 @@ class SinkManager:
         except KeyError:
             logging.error("Unknown sink %s from sink list", short_name)
             return None
+
+    def read_configs(self, timeout_s=None):
+        """
+        Read the config of all the sinks at the same time
+
+        Args:
+            timeout_s: maximum time to wait for the configs, None to wait
+                       until all are read
+
+        Returns: A tuple (configs, partial) with configs a dict of sink id
+                 to config. A sink not read in time is given with its last
+                 read config (if any) and partial is set.
+        """
+        reads = {
+            sink: self._config_reader.submit(sink.read_config)
+            for sink in self.get_sinks()
+        }
+        wait(reads.values(), timeout=timeout_s)
+
+        configs = {}
+        partial = False
+        for sink, read in reads.items():
+            if read.done():
+                try:
+                    config, config_partial = read.result()
+                except Exception:
+                    logging.exception("Cannot read config of sink %s", sink.sink_id)
+                    config, config_partial = sink.get_cached_config(), True
+            else:
+                logging.warning(
+                    "Config of sink %s not read in %ss, use last one",
+                    sink.sink_id,
+                    timeout_s,
+                )
+                config, config_partial = sink.get_cached_config(), True
+
+            partial |= config_partial
+            if config is not None:
+                configs[sink.sink_id] = config
+
+        return configs, partial
+
+    def get_least_loaded_sink(self, network_address):
+        """
+        Get the sink of a network with the lowest downlink occupancy
+
+        Args:
+            network_address: network address the sink must be part of
+
+        Returns: The selected sink or None if no sink is part of this network
+        """
+        selected_sink = None
+        selected_occupancy = None
+        for sink in self.get_sinks():
+            if sink.get_network_address() != network_address:
+                continue
+
+            occupancy = sink.get_downlink_occupancy()
+            if occupancy is None:
+                # Unknown occupancy, only use it if no other choice
+                occupancy = float("inf")
+
+            if selected_sink is None or occupancy < selected_occupancy:
+                selected_sink = sink
+                selected_occupancy = occupancy
+
+        return selected_sink
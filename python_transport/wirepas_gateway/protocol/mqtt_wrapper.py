@@ -312,6 +312,17 @@ class MQTTWrapper(Thread):
     def publish_waiting_time_s(self):
         return self._publish_monitor.get_publish_waiting_time_s()
 
+    def set_publish_threshold_listener(self, max_size, cb):
+        """
+        Be notified when the publish queue crosses a threshold
+
+        Args:
+            max_size: queue size to be notified when going over it (None to
+                      only be notified when queue becomes empty or not)
+            cb: callback without parameter, called from the publishing threads
+        """
+        self._publish_monitor.set_threshold_listener(max_size, cb)
+
 
 class SelectableQueue(queue.LifoQueue):
     """
@@ -448,6 +459,18 @@ class PublishMonitor:
         self._lock = Lock()
         self._size = 0
         self._last_publish_event_timestamp = 0  # valid if size != 0
+        self._max_size = None
+        self._on_threshold_crossed_cb = None
+
+    def set_threshold_listener(self, max_size, cb):
+        """
+        Set a callback called when the queue goes over max_size,
+        becomes empty or stops being empty.
+        Callback is called without the lock held.
+        """
+        with self._lock:
+            self._max_size = max_size
+            self._on_threshold_crossed_cb = cb
 
     def get_publish_queue_size(self):
         with self._lock:
@@ -466,8 +489,18 @@ class PublishMonitor:
             if self._size == 0:
                 self._last_publish_event_timestamp = datetime.now()
             self._size = self._size + 1
+            crossed = self._size == 1 or self._size - 1 == self._max_size
+            cb = self._on_threshold_crossed_cb
+
+        if crossed and cb is not None:
+            cb()
 
     def on_publish_done(self):
         with self._lock:
             self._size = self._size - 1
             self._last_publish_event_timestamp = datetime.now()
+            crossed = self._size == 0
+            cb = self._on_threshold_crossed_cb
+
+        if crossed and cb is not None:
+            cb()
@@ -6,6 +6,12 @@ BASE_GW_EVENT = "gw-event"
 BASE_REQUEST = "gw-request"
 BASE_RESPONSE = "gw-response"
 
+# Sink id prefix to let the gateway select the sink of a given network
+ANY_SINK_ID_PREFIX = "any@"
+
+# Sink id prefix to address all the sinks, or a comma separated list of sinks
+ALL_SINKS_ID_PREFIX = "all@"
+
 
 class TopicGenerator:
     """
@@ -40,12 +46,40 @@ class TopicGenerator:
             "set_config", [str(gw_id), str(sink_id)]
         )
 
+    @staticmethod
+    def make_any_sink_id(network_address):
+        return ANY_SINK_ID_PREFIX + str(network_address)
+
+    @staticmethod
+    def make_all_sinks_id(sink_ids=None):
+        return ALL_SINKS_ID_PREFIX + ",".join(sink_ids or [])
+
     @staticmethod
     def make_send_data_request_topic(gw_id="+", sink_id="+"):
         return TopicGenerator._make_request_topic(
             "send_data", [str(gw_id), str(sink_id)]
         )
 
+    @staticmethod
+    def make_scheduled_send_data_request_topic(
+        gw_id="+", sink_id="+", send_at_ms_epoch="+"
+    ):
+        return TopicGenerator._make_request_topic(
+            "send_data", [str(gw_id), str(sink_id), str(send_at_ms_epoch)]
+        )
+
+    @staticmethod
+    def make_cancel_send_data_request_topic(gw_id="+", sink_id="+", req_id="+"):
+        return TopicGenerator._make_request_topic(
+            "cancel_send_data", [str(gw_id), str(sink_id), str(req_id)]
+        )
+
+    @staticmethod
+    def make_get_scheduled_send_data_request_topic(gw_id="+"):
+        return TopicGenerator._make_request_topic(
+            "get_scheduled_send_data", [str(gw_id)]
+        )
+
     @staticmethod
     def make_otap_status_request_topic(gw_id="+", sink_id="+"):
         return TopicGenerator._make_request_topic(
@@ -109,6 +143,18 @@ class TopicGenerator:
             "send_data", [str(gw_id), str(sink_id)]
         )
 
+    @staticmethod
+    def make_cancel_send_data_response_topic(gw_id, sink_id):
+        return TopicGenerator._make_response_topic(
+            "cancel_send_data", [str(gw_id), str(sink_id)]
+        )
+
+    @staticmethod
+    def make_get_scheduled_send_data_response_topic(gw_id):
+        return TopicGenerator._make_response_topic(
+            "get_scheduled_send_data", [str(gw_id)]
+        )
+
     @staticmethod
     def make_otap_status_response_topic(gw_id="+", sink_id="+"):
         return TopicGenerator._make_response_topic(
@@ -161,6 +207,16 @@ class TopicGenerator:
     def make_status_topic(gw_id="+"):
         return TopicGenerator._make_event_topic("status", [str(gw_id)])
 
+    @staticmethod
+    def make_otap_missing_chunks_topic(gw_id="+", sink_id="+"):
+        return TopicGenerator._make_event_topic(
+            "otap_missing_chunks", [str(gw_id), str(sink_id)]
+        )
+
+    @staticmethod
+    def make_statistics_topic(gw_id="+"):
+        return TopicGenerator._make_event_topic("statistics", [str(gw_id)])
+
     @staticmethod
     def make_received_data_topic(
         gw_id="+", sink_id="+", network_id="+", src_ep="+", dst_ep="+"
@@ -185,3 +241,63 @@ class TopicParser:
             raise RuntimeError("Wrong topic for send_data_request")
 
         return gw_id, sink_id
+
+    @staticmethod
+    def parse_scheduled_send_data_topic(topic):
+        _, cmd, gw_id, sink_id, send_at_ms_epoch = topic.split("/")
+        if not cmd.startswith("send_data"):
+            raise RuntimeError("Wrong topic for scheduled send_data_request")
+
+        try:
+            send_at_ms_epoch = int(send_at_ms_epoch)
+        except ValueError:
+            raise RuntimeError("Wrong send time for scheduled send_data_request")
+
+        return gw_id, sink_id, send_at_ms_epoch
+
+    @staticmethod
+    def parse_cancel_send_data_topic(topic):
+        _, cmd, gw_id, sink_id, req_id = topic.split("/")
+        if not cmd.startswith("cancel_send_data"):
+            raise RuntimeError("Wrong topic for cancel_send_data_request")
+
+        try:
+            req_id = int(req_id)
+        except ValueError:
+            raise RuntimeError("Wrong req_id for cancel_send_data_request")
+
+        return gw_id, sink_id, req_id
+
+    @staticmethod
+    def parse_any_sink_id(sink_id):
+        """
+        Get the network address targeted by an "any sink" id
+
+        Returns: The network address or None if sink_id is a regular sink id
+        """
+        if not sink_id.startswith(ANY_SINK_ID_PREFIX):
+            return None
+
+        try:
+            return int(sink_id[len(ANY_SINK_ID_PREFIX) :], 0)
+        except ValueError:
+            raise RuntimeError("Wrong network address in sink id {}".format(sink_id))
+
+    @staticmethod
+    def parse_all_sinks_id(sink_id):
+        """
+        Get the sinks targeted by an "all sinks" id
+
+        Returns: None if sink_id is a regular sink id, an empty list if all
+                 sinks are targeted or the list of targeted sink ids, each
+                 one only once
+        """
+        if not sink_id.startswith(ALL_SINKS_ID_PREFIX):
+            return None
+
+        sink_ids = sink_id[len(ALL_SINKS_ID_PREFIX) :]
+        if not sink_ids:
+            return []
+
+        # Keep the order given by the backend
+        return list(dict.fromkeys(sink_ids.split(",")))
@@ -2,19 +2,31 @@
 #
 # See file LICENSE for full license details.
 #
+import json
 import logging
 import os
 import sys
+import tempfile
 import wirepas_mesh_messaging as wmm
-from time import time, sleep
+from time import time, sleep, monotonic
 from uuid import getnode
-from threading import Thread, Event
+from concurrent.futures import ThreadPoolExecutor, wait
+from contextlib import contextmanager, ExitStack
+from threading import Thread, Event, Lock
 from copy import deepcopy
 
 from wirepas_gateway.dbus.dbus_client import BusClient
 from wirepas_gateway.protocol.topic_helper import TopicGenerator, TopicParser
 from wirepas_gateway.protocol.mqtt_wrapper import MQTTWrapper
-from wirepas_gateway.utils import ParserHelper
+from wirepas_gateway.utils import (
+    ParserHelper,
+    TimerWheel,
+    ExpiringCache,
+    SinkCostController,
+    PartialScratchpad,
+    get_scratchpad_crc,
+    SCRATCHPAD_HEADER_END,
+)
 
 from wirepas_gateway import __version__ as transport_version
 from wirepas_gateway import __pkg_name__
@@ -28,15 +40,21 @@ class ConnectionToBackendMonitorThread(Thread):
     # Maximum cost to disable traffic
     SINK_COST_HIGH = 254
 
+    # Margin added to the publish deadline to be sure it is over when checked
+    DEADLINE_MARGIN_S = 0.01
+
+    # Period to update the sink cost while it is controlled
+    COST_CONTROL_PERIOD_S = 1
+
     def __init__(
         self,
-        period,
         mqtt_wrapper,
         sink_manager,
         minimum_sink_cost,
         max_buffered_packets,
         max_delay_without_publish,
-        stop_stack = False
+        stop_stack = False,
+        cost_controller=None,
     ):
         """
         Thread monitoring the connection with the MQTT broker.
@@ -46,8 +64,11 @@ class ConnectionToBackendMonitorThread(Thread):
         Mqtt connection is not used as a trigger as it may modify too often
         the sink cost with an unstable connection that would be counterproductive.
 
+        Thread is woken up by the publish queue when it crosses a threshold, and
+        when the delay without publish is reached, instead of sampling the queue.
+        Black hole ends only once the queue is empty to avoid oscillations.
+
         Args:
-            period: the period to check the buffer status
             mqtt_wrapper: the mqtt wrapper to get access to queue level
             sink_manager: the sink manager to modify sink cost of all sinks
             minimum_sink_cost: the minimum sink cost for sinks on this gateway
@@ -56,14 +77,14 @@ class ConnectionToBackendMonitorThread(Thread):
             max_delay_without_publish: the maximum delay without any successful publish (with
                                        something in the queue before rising the sink costs
             stop_stack: stop the stack instead of increasing the sink cost in case of black hole
+            cost_controller: a SinkCostController to grade the sink cost with the queue
+                             state instead of setting it to its maximum on black hole
         """
         Thread.__init__(self)
 
         # Daemonize thread to exit with full process
         self.daemon = True
 
-        # How often to check the queue
-        self.period = period
         self.mqtt_wrapper = mqtt_wrapper
         self.sink_manager = sink_manager
 
@@ -75,10 +96,23 @@ class ConnectionToBackendMonitorThread(Thread):
         self.max_buffered_packets = max_buffered_packets
         self.max_delay_without_publish = max_delay_without_publish
         self.stop_stack = stop_stack
+        self.cost_controller = cost_controller
+
+        # Set when the queue state must be checked again
+        self._check_event = Event()
+        self.mqtt_wrapper.set_publish_threshold_listener(
+            max_buffered_packets if max_buffered_packets > 0 else None,
+            self._check_event.set,
+        )
 
     def _set_sinks_cost(self, cost):
         for sink in self.sink_manager.get_sinks():
-            sink.cost = cost
+            try:
+                sink.cost = cost
+            except ValueError:
+                logging.debug(
+                    "Cannot set cost of %s, probably not a sink", sink.sink_id
+                )
 
     def _stop_sinks(self):
         for sink in self.sink_manager.get_sinks():
@@ -110,10 +144,95 @@ class ConnectionToBackendMonitorThread(Thread):
 
         return self.mqtt_wrapper.publish_queue_size > self.max_buffered_packets
 
+    def _get_next_check_delay_s(self):
+        if self.disconnected or self.max_delay_without_publish <= 0:
+            # Only the queue becoming empty or over threshold matters
+            return None
+
+        if self.mqtt_wrapper.publish_queue_size == 0:
+            # Delay starts with next publish, that wakes the thread
+            return None
+
+        # Wake up when delay would be over if no publish happens in between
+        return max(
+            0,
+            self.max_delay_without_publish
+            - self.mqtt_wrapper.publish_waiting_time_s
+            + self.DEADLINE_MARGIN_S,
+        )
+
+    def _control_sinks_cost(self):
+        """
+        Update the graded sink cost from the queue state
+
+        Returns: delay before next update, None to wait for a queue event
+        """
+        previous_cost = self.cost_controller.cost
+        cost = self.cost_controller.update(
+            self.mqtt_wrapper.publish_queue_size,
+            self.mqtt_wrapper.publish_waiting_time_s,
+            monotonic(),
+        )
+
+        if cost != previous_cost:
+            logging.info(
+                "Sink cost set to %d (load=%.2f, queue size=%d)",
+                cost,
+                self.cost_controller.load,
+                self.mqtt_wrapper.publish_queue_size,
+            )
+            self._set_sinks_cost(cost)
+
+        if self.cost_controller.is_settled():
+            return None
+
+        return self.COST_CONTROL_PERIOD_S
+
+    def _detect_black_hole(self):
+        """
+        Set the sinks cost to its maximum or stop them while in black hole
+
+        Returns: delay before next check, None to wait for a queue event
+        """
+        if not self.disconnected:
+            # Check if a condition to declare "back hole" is met
+            if self._is_publish_delay_over() or self._is_buffer_threshold_reached():
+                if self.stop_stack:
+                    logging.info("Black hole detected, stop all stacks")
+                    self._stop_sinks()
+                else:
+                    logging.info("Increasing sink cost of all sinks")
+                    self._set_sinks_cost_high()
+
+                logging.info(
+                    "Last publish: %s Queue Size %s",
+                    self.mqtt_wrapper.publish_waiting_time_s,
+                    self.mqtt_wrapper.publish_queue_size,
+                )
+
+                self.disconnected = True
+        else:
+            if self.mqtt_wrapper.publish_queue_size == 0:
+                # Network is back, put the connection back
+                logging.info(
+                    "Connection is back, black hole is finished"
+                )
+
+                if self.stop_stack:
+                    logging.info("Restart all sinks")
+                    self._start_sinks()
+                else:
+                    logging.info("Decreasing sink cost")
+                    self._set_sinks_cost_low()
+
+                self.disconnected = False
+
+        return self._get_next_check_delay_s()
+
     def run(self):
         """
-        Main loop that check periodically the status of the published queue and compare
-        it to threshold set when starting Transport
+        Main loop that check the status of the published queue when it changes
+        and compare it to threshold set when starting Transport
         """
 
         # Initialize already detected sinks
@@ -122,47 +241,23 @@ class ConnectionToBackendMonitorThread(Thread):
         self.running = True
 
         while self.running:
-            if not self.disconnected:
-                # Check if a condition to declare "back hole" is met
-                if self._is_publish_delay_over() or self._is_buffer_threshold_reached():
-                    if self.stop_stack:
-                        logging.info("Black hole detected, stop all stacks")
-                        self._stop_sinks()
-                    else:
-                        logging.info("Increasing sink cost of all sinks")
-                        self._set_sinks_cost_high()
-
-                    logging.info(
-                        "Last publish: %s Queue Size %s",
-                        self.mqtt_wrapper.publish_waiting_time_s,
-                        self.mqtt_wrapper.publish_queue_size,
-                    )
+            # Cleared before the checks, so any change after them is not missed
+            self._check_event.clear()
 
-                    self.disconnected = True
+            if self.cost_controller is not None:
+                next_check_delay_s = self._control_sinks_cost()
             else:
-                if self.mqtt_wrapper.publish_queue_size == 0:
-                    # Network is back, put the connection back
-                    logging.info(
-                        "Connection is back, black hole is finished"
-                    )
-
-                    if self.stop_stack:
-                        logging.info("Restart all sinks")
-                        self._start_sinks()
-                    else:
-                        logging.info("Decreasing sink cost")
-                        self._set_sinks_cost_low()
-
-                    self.disconnected = False
+                next_check_delay_s = self._detect_black_hole()
 
-            # Wait for period
-            sleep(self.period)
+            # Wait for next queue event, publish deadline or cost update
+            self._check_event.wait(next_check_delay_s)
 
     def stop(self):
         """
         Stop the black hole monitoring thread
         """
         self.running = False
+        self._check_event.set()
 
     def initialize_sink(self, name):
         """
@@ -176,7 +271,9 @@ class ConnectionToBackendMonitorThread(Thread):
 
             logging.info("Initialize sinkCost of sink %s", name)
             if sink is not None:
-                if self.disconnected:
+                if self.cost_controller is not None:
+                    sink.cost = self.cost_controller.cost
+                elif self.disconnected:
                     sink.cost = self.SINK_COST_HIGH
                 else:
                     sink.cost = self.minimum_sink_cost
@@ -198,6 +295,10 @@ class SetStatusThread(Thread):
         max_scratchpad_size,
         agregate_delay_s=0.5,
         backup_delay_s=3600,
+        read_timeout_s=None,
+        snapshot_max_age_s=0,
+        downlink_duplicates=None,
+        publish_statistics=False,
     ):
         """
         Thread sending periodically the gateway status
@@ -210,6 +311,15 @@ class SetStatusThread(Thread):
             backup_delay_s: delay in s to update gateway status, just in case.
                             It should never generate a publish as content
                             may not change
+            read_timeout_s: maximum time in s to wait for the sink configs,
+                            a sink not read in time is given from cache
+            snapshot_max_age_s: maximum age in s of the last read configs
+                                to answer get_configs without reading sinks
+            downlink_duplicates: ExpiringCache of the downlink requests,
+                                 whose statistics are published with the
+                                 sinks ones
+            publish_statistics: publish the traffic counters of the sinks
+                                each time the status is refreshed
         """
         Thread.__init__(self)
 
@@ -218,6 +328,7 @@ class SetStatusThread(Thread):
 
         self.agregate_delay_s = agregate_delay_s
         self.backup_delay_s = backup_delay_s
+        self.read_timeout_s = read_timeout_s
         self.mqtt_wrapper = mqtt_wrapper
         self.sink_manager = sink_manager
         self.gw_id = gw_id
@@ -232,15 +343,89 @@ class SetStatusThread(Thread):
 
         self._last_status_config = None
 
+        # Snapshot of the last read configs, shared with get_configs requests
+        self.snapshot_max_age_s = snapshot_max_age_s
+        self._snapshot_lock = Lock()
+        # Incremented each time the sinks state may have changed
+        self._status_version = 0
+        self._snapshot = None
+
+        self.downlink_duplicates = downlink_duplicates
+        self.publish_statistics = publish_statistics
+
+    def _read_configs(self):
+        # Version is taken before the reads so a change during them
+        # makes the snapshot stale
+        version = self._status_version
+        configs, partial = self.sink_manager.read_configs(self.read_timeout_s)
+
+        with self._snapshot_lock:
+            if not partial:
+                self._snapshot = (version, monotonic(), configs.copy())
+            else:
+                self._snapshot = None
+
+        return configs, partial
+
+    def get_configs(self):
+        """
+        Get the configs of all the sinks
+
+        Configs are taken from the last read if it is recent enough and
+        nothing changed since, otherwise they are read from the sinks.
+
+        Returns: A dict of sink id to config
+        """
+        with self._snapshot_lock:
+            if self._snapshot is not None:
+                version, read_time, configs = self._snapshot
+                if (
+                    version == self._status_version
+                    and monotonic() - read_time <= self.snapshot_max_age_s
+                ):
+                    logging.debug("Configs served from snapshot")
+                    return configs.copy()
+
+        configs, _ = self._read_configs()
+        return configs
+
+    def _publish_statistics(self, reads):
+        # Reads were issued with the configs ones, so they are done by now
+        # or take at most the same timeout
+        wait(reads.values(), timeout=self.read_timeout_s)
+
+        sinks = {}
+        for sink_id, read in reads.items():
+            if read.done() and read.result() is not None:
+                sinks[sink_id] = read.result()
+            else:
+                logging.warning("Statistics of sink %s not read", sink_id)
+
+        # Status has no field for them, so they have their own event
+        payload = {
+            "gw_id": self.gw_id,
+            "timestamp_ms": int(time() * 1000),
+            "sinks": sinks,
+        }
+        if self.downlink_duplicates is not None:
+            payload["downlink_duplicates"] = self.downlink_duplicates.stats()
+        topic = TopicGenerator.make_statistics_topic(self.gw_id)
+        self.mqtt_wrapper.publish(topic, json.dumps(payload).encode(), qos=1)
+
     def _set_status(self) -> bool:
+        statistics_reads = None
+        if self.publish_statistics:
+            # Done asynchronously, at the same time as the configs reads
+            statistics_reads = {
+                sink.sink_id: sink.get_statistics_async()
+                for sink in self.sink_manager.get_sinks()
+            }
+
         # Create a list of different sink configs
-        partial_status = False
-        configs = {}
-        for sink in self.sink_manager.get_sinks():
-            config, partial = sink.read_config()
-            partial_status |= partial
-            if config is not None:
-                configs[sink.sink_id] = config
+        configs, partial_status = self._read_configs()
+
+        if statistics_reads is not None:
+            self._publish_statistics(statistics_reads)
 
         if partial_status:
             # Some part of the status were read from cache value
@@ -351,16 +536,248 @@ class SetStatusThread(Thread):
         """
         self.running = False
 
+    def invalidate_snapshot(self):
+        """
+        Mark the configs snapshot as stale, without publishing a status
+        """
+        with self._snapshot_lock:
+            self._status_version += 1
+
     def update_status(self, force=False):
         """
         Request to update the status
         """
         logging.debug("Request to update status")
+        self.invalidate_snapshot()
+
         if force:
             self._last_status_config = None
 
         self._set_status_event.set()
 
+
+class DownlinkSchedulerThread(Thread):
+
+    # Number of slots in each timer wheel
+    WHEEL_SLOTS = 512
+
+    def __init__(self, on_send_time_cb, tick_s, max_delay_s):
+        """
+        Thread holding scheduled downlink requests until their send time
+
+        Requests are kept in a timer wheel per sink and given back
+        through on_send_time_cb once their send time is reached. The
+        callback is called from a worker thread per sink, so a slow send
+        delays neither the other sinks nor the timer wheels.
+
+        Args:
+            on_send_time_cb: callback called with (sink_id, request) when
+                             a request must be sent
+            tick_s: resolution of the timer wheels
+            max_delay_s: maximum delay a request can be held
+        """
+        Thread.__init__(self)
+
+        # Daemonize thread to exit with full process
+        self.daemon = True
+
+        self.on_send_time_cb = on_send_time_cb
+        self.tick_s = tick_s
+        self.max_delay_s = max_delay_s
+
+        self.running = False
+
+        # One timer wheel per sink
+        self._wheels = {}
+        # One single worker per sink to keep the send order on a sink
+        self._senders = {}
+        # req_id to sink_id of the scheduled requests, as a req_id is unique
+        self._req_id_to_sink_id = {}
+        self._lock = Lock()
+        self._wakeup_event = Event()
+
+    def schedule(self, sink_id, request, send_at_s_epoch):
+        """
+        Hold a request until its send time
+
+        Args:
+            sink_id: the sink to send the request on
+            request: the SendDataRequest to hold
+            send_at_s_epoch: time to send the request (s since epoch)
+
+        Returns: A GatewayResultCode, GW_RES_OK if request is scheduled
+        """
+        delay_s = send_at_s_epoch - time()
+        if delay_s > self.max_delay_s:
+            logging.error(
+                "Send time of request %s is too far (%ss)", request.req_id, delay_s
+            )
+            return wmm.GatewayResultCode.GW_RES_INVALID_PARAM
+
+        with self._lock:
+            if request.req_id in self._req_id_to_sink_id:
+                logging.error("Request %s is already scheduled", request.req_id)
+                return wmm.GatewayResultCode.GW_RES_INVALID_PARAM
+
+            wheel = self._wheels.get(sink_id)
+            if wheel is None:
+                wheel = TimerWheel(self.tick_s, self.WHEEL_SLOTS, monotonic())
+                self._wheels[sink_id] = wheel
+
+            wheel.add(
+                request.req_id, monotonic() + delay_s, (send_at_s_epoch, request)
+            )
+            self._req_id_to_sink_id[request.req_id] = sink_id
+
+        logging.debug(
+            "Downlink %s scheduled on %s in %.3fs", request.req_id, sink_id, delay_s
+        )
+        # Wake up the thread to take into account the new deadline
+        self._wakeup_event.set()
+        return wmm.GatewayResultCode.GW_RES_OK
+
+    def cancel(self, req_id):
+        """
+        Cancel a scheduled request
+
+        Args:
+            req_id: id of the request to cancel
+
+        Returns: A tuple (sink_id, request) of the cancelled request or None
+                 if not scheduled
+        """
+        with self._lock:
+            sink_id = self._req_id_to_sink_id.pop(req_id, None)
+            if sink_id is None:
+                return None
+
+            _, request = self._wheels[sink_id].cancel(req_id)
+
+        logging.info("Scheduled downlink %s cancelled on %s", req_id, sink_id)
+        return sink_id, request
+
+    def cancel_sink(self, sink_id):
+        """
+        Cancel all the requests scheduled on a sink
+
+        Args:
+            sink_id: the sink to clear
+
+        Returns: The list of cancelled requests
+        """
+        with self._lock:
+            wheel = self._wheels.pop(sink_id, None)
+            # Requests already given to it are still sent
+            sender = self._senders.pop(sink_id, None)
+            requests = []
+            if wheel is not None:
+                for req_id, _, (_, request) in wheel.items():
+                    del self._req_id_to_sink_id[req_id]
+                    requests.append(request)
+
+        if sender is not None:
+            sender.shutdown(wait=False)
+
+        if requests:
+            logging.info(
+                "%d scheduled downlink(s) cancelled on %s", len(requests), sink_id
+            )
+        return requests
+
+    def get_pending(self, sink_id=None):
+        """
+        Get the scheduled requests
+
+        Args:
+            sink_id: the sink to inspect, None for all sinks
+
+        Returns: A list of (sink_id, req_id, send_at_s_epoch) sorted by send time
+        """
+        pending = []
+        with self._lock:
+            for wheel_sink_id, wheel in self._wheels.items():
+                if sink_id is not None and wheel_sink_id != sink_id:
+                    continue
+
+                for req_id, _, (send_at_s_epoch, _) in wheel.items():
+                    pending.append((wheel_sink_id, req_id, send_at_s_epoch))
+
+        return sorted(pending, key=lambda entry: entry[2])
+
+    def _pop_expired(self):
+        now = monotonic()
+        expired = []
+        next_expiration = None
+        with self._lock:
+            for sink_id, wheel in self._wheels.items():
+                for req_id, deadline, (_, request) in wheel.pop_expired(now):
+                    del self._req_id_to_sink_id[req_id]
+                    # Sender is taken with the wheel, so a sink removed
+                    # meanwhile cannot leave a sender behind
+                    sender = self._senders.get(sink_id)
+                    if sender is None:
+                        sender = ThreadPoolExecutor(max_workers=1)
+                        self._senders[sink_id] = sender
+                    expired.append((deadline, sender, sink_id, request))
+
+                wheel_expiration = wheel.next_expiration()
+                if wheel_expiration is not None and (
+                    next_expiration is None or wheel_expiration < next_expiration
+                ):
+                    next_expiration = wheel_expiration
+
+        if next_expiration is None:
+            timeout = None
+        else:
+            timeout = max(next_expiration - monotonic(), 0)
+
+        return sorted(expired, key=lambda entry: entry[0]), timeout
+
+    def _send(self, sink_id, request):
+        try:
+            self.on_send_time_cb(sink_id, request)
+        except Exception:
+            logging.exception("Cannot send scheduled downlink")
+
+    def run(self):
+        """
+        Main loop that gives back the requests when their send time is reached
+        """
+        self.running = True
+
+        while self.running:
+            # Clear before checking, any schedule after this point wakes us up
+            self._wakeup_event.clear()
+
+            expired, timeout = self._pop_expired()
+            for _, sender, sink_id, request in expired:
+                try:
+                    sender.submit(self._send, sink_id, request)
+                except RuntimeError:
+                    # Sink was removed in between
+                    logging.warning(
+                        "Scheduled downlink %s dropped, %s is removed",
+                        request.req_id,
+                        sink_id,
+                    )
+
+            self._wakeup_event.wait(timeout)
+
+        with self._lock:
+            senders = list(self._senders.values())
+            self._senders.clear()
+
+        for sender in senders:
+            sender.shutdown(wait=False)
+
+    def stop(self):
+        """
+        Stop the scheduler
+        """
+        self.running = False
+        self._wakeup_event.set()
+
+
 class TransportService(BusClient):
     """
     Implementation of gateway to backend protocol
@@ -372,8 +789,8 @@ class TransportService(BusClient):
     # Maximum hop limit to send a packet is limited to 15 by API (4 bits)
     MAX_HOP_LIMIT = 15
 
-    # Period in s to check for black hole issue
-    MONITORING_BUFFERING_PERIOD_S = 1
+    # Maximum number of scratchpad missing ranges logged at each chunk
+    MAX_LOGGED_MISSING_RANGES = 8
 
     class MaskedRequest:
         """
@@ -404,6 +821,7 @@ class TransportService(BusClient):
         super(TransportService, self).__init__(
             c_extension=(settings.full_python is False),
             ignored_ep_filter=settings.ignored_endpoints_filter,
+            uplink_ring=settings.uplink_ring,
             **kwargs
         )
 
@@ -450,15 +868,35 @@ class TransportService(BusClient):
                 settings.buffering_max_delay_without_publish,
                 settings.buffering_stop_stack
             )
+            cost_controller = None
+            if settings.buffering_sink_cost_control:
+                if settings.buffering_stop_stack:
+                    logging.warning(
+                        "Sink cost control is not used as stack is stopped on "
+                        "black hole"
+                    )
+                else:
+                    logging.info(
+                        "Sink cost control enabled: max_step=%s",
+                        settings.buffering_sink_cost_max_step
+                    )
+                    cost_controller = SinkCostController(
+                        settings.buffering_minimal_sink_cost,
+                        settings.buffering_max_buffered_packets,
+                        settings.buffering_max_delay_without_publish,
+                        maximum_cost=ConnectionToBackendMonitorThread.SINK_COST_HIGH,
+                        max_step=settings.buffering_sink_cost_max_step,
+                    )
+
             # Create and start a monitoring thread for black hole issue
             self.monitoring_thread = ConnectionToBackendMonitorThread(
-                self.MONITORING_BUFFERING_PERIOD_S,
                 self.mqtt_wrapper,
                 self.sink_manager,
                 settings.buffering_minimal_sink_cost,
                 settings.buffering_max_buffered_packets,
                 settings.buffering_max_delay_without_publish,
-                settings.buffering_stop_stack
+                settings.buffering_stop_stack,
+                cost_controller
             )
             self.monitoring_thread.start()
 
@@ -467,6 +905,16 @@ class TransportService(BusClient):
         else:
             self.data_event_id = None
 
+        self.downlink_duplicates = None
+        if settings.downlink_duplicate_window_s > 0:
+            logging.info(
+                "Duplicate downlink suppression enabled: window=%ss",
+                settings.downlink_duplicate_window_s,
+            )
+            self.downlink_duplicates = ExpiringCache(
+                settings.downlink_duplicate_window_s
+            )
+
         self.status_thread = SetStatusThread(
             self.mqtt_wrapper,
             self.sink_manager,
@@ -474,12 +922,52 @@ class TransportService(BusClient):
             self.gw_model,
             self.gw_version,
             self.gw_features,
-            self.max_scratchpad_size
+            self.max_scratchpad_size,
+            read_timeout_s=settings.gateway_config_read_timeout_s,
+            snapshot_max_age_s=settings.gateway_config_max_age_s,
+            downlink_duplicates=self.downlink_duplicates,
+            publish_statistics=settings.gateway_publish_statistics,
         )
         self.status_thread.start()
 
+        self.downlink_scheduler = None
+        if settings.downlink_max_schedule_delay_s > 0:
+            logging.info(
+                "Scheduled downlink enabled: max_delay=%ss, tick=%sms",
+                settings.downlink_max_schedule_delay_s,
+                settings.downlink_scheduler_tick_ms,
+            )
+            self.downlink_scheduler = DownlinkSchedulerThread(
+                self._send_unique_data_request,
+                settings.downlink_scheduler_tick_ms / 1000,
+                settings.downlink_max_schedule_delay_s,
+            )
+            self.downlink_scheduler.start()
+
+        self._downlink_credit_wait_s = settings.downlink_credit_wait_s
+        if self._downlink_credit_wait_s > 0:
+            logging.info(
+                "Downlink credit pacing enabled: max_wait=%ss",
+                self._downlink_credit_wait_s,
+            )
+
         # Dictionnary to store scratchpad chunks
         self._scratchpad_chunks = {}
+        # Lock per sink id, upload requests run in their own thread
+        self._scratchpad_locks = {}
+        self._scratchpad_locks_lock = Lock()
+        self._scratchpad_chunks_dir = settings.gateway_scratchpad_chunks_dir
+        self._scratchpad_chunks_ttl_s = settings.gateway_scratchpad_chunks_ttl_s
+        if self._scratchpad_chunks_dir is not None:
+            logging.info(
+                "Partial scratchpads persisted in %s (ttl=%ss)",
+                self._scratchpad_chunks_dir,
+                self._scratchpad_chunks_ttl_s,
+            )
+            os.makedirs(self._scratchpad_chunks_dir, exist_ok=True)
+            PartialScratchpad.purge_expired(
+                self._scratchpad_chunks_dir, self._scratchpad_chunks_ttl_s
+            )
 
 
     def _on_mqtt_wrapper_termination_cb(self):
@@ -524,6 +1012,21 @@ class TransportService(BusClient):
         # application
         self.mqtt_wrapper.subscribe(topic, self._on_send_data_cmd_received, qos=2)
 
+        # Register for send data request to be sent at a given time
+        topic = TopicGenerator.make_scheduled_send_data_request_topic(self.gw_id)
+        self.mqtt_wrapper.subscribe(
+            topic, self._on_scheduled_send_data_cmd_received, qos=2
+        )
+
+        # Register for scheduled send data requests cancel and listing
+        topic = TopicGenerator.make_cancel_send_data_request_topic(self.gw_id)
+        self.mqtt_wrapper.subscribe(
+            topic, self._on_cancel_send_data_cmd_received, qos=2
+        )
+
+        topic = TopicGenerator.make_get_scheduled_send_data_request_topic(self.gw_id)
+        self.mqtt_wrapper.subscribe(topic, self._on_get_scheduled_send_data_received)
+
         # Register for otap commands for any sink on the gateway
         topic = TopicGenerator.make_otap_status_request_topic(self.gw_id)
         self.mqtt_wrapper.subscribe(topic, self._on_otap_status_request_received)
@@ -633,6 +1136,12 @@ class TransportService(BusClient):
     def on_stack_stopped(self, name):
         logging.debug("Sink stopped: %s", name)
 
+    def on_sink_config_changed(self, name):
+        # Sinks may notify changes before the status thread is created
+        status_thread = getattr(self, "status_thread", None)
+        if status_thread is not None:
+            status_thread.invalidate_snapshot()
+
     def deferred_thread(fn):
         """
         Decorator to handle a request on its own Thread
@@ -670,26 +1179,59 @@ class TransportService(BusClient):
     @update_gateway_status_dec
     def on_sink_disconnected(self, name):
         logging.info("Sink disconnected, sending new configs")
+        if self.downlink_scheduler is not None:
+            # Scheduled requests cannot be sent anymore on this sink
+            for request in self.downlink_scheduler.cancel_sink(name):
+                self._forget_send_data_request(name, request)
+                self._publish_send_data_response(
+                    request, name, wmm.GatewayResultCode.GW_RES_INVALID_SINK_ID
+                )
 
-    @deferred_thread
-    def _on_send_data_cmd_received(self, client, userdata, message):
-        # pylint: disable=unused-argument
+    def _publish_send_data_response(self, request, sink_id, res):
+        response = wmm.SendDataResponse(request.req_id, self.gw_id, res, sink_id)
+        topic = TopicGenerator.make_send_data_response_topic(self.gw_id, sink_id)
+
+        self.mqtt_wrapper.publish(topic, response.payload, qos=2)
+
+    def _get_downlink_sink(self, sink_id):
         try:
-            request = wmm.SendDataRequest.from_payload(message.payload)
-        except wmm.GatewayAPIParsingException as e:
+            network_address = TopicParser.parse_any_sink_id(sink_id)
+        except RuntimeError as e:
             logging.error(str(e))
-            return
+            return None
 
-        # Get the sink-id from topic
-        _, sink_id = TopicParser.parse_send_data_topic(message.topic)
+        if network_address is None:
+            return self.sink_manager.get_sink(sink_id)
+
+        # Any sink of the network can be used, take the least loaded one
+        sink = self.sink_manager.get_least_loaded_sink(network_address)
+        if sink is not None:
+            logging.debug("Sink %s selected for %s", sink.sink_id, sink_id)
+
+        return sink
+
+    def _send_data_request(self, sink_id, request):
+        """
+        Send a request on a sink and answer to backend
 
+        Returns: The sink id used and the result of the request
+        """
         logging.debug("Downlink traffic: %s | %s", sink_id, request.req_id)
 
-        sink = self.sink_manager.get_sink(sink_id)
+        sink = self._get_downlink_sink(sink_id)
         if sink is not None:
+            # Answer with the sink really used
+            sink_id = sink.sink_id
+
             if request.hop_limit > self.MAX_HOP_LIMIT:
                 res = wmm.GatewayResultCode.GW_RES_INVALID_MAX_HOP_COUNT
             else:
+                if self._downlink_credit_wait_s > 0 and not sink.wait_downlink_credit(
+                    self._downlink_credit_wait_s
+                ):
+                    # Sink will most probably refuse it, but let it decide
+                    logging.warning("Downlink queue of %s still full", sink_id)
+
                 res = sink.send_data(
                     request.destination_address,
                     request.source_endpoint,
@@ -706,10 +1248,163 @@ class TransportService(BusClient):
             res = wmm.GatewayResultCode.GW_RES_INVALID_SINK_ID
 
         # Answer to backend
-        response = wmm.SendDataResponse(request.req_id, self.gw_id, res, sink_id)
-        topic = TopicGenerator.make_send_data_response_topic(self.gw_id, sink_id)
+        self._publish_send_data_response(request, sink_id, res)
 
-        self.mqtt_wrapper.publish(topic, response.payload, qos=2)
+        return sink_id, res
+
+    def _is_duplicate_send_data_request(self, sink_id, request):
+        if self.downlink_duplicates is None:
+            return False
+
+        # Result is unknown until the request is sent
+        found, cached = self.downlink_duplicates.get_or_add(
+            (sink_id, request.req_id), None
+        )
+        if not found:
+            return False
+
+        logging.info(
+            "Duplicate downlink %s on %s not sent again", request.req_id, sink_id
+        )
+        if cached is not None:
+            # Replay the answer of the first request
+            self._publish_send_data_response(request, *cached)
+        # Otherwise first request is still ongoing and will be answered
+
+        return True
+
+    @deferred_thread
+    def _on_send_data_cmd_received(self, client, userdata, message):
+        # pylint: disable=unused-argument
+        try:
+            request = wmm.SendDataRequest.from_payload(message.payload)
+        except wmm.GatewayAPIParsingException as e:
+            logging.error(str(e))
+            return
+
+        # Get the sink-id from topic
+        _, sink_id = TopicParser.parse_send_data_topic(message.topic)
+
+        if self._is_duplicate_send_data_request(sink_id, request):
+            return
+
+        self._send_unique_data_request(sink_id, request)
+
+    def _send_unique_data_request(self, sink_id, request):
+        """
+        Send a request that passed the duplicate check and remember its result
+        """
+        if self.downlink_duplicates is None:
+            self._send_data_request(sink_id, request)
+            return
+
+        res = None
+        try:
+            used_sink_id, res = self._send_data_request(sink_id, request)
+        finally:
+            if res == wmm.GatewayResultCode.GW_RES_OK:
+                self.downlink_duplicates.update(
+                    (sink_id, request.req_id), (used_sink_id, res)
+                )
+            else:
+                # Failure may be transient (ie queue full), so a retry
+                # from backend must be sent again
+                self._forget_send_data_request(sink_id, request)
+
+    def _forget_send_data_request(self, sink_id, request):
+        if self.downlink_duplicates is not None:
+            self.downlink_duplicates.remove((sink_id, request.req_id))
+
+    def _on_scheduled_send_data_cmd_received(self, client, userdata, message):
+        # pylint: disable=unused-argument
+        """
+        This function doesn't need the decorator @deferred_thread as request is
+        only scheduled, except if its send time is already reached
+        """
+        try:
+            request = wmm.SendDataRequest.from_payload(message.payload)
+        except wmm.GatewayAPIParsingException as e:
+            logging.error(str(e))
+            return
+
+        try:
+            _, sink_id, send_at_ms_epoch = TopicParser.parse_scheduled_send_data_topic(
+                message.topic
+            )
+        except RuntimeError as e:
+            logging.error(str(e))
+            _, _, sink_id, _ = message.topic.split("/", 3)
+            self._publish_send_data_response(
+                request, sink_id, wmm.GatewayResultCode.GW_RES_INVALID_PARAM
+            )
+            return
+
+        if self.downlink_scheduler is None:
+            logging.warning("Scheduled downlink is disabled")
+            self._publish_send_data_response(
+                request, sink_id, wmm.GatewayResultCode.GW_RES_INVALID_PARAM
+            )
+            return
+
+        if self._is_duplicate_send_data_request(sink_id, request):
+            return
+
+        send_at_s_epoch = send_at_ms_epoch / 1000
+        if send_at_s_epoch <= time():
+            # Send time is already reached, no need to hold it
+            Thread(
+                target=self._send_unique_data_request, args=[sink_id, request]
+            ).start()
+            return
+
+        res = self.downlink_scheduler.schedule(sink_id, request, send_at_s_epoch)
+        if res != wmm.GatewayResultCode.GW_RES_OK:
+            self._forget_send_data_request(sink_id, request)
+            self._publish_send_data_response(request, sink_id, res)
+
+    def _on_cancel_send_data_cmd_received(self, client, userdata, message):
+        # pylint: disable=unused-argument
+        """
+        Cancel a scheduled send data request from its req_id. Answer is a json
+        with the req_id and if it was still scheduled
+        """
+        try:
+            _, sink_id, req_id = TopicParser.parse_cancel_send_data_topic(message.topic)
+        except RuntimeError as e:
+            logging.error(str(e))
+            return
+
+        cancelled = None
+        if self.downlink_scheduler is not None:
+            cancelled = self.downlink_scheduler.cancel(req_id)
+
+        if cancelled is not None:
+            # Request can be sent again by backend
+            self._forget_send_data_request(*cancelled)
+
+        topic = TopicGenerator.make_cancel_send_data_response_topic(self.gw_id, sink_id)
+        payload = {"req_id": req_id, "cancelled": cancelled is not None}
+        self.mqtt_wrapper.publish(topic, json.dumps(payload), qos=2)
+
+    def _on_get_scheduled_send_data_received(self, client, userdata, message):
+        # pylint: disable=unused-argument
+        logging.info("Scheduled send data list request received")
+        pending = []
+        if self.downlink_scheduler is not None:
+            pending = self.downlink_scheduler.get_pending()
+
+        topic = TopicGenerator.make_get_scheduled_send_data_response_topic(self.gw_id)
+        payload = {
+            "scheduled": [
+                {
+                    "sink_id": sink_id,
+                    "req_id": req_id,
+                    "send_at_ms_epoch": int(send_at_s_epoch * 1000),
+                }
+                for sink_id, req_id, send_at_s_epoch in pending
+            ]
+        }
+        self.mqtt_wrapper.publish(topic, json.dumps(payload), qos=1)
 
     @deferred_thread
     def _on_get_configs_cmd_received(self, client, userdata, message):
@@ -721,15 +1416,14 @@ class TransportService(BusClient):
             logging.error(str(e))
             return
 
-        # Create a list of different sink configs
-        configs = []
-        for sink in self.sink_manager.get_sinks():
-            config, _ = sink.read_config()
-            if config is not None:
-                configs.append(config)
+        # Answered from last read configs if still valid
+        configs = self.status_thread.get_configs()
 
         response = wmm.GetConfigsResponse(
-            request.req_id, self.gw_id, wmm.GatewayResultCode.GW_RES_OK, configs
+            request.req_id,
+            self.gw_id,
+            wmm.GatewayResultCode.GW_RES_OK,
+            configs.values(),
         )
         topic = TopicGenerator.make_get_configs_response_topic(self.gw_id)
 
@@ -792,6 +1486,35 @@ class TransportService(BusClient):
 
         self.mqtt_wrapper.publish(topic, response.payload, qos=2)
 
+    def _publish_scratchpad_chunks_status(self, sink_id):
+        # Status response has no field for it, so the ranges still expected
+        # for a pending chunked upload have their own event
+        with self._lock_scratchpad_sinks(self._get_otap_sink_ids(sink_id)):
+            acc = self._get_scratchpad_chunks(sink_id)
+            if acc is None:
+                return
+
+            payload = {
+                "gw_id": self.gw_id,
+                "sink_id": sink_id,
+                "seq": acc.seq,
+                "total_size": acc.total_size,
+                "received_size": acc.received.covered,
+                "missing": acc.missing(),
+            }
+
+        logging.info(
+            "Pending scratchpad upload for %s: seq=%d, %d/%d bytes, "
+            "%d missing range(s)",
+            sink_id,
+            payload["seq"],
+            payload["received_size"],
+            payload["total_size"],
+            len(payload["missing"]),
+        )
+        topic = TopicGenerator.make_otap_missing_chunks_topic(self.gw_id, sink_id)
+        self.mqtt_wrapper.publish(topic, json.dumps(payload).encode(), qos=1)
+
     @deferred_thread
     def _on_otap_status_request_received(self, client, userdata, message):
         # pylint: disable=unused-argument
@@ -802,6 +1525,9 @@ class TransportService(BusClient):
             logging.error(str(e))
             return
 
+        # Also for an upload to several sinks, status is asked with its id
+        self._publish_scratchpad_chunks_status(request.sink_id)
+
         sink = self.sink_manager.get_sink(request.sink_id)
         if sink is not None:
             d = sink.get_scratchpad_status()
@@ -853,6 +1579,132 @@ class TransportService(BusClient):
         logging.debug("Publishing otap response for id %d", request.req_id)
         self.mqtt_wrapper.publish(topic, response.payload, qos=2)
 
+    def _get_otap_sink_ids(self, sink_id):
+        """
+        Get the ids of the sinks targeted by an otap request
+
+        Returns: A list of sink ids, without duplicates
+        """
+        sink_ids = TopicParser.parse_all_sinks_id(sink_id)
+        if sink_ids is None:
+            return [sink_id]
+
+        if not sink_ids:
+            return [sink.sink_id for sink in self.sink_manager.get_sinks()]
+
+        return sink_ids
+
+    def _get_sinks(self, sink_ids):
+        """
+        Get the sinks from their ids
+
+        Returns: A list of sinks or None if a sink is unknown
+        """
+        sinks = [self.sink_manager.get_sink(s) for s in sink_ids]
+        if not sinks or None in sinks:
+            return None
+
+        return sinks
+
+    def _get_otap_sinks(self, sink_id):
+        """
+        Get the sinks targeted by an otap request
+
+        Returns: A list of sinks or None if a sink is unknown
+        """
+        return self._get_sinks(self._get_otap_sink_ids(sink_id))
+
+    @staticmethod
+    def _run_on_sinks(sinks, operation):
+        """
+        Run an operation on several sinks at the same time
+
+        Args:
+            sinks: list of sinks
+            operation: function called with a sink and returning a
+                       GatewayResultCode
+
+        Returns: GW_RES_OK if the operation succeeded on all sinks or the
+                 error of one of the failing sinks
+        """
+        if len(sinks) == 1:
+            return operation(sinks[0])
+
+        with ThreadPoolExecutor(max_workers=len(sinks)) as executor:
+            results = list(executor.map(operation, sinks))
+
+        res = wmm.GatewayResultCode.GW_RES_OK
+        for sink, sink_res in zip(sinks, results):
+            logging.info("Result for sink %s: %s", sink.sink_id, sink_res.name)
+            if sink_res != wmm.GatewayResultCode.GW_RES_OK:
+                res = sink_res
+
+        return res
+
+    @staticmethod
+    def _upload_if_not_stored(sink, seq, crc, length, upload):
+        """
+        Upload a scratchpad on a sink unless it already stores it
+
+        Args:
+            sink: the sink to upload the scratchpad on
+            seq, crc, length: the scratchpad identification
+            upload: function to upload the scratchpad on a sink
+
+        Returns: The GatewayResultCode of the upload
+        """
+        if sink.is_scratchpad_stored(seq, crc, length):
+            logging.info(
+                "Scratchpad with seq %d and crc 0x%04x already stored on %s",
+                seq,
+                crc,
+                sink.sink_id,
+            )
+            return wmm.GatewayResultCode.GW_RES_OK
+
+        return upload(sink)
+
+    def _get_scratchpad_lock(self, sink_id):
+        with self._scratchpad_locks_lock:
+            return self._scratchpad_locks.setdefault(sink_id, Lock())
+
+    @contextmanager
+    def _lock_scratchpad_sinks(self, sink_ids):
+        """
+        Hold the scratchpad lock of several sinks
+
+        Locks are taken in sorted order, so requests targeting overlapping
+        sets of sinks cannot dead lock.
+        """
+        with ExitStack() as stack:
+            for sink_id in sorted(sink_ids):
+                stack.enter_context(self._get_scratchpad_lock(sink_id))
+            yield
+
+    def _get_scratchpad_chunks(self, sink_id):
+        acc = self._scratchpad_chunks.get(sink_id)
+        if acc is not None and acc.is_expired(self._scratchpad_chunks_ttl_s):
+            logging.info("Partial scratchpad for %s expired", sink_id)
+            self._drop_scratchpad_chunks(sink_id)
+            acc = None
+
+        if acc is None:
+            # Resume an upload started before a restart, if any
+            acc = PartialScratchpad.load(
+                sink_id, self._scratchpad_chunks_dir, self._scratchpad_chunks_ttl_s
+            )
+            if acc is not None:
+                self._scratchpad_chunks[sink_id] = acc
+
+        return acc
+
+    def _drop_scratchpad_chunks(self, sink_id):
+        acc = self._scratchpad_chunks.pop(sink_id, None)
+        if acc is not None:
+            acc.close()
+        elif self._scratchpad_chunks_dir is not None:
+            PartialScratchpad.remove(sink_id, self._scratchpad_chunks_dir)
+
     @deferred_thread
     @update_gateway_status_dec
     def _on_otap_upload_scratchpad_request_received(self, client, userdata, message):
@@ -865,8 +1717,15 @@ class TransportService(BusClient):
 
         logging.info("OTAP upload request received for %s", request.sink_id)
 
-        sink = self.sink_manager.get_sink(request.sink_id)
-        if sink is None:
+        # Chunks of a same upload, or uploads sharing a sink, must be handled
+        # one at a time
+        sink_ids = self._get_otap_sink_ids(request.sink_id)
+        with self._lock_scratchpad_sinks(sink_ids):
+            self._handle_upload_scratchpad_request(request, sink_ids)
+
+    def _handle_upload_scratchpad_request(self, request, sink_ids):
+        sinks = self._get_sinks(sink_ids)
+        if sinks is None:
             self._send_otap_response(
                 request, wmm.GatewayResultCode.GW_RES_INVALID_SINK_ID
             )
@@ -875,10 +1734,12 @@ class TransportService(BusClient):
         # Check if it is a clear scratchpad
         if request.scratchpad is None:
             logging.info("Clear scratchpad")
-            res = sink.clear_local_scratchpad()
+            res = self._run_on_sinks(
+                sinks, lambda sink: sink.clear_local_scratchpad()
+            )
 
             # Drop any pending incomplete upload for this sink
-            self._scratchpad_chunks.pop(request.sink_id, None)
+            self._drop_scratchpad_chunks(request.sink_id)
 
             self._send_otap_response(request, res)
             return
@@ -887,9 +1748,38 @@ class TransportService(BusClient):
         if request.chunk_info is None:
             logging.info("Full scratchpad")
             # Drop any pending incomplete upload for this sink
-            self._scratchpad_chunks.pop(request.sink_id, None)
+            self._drop_scratchpad_chunks(request.sink_id)
+
+            crc = get_scratchpad_crc(request.scratchpad)
+            size = len(request.scratchpad)
+            if len(sinks) == 1:
+                res = self._upload_if_not_stored(
+                    sinks[0],
+                    request.seq,
+                    crc,
+                    size,
+                    lambda sink: sink.upload_scratchpad(
+                        request.seq, request.scratchpad
+                    ),
+                )
+            else:
+                # Store it once for all the sinks
+                with tempfile.TemporaryFile() as scratchpad_file:
+                    scratchpad_file.write(request.scratchpad)
+                    scratchpad_file.flush()
+                    res = self._run_on_sinks(
+                        sinks,
+                        lambda sink: self._upload_if_not_stored(
+                            sink,
+                            request.seq,
+                            crc,
+                            size,
+                            lambda s: s.upload_scratchpad_file(
+                                request.seq, scratchpad_file
+                            ),
+                        ),
+                    )
 
-            res = sink.upload_scratchpad(request.seq, request.scratchpad)
             self._send_otap_response(request, res)
             return
 
@@ -899,36 +1789,69 @@ class TransportService(BusClient):
         offset = chunk_info["offset"]
         chunk = request.scratchpad
 
-        acc = self._scratchpad_chunks.get(request.sink_id)
+        if offset + len(chunk) > total_size:
+            logging.error(
+                "Chunk %d-%d is out of scratchpad size %d",
+                offset,
+                offset + len(chunk),
+                total_size,
+            )
+            self._send_otap_response(
+                request, wmm.GatewayResultCode.GW_RES_INVALID_PARAM
+            )
+            return
+
+        acc = self._get_scratchpad_chunks(request.sink_id)
+
+        crc = None
+        if offset == 0 and len(chunk) >= SCRATCHPAD_HEADER_END:
+            # Scratchpad can be identified from its header
+            crc = get_scratchpad_crc(chunk)
 
-        # New req_id for same sink → discard previous incomplete upload
+        # Another scratchpad for same sink → discard previous incomplete
+        # upload. Restarting from first chunk keeps the received ones, so an
+        # upload can be resumed after a restart of the backend too
         if acc is not None:
-            if (acc["seq"] != request.seq
-                or acc["total_size"] != total_size
-                or offset == 0):
+            if (acc.seq != request.seq
+                or acc.total_size != total_size
+                or (crc is not None and acc.crc is not None and acc.crc != crc)):
                 logging.warning(
                     "New scratchpad upload detected for sink %s, "
                     "discarding previous incomplete upload",
                     request.sink_id,
                 )
-                self._scratchpad_chunks.pop(request.sink_id)
+                self._drop_scratchpad_chunks(request.sink_id)
                 acc = None
 
         # Initialize accumulator if needed
         if acc is None:
-            acc = {
-                "seq": request.seq,
-                "total_size": total_size,
-                "buffer": bytearray(total_size),
-                "received": set(),
-            }
+            # Chunks are stored in a file to not hold the scratchpad in memory
+            # and to give it to the sink service as a file descriptor
+            PartialScratchpad.purge_expired(
+                self._scratchpad_chunks_dir, self._scratchpad_chunks_ttl_s
+            )
+            acc = PartialScratchpad.create(
+                request.sink_id, request.seq, total_size, self._scratchpad_chunks_dir
+            )
             self._scratchpad_chunks[request.sink_id] = acc
 
-        # Copy chunk into buffer
-        acc["buffer"][offset : offset + len(chunk)] = chunk
-        acc["received"].add((offset, len(chunk)))
+        if crc is not None and acc.crc is None:
+            acc.crc = crc
+            acc.stored = all(
+                sink.is_scratchpad_stored(request.seq, acc.crc, total_size)
+                for sink in sinks
+            )
+            if acc.stored:
+                logging.info(
+                    "Scratchpad already stored on %s, next chunks are not kept",
+                    request.sink_id,
+                )
+
+        # Write chunk at its place in file, unless it is useless
+        acc.write(offset, chunk)
 
-        received_size = sum(length for _, length in acc["received"])
+        # Retransmitted or overlapping chunks are only counted once
+        received_size = acc.received.covered
         logging.info(
             "Received chunk %d–%d (%d/%d bytes)",
             offset,
@@ -939,6 +1862,13 @@ class TransportService(BusClient):
 
         # Check if it is full
         if received_size < total_size:
+            missing = acc.missing()
+            logging.debug(
+                "Missing %d range(s) for %s: %s",
+                len(missing),
+                request.sink_id,
+                missing[:self.MAX_LOGGED_MISSING_RANGES],
+            )
             # Answer the chunk, wait for next ones
             self._send_otap_response(request, wmm.GatewayResultCode.GW_RES_OK)
             return
@@ -948,10 +1878,22 @@ class TransportService(BusClient):
 
         try:
             res = wmm.GatewayResultCode.GW_RES_INTERNAL_ERROR
-            res = sink.upload_scratchpad(request.seq, acc["buffer"])
+            if acc.stored:
+                res = wmm.GatewayResultCode.GW_RES_OK
+            else:
+                res = self._run_on_sinks(
+                    sinks,
+                    lambda sink: self._upload_if_not_stored(
+                        sink,
+                        request.seq,
+                        acc.crc,
+                        total_size,
+                        lambda s: s.upload_scratchpad_file(request.seq, acc.file),
+                    ),
+                )
         finally:
             # Cleanup accumulator
-            self._scratchpad_chunks.pop(request.sink_id, None)
+            self._drop_scratchpad_chunks(request.sink_id)
 
         self._send_otap_response(request, res)
 
@@ -965,9 +1907,9 @@ class TransportService(BusClient):
             logging.error(str(e))
             return
 
-        sink = self.sink_manager.get_sink(request.sink_id)
-        if sink is not None:
-            res = sink.process_scratchpad()
+        sinks = self._get_otap_sinks(request.sink_id)
+        if sinks is not None:
+            res = self._run_on_sinks(sinks, lambda sink: sink.process_scratchpad())
         else:
             res = wmm.GatewayResultCode.GW_RES_INVALID_SINK_ID
 
@@ -1274,6 +2216,7 @@ def main():
     parse.add_gateway_config()
     parse.add_filtering_config()
     parse.add_buffering_settings()
+    parse.add_downlink_settings()
     parse.add_debug_settings()
     parse.add_deprecated_args()
 
@@ -5,3 +5,8 @@
 
 from .serialization_tools import *
 from .argument_tools import *
+from .timer_wheel import *
+from .expiring_cache import *
+from .sink_cost_controller import *
+from .interval_set import *
+from .scratchpad_tools import *
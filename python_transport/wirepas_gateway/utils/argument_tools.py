@@ -424,6 +424,74 @@ class ParserHelper:
             ),
         )
 
+        self.buffering.add_argument(
+            "--buffering_sink_cost_control",
+            default=os.environ.get("WM_GW_BUFFERING_SINK_COST_CONTROL", False),
+            type=self.str2bool,
+            help=(
+                "When true, sink cost is raised progressively with the publish "
+                "queue size, its growth and the delay without publish, instead "
+                "of being set to its maximum when a black hole is detected"
+            ),
+        )
+
+        self.buffering.add_argument(
+            "--buffering_sink_cost_max_step",
+            default=os.environ.get("WM_GW_BUFFERING_SINK_COST_MAX_STEP", 16),
+            action="store",
+            type=self.str2int,
+            help=(
+                "Maximum change of the sink cost each second when sink cost "
+                "control is enabled"
+            ),
+        )
+
+    def add_downlink_settings(self):
+        """ Parameters used to handle downlink traffic """
+        self.downlink.add_argument(
+            "--downlink_max_schedule_delay_s",
+            default=os.environ.get("WM_GW_DOWNLINK_MAX_SCHEDULE_DELAY_S", 3600),
+            action="store",
+            type=self.str2int,
+            help=(
+                "Maximum delay in seconds a scheduled downlink request can be "
+                "held on gateway before being sent (0 will disable feature)"
+            ),
+        )
+
+        self.downlink.add_argument(
+            "--downlink_scheduler_tick_ms",
+            default=os.environ.get("WM_GW_DOWNLINK_SCHEDULER_TICK_MS", 10),
+            action="store",
+            type=self.str2int,
+            help=("Resolution in ms of the scheduled downlink timer wheel"),
+        )
+
+        self.downlink.add_argument(
+            "--downlink_duplicate_window_s",
+            default=os.environ.get("WM_GW_DOWNLINK_DUPLICATE_WINDOW_S", 0),
+            action="store",
+            type=self.str2int,
+            help=(
+                "Window in seconds during which a send data request with an "
+                "already seen req_id on the same sink is not sent again but "
+                "answered with the first result. Only successful sends are "
+                "remembered (0 will disable feature)"
+            ),
+        )
+
+        self.downlink.add_argument(
+            "--downlink_credit_wait_s",
+            default=os.environ.get("WM_GW_DOWNLINK_CREDIT_WAIT_S", 0),
+            action="store",
+            type=self.str2int,
+            help=(
+                "Max time in seconds to wait for room in the sink downlink "
+                "queue before sending a request, as notified by the sink "
+                "service (0 will disable feature)"
+            ),
+        )
+
     def add_debug_settings(self):
         self.debug.add_argument(
             "--debug_incr_data_event_id",
@@ -527,6 +595,17 @@ class ParserHelper:
             help=("Do not use C extension for optimization."),
         )
 
+        self.gateway.add_argument(
+            "--uplink_ring",
+            default=os.environ.get("WM_GW_UPLINK_RING", False),
+            type=self.str2bool,
+            nargs="?",
+            const=True,
+            help=("Read received packets from the sinks through shared "
+                  "memory rings instead of DBus signals, for sinks supporting "
+                  "it. Requires the C extension."),
+        )
+
         self.gateway.add_argument(
             "-gm",
             "--gateway_model",
@@ -552,6 +631,53 @@ class ParserHelper:
                   "it must be sent as chunks smaller or equal to this value"),
         )
 
+        self.gateway.add_argument(
+            "--gateway_config_read_timeout_s",
+            type=self.str2int,
+            default=os.environ.get("WM_GW_CONFIG_READ_TIMEOUT_S", 10),
+            help=("Maximum time in seconds to read the config of the sinks "
+                  "for a status or a get_configs request. A sink not read in "
+                  "time is reported with its last known config"),
+        )
+
+        self.gateway.add_argument(
+            "--gateway_config_max_age_s",
+            type=self.str2int,
+            default=os.environ.get("WM_GW_CONFIG_MAX_AGE_S", 30),
+            help=("Maximum age in seconds of the last read sink configs to "
+                  "answer a get_configs request without reading the sinks "
+                  "again (0 will disable feature)"),
+        )
+
+        self.gateway.add_argument(
+            "--gateway_scratchpad_chunks_dir",
+            type=self.str2none,
+            default=os.environ.get("WM_GW_SCRATCHPAD_CHUNKS_DIR", None),
+            help=("Directory to persist the scratchpads received by chunks, "
+                  "so an upload can be resumed after a restart. If not set, "
+                  "chunks are kept in a temporary file"),
+        )
+
+        self.gateway.add_argument(
+            "--gateway_scratchpad_chunks_ttl_s",
+            type=self.str2int,
+            default=os.environ.get("WM_GW_SCRATCHPAD_CHUNKS_TTL_S", 3600),
+            help=("Time in seconds without new chunk after which a partially "
+                  "received scratchpad is discarded"),
+        )
+
+        self.gateway.add_argument(
+            "--gateway_publish_statistics",
+            default=os.environ.get("WM_GW_PUBLISH_STATISTICS", False),
+            type=self.str2bool,
+            nargs="?",
+            const=True,
+            help=("Publish the traffic counters of the sinks, and the "
+                  "duplicate downlink counters, as json on "
+                  "gw-event/statistics/<gw_id> each time the status is "
+                  "refreshed"),
+        )
+
     def add_filtering_config(self):
         self.filtering.add_argument(
             "-iepf",
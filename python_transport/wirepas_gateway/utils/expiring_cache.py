@@ -0,0 +1,115 @@
+"""
+    Expiring cache
+    ==============
+
+    Contains a size and time bounded cache.
+
+    .. Copyright:
+        Copyright 2019 Wirepas Ltd licensed under Apache License, Version 2.0
+        See file LICENSE for full license details.
+"""
+
+from collections import OrderedDict
+from threading import Lock
+from time import monotonic
+
+
+class ExpiringCache:
+    """
+    Cache whose entries expire after a given time window
+
+    Entries are kept in insertion order, so expired entries are always
+    at the beginning and are purged without scanning the full cache.
+    A hit doesn't extend the life of an entry.
+    This class is thread safe.
+
+    Args:
+        window_s: time in seconds an entry is kept
+        max_entries: maximum number of entries, oldest one is dropped first
+    """
+
+    def __init__(self, window_s, max_entries=1024):
+        self.window_s = window_s
+        self.max_entries = max_entries
+
+        self.hits = 0
+        self.misses = 0
+
+        # Key to (insertion time, value)
+        self._entries = OrderedDict()
+        self._lock = Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def _purge(self, now):
+        while self._entries:
+            key, (inserted, _) = next(iter(self._entries.items()))
+            if (
+                now - inserted < self.window_s
+                and len(self._entries) <= self.max_entries
+            ):
+                break
+            del self._entries[key]
+
+    def get_or_add(self, key, value):
+        """ Get the value of a key or add it atomically if not present
+
+        Args:
+            key: key to look for
+            value: value to add if key is not present
+
+        Returns: A tuple (found, value) with the value already in cache if found
+        """
+        with self._lock:
+            now = monotonic()
+            self._purge(now)
+
+            try:
+                _, cached = self._entries[key]
+                self.hits += 1
+                return True, cached
+            except KeyError:
+                self.misses += 1
+
+            self._entries[key] = (now, value)
+            self._purge(now)
+            return False, value
+
+    def update(self, key, value):
+        """ Update the value of a key still in cache
+
+        Insertion time is kept, so updating doesn't extend the entry life.
+
+        Args:
+            key: key to update
+            value: new value
+        """
+        with self._lock:
+            try:
+                inserted, _ = self._entries[key]
+            except KeyError:
+                return
+
+            self._entries[key] = (inserted, value)
+
+    def remove(self, key):
+        """ Remove a key from the cache, if present
+
+        Args:
+            key: key to remove
+        """
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def stats(self):
+        """ Get the cache statistics
+
+        Returns: A dict with the hits, misses and current number of entries
+        """
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "entries": len(self._entries),
+            }
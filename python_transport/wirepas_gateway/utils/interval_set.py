@@ -0,0 +1,84 @@
+"""
+    Interval set
+    ============
+
+    Contains a set of merged integer intervals.
+
+    .. Copyright:
+        Copyright 2019 Wirepas Ltd licensed under Apache License, Version 2.0
+        See file LICENSE for full license details.
+"""
+
+from bisect import bisect_left, bisect_right
+
+
+class IntervalSet:
+    """
+    Set of disjoint half-open intervals [start, end[
+
+    Added intervals are merged with the ones they overlap or touch, so an
+    area added several times is only counted once. Intervals are kept
+    sorted, so an insertion is found by bisection.
+
+    This class is not thread safe, caller must protect it if needed.
+
+    Args:
+        intervals: initial (start, end) intervals
+    """
+
+    def __init__(self, intervals=()):
+        # Sorted starts and ends of the disjoint intervals
+        self._starts = []
+        self._ends = []
+        self.covered = 0
+
+        for start, end in intervals:
+            self.add(start, end)
+
+    def __len__(self):
+        return len(self._starts)
+
+    def add(self, start, end):
+        """ Add the interval [start, end[ """
+        if end <= start:
+            return
+
+        # Intervals overlapping or touching the new one
+        first = bisect_left(self._ends, start)
+        last = bisect_right(self._starts, end)
+
+        if first < last:
+            start = min(start, self._starts[first])
+            end = max(end, self._ends[last - 1])
+            for i in range(first, last):
+                self.covered -= self._ends[i] - self._starts[i]
+
+        self._starts[first:last] = [start]
+        self._ends[first:last] = [end]
+        self.covered += end - start
+
+    def intervals(self):
+        """ Get the disjoint intervals of the set
+
+        Returns: A sorted list of (start, end) tuples
+        """
+        return list(zip(self._starts, self._ends))
+
+    def missing(self, start, end):
+        """ Get the parts of [start, end[ not covered by the set
+
+        Returns: A list of (start, end) tuples
+        """
+        gaps = []
+        current = start
+        for i in range(bisect_right(self._ends, start), len(self._starts)):
+            if self._starts[i] >= end:
+                break
+            if self._starts[i] > current:
+                gaps.append((current, self._starts[i]))
+            current = max(current, self._ends[i])
+
+        if current < end:
+            gaps.append((current, end))
+
+        return gaps
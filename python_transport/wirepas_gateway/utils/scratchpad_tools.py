@@ -0,0 +1,248 @@
+"""
+    Scratchpad tools
+    ================
+
+    Contains utilities to inspect and receive scratchpad images.
+
+    .. Copyright:
+        Copyright 2019 Wirepas Ltd licensed under Apache License, Version 2.0
+        See file LICENSE for full license details.
+"""
+
+import json
+import logging
+import os
+import struct
+import tempfile
+import time
+from urllib.parse import quote, unquote
+
+from .interval_set import IntervalSet
+
+# A scratchpad image starts with a 16 bytes tag followed by its header
+SCRATCHPAD_TAG = b"SCR1\x9a\x93\x30\x82\xd9\xeb\x0a\xfc\x31\x21\xe3\x37"
+
+# Header fields: length, crc, seq, flags, type, status
+SCRATCHPAD_HEADER_FORMAT = "<IHBBII"
+
+SCRATCHPAD_HEADER_END = len(SCRATCHPAD_TAG) + struct.calcsize(
+    SCRATCHPAD_HEADER_FORMAT
+)
+
+
+def get_scratchpad_crc(image):
+    """ Get the crc of a scratchpad image, as reported by the node once stored
+
+    Args:
+        image: the scratchpad image, or at least its first bytes
+
+    Returns: The crc or None if the image doesn't start with a valid header
+    """
+    if len(image) < SCRATCHPAD_HEADER_END:
+        return None
+
+    if bytes(image[: len(SCRATCHPAD_TAG)]) != SCRATCHPAD_TAG:
+        return None
+
+    _, crc, _, _, _, _ = struct.unpack_from(
+        SCRATCHPAD_HEADER_FORMAT, image, len(SCRATCHPAD_TAG)
+    )
+    return crc
+
+
+class PartialScratchpad:
+    """
+    Scratchpad being received by chunks
+
+    Chunks are written at their offset in a file, and the received
+    ranges are tracked. If a directory is given, the file and its
+    description are kept in it, so the reception can be resumed after a
+    restart of the gateway. Otherwise a temporary file is used.
+
+    Use create or load to get an instance.
+
+    Args:
+        key: identifier of the upload (ie the targeted sink id)
+        seq: sequence of the scratchpad
+        total_size: size of the full scratchpad
+        file: file object the chunks are written in
+        received: IntervalSet of the received ranges
+        directory: directory to persist the scratchpad in, or None
+    """
+
+    FILE_SUFFIX = ".scratchpad"
+    DESCRIPTION_SUFFIX = ".json"
+    TMP_SUFFIX = ".tmp"
+
+    def __init__(self, key, seq, total_size, file, received, directory=None):
+        self.key = key
+        self.seq = seq
+        self.total_size = total_size
+        self.file = file
+        self.received = received
+        self.directory = directory
+        # Crc read from scratchpad header, if received
+        self.crc = None
+        # Set if all sinks already store this scratchpad
+        self.stored = False
+        self.last_update = time.time()
+
+    @staticmethod
+    def _paths(directory, key):
+        # Key comes from the backend, it is escaped to stay in the directory
+        base = os.path.join(directory, quote(key, safe=""))
+        return (
+            base + PartialScratchpad.FILE_SUFFIX,
+            base + PartialScratchpad.DESCRIPTION_SUFFIX,
+        )
+
+    @classmethod
+    def create(cls, key, seq, total_size, directory=None):
+        """ Start the reception of a new scratchpad """
+        if directory is None:
+            file = tempfile.TemporaryFile()
+        else:
+            file_path, _ = cls._paths(directory, key)
+            file = open(file_path, "w+b")
+
+        file.truncate(total_size)
+        scratchpad = cls(key, seq, total_size, file, IntervalSet(), directory)
+        scratchpad.save()
+        return scratchpad
+
+    @classmethod
+    def load(cls, key, directory, ttl_s):
+        """ Resume the reception of a scratchpad persisted in a directory
+
+        Returns: The PartialScratchpad or None if there is none or it expired
+        """
+        if directory is None:
+            return None
+
+        file_path, description_path = cls._paths(directory, key)
+        try:
+            with open(description_path) as f:
+                description = json.load(f)
+
+            if time.time() - description["last_update"] > ttl_s:
+                logging.info("Partial scratchpad for %s expired", key)
+                cls.remove(key, directory)
+                return None
+
+            file = open(file_path, "r+b")
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError, KeyError) as e:
+            logging.error("Cannot load partial scratchpad for %s: %s", key, e)
+            cls.remove(key, directory)
+            return None
+
+        scratchpad = cls(
+            key,
+            description["seq"],
+            description["total_size"],
+            file,
+            IntervalSet(description["received"]),
+            directory,
+        )
+        scratchpad.crc = description.get("crc")
+        scratchpad.stored = description.get("stored", False)
+        scratchpad.last_update = description["last_update"]
+
+        logging.info(
+            "Partial scratchpad for %s resumed (%d/%d bytes)",
+            key,
+            scratchpad.received.covered,
+            scratchpad.total_size,
+        )
+        return scratchpad
+
+    @classmethod
+    def remove(cls, key, directory):
+        """ Remove a persisted scratchpad """
+        for path in cls._paths(directory, key):
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+
+    @classmethod
+    def purge_expired(cls, directory, ttl_s):
+        """ Remove the persisted scratchpads not updated since ttl_s """
+        if directory is None:
+            return
+
+        now = time.time()
+        for name in os.listdir(directory):
+            path = os.path.join(directory, name)
+            try:
+                if name.endswith(cls.TMP_SUFFIX):
+                    # Left by an interrupted save
+                    if now - os.path.getmtime(path) > ttl_s:
+                        os.remove(path)
+                    continue
+
+                if not name.endswith(cls.DESCRIPTION_SUFFIX):
+                    continue
+
+                if now - os.path.getmtime(path) > ttl_s:
+                    key = unquote(name[: -len(cls.DESCRIPTION_SUFFIX)])
+                    logging.info("Remove expired partial scratchpad for %s", key)
+                    cls.remove(key, directory)
+            except OSError:
+                pass
+
+    def is_expired(self, ttl_s):
+        return time.time() - self.last_update > ttl_s
+
+    def write(self, offset, chunk):
+        """ Write a chunk at its place and record it as received """
+        if not self.stored:
+            os.pwrite(self.file.fileno(), chunk, offset)
+        self.received.add(offset, offset + len(chunk))
+        self.last_update = time.time()
+        self.save()
+
+    def save(self):
+        """ Persist the description of the scratchpad, if a directory is set """
+        if self.directory is None:
+            return
+
+        self.file.flush()
+        os.fsync(self.file.fileno())
+
+        _, description_path = self._paths(self.directory, self.key)
+        # Unique temporary name, in the same directory to be renamed
+        with tempfile.NamedTemporaryFile(
+            "w", dir=self.directory, suffix=self.TMP_SUFFIX, delete=False
+        ) as f:
+            try:
+                json.dump(
+                    {
+                        "seq": self.seq,
+                        "total_size": self.total_size,
+                        "received": self.received.intervals(),
+                        "crc": self.crc,
+                        "stored": self.stored,
+                        "last_update": self.last_update,
+                    },
+                    f,
+                )
+            except BaseException:
+                os.remove(f.name)
+                raise
+        # Atomic replacement, description is never seen half written
+        os.replace(f.name, description_path)
+
+    def missing(self):
+        """ Get the ranges not received yet, as (start, end) tuples """
+        return self.received.missing(0, self.total_size)
+
+    def is_complete(self):
+        return self.received.covered >= self.total_size
+
+    def close(self):
+        """ Close the scratchpad and remove it if persisted """
+        self.file.close()
+        if self.directory is not None:
+            self.remove(self.key, self.directory)
@@ -0,0 +1,120 @@
+"""
+    Sink cost controller
+    ====================
+
+    Contains a controller to derive the sink cost from the publish queue state.
+
+    .. Copyright:
+        Copyright 2019 Wirepas Ltd licensed under Apache License, Version 2.0
+        See file LICENSE for full license details.
+"""
+
+
+class SinkCostController:
+    """
+    Proportional sink cost controller
+
+    The load of the connection to the backend is estimated from the publish
+    queue depth (relative to max_buffered_packets), its growth rate and the
+    time since the last successful publish (relative to
+    max_delay_without_publish). This load, between 0 and 1, is smoothed and
+    mapped linearly between the minimum and maximum sink costs. The cost
+    change is limited at each update, so traffic moves progressively to
+    the neighbouring gateways.
+
+    This class is not thread safe, caller must protect it if needed.
+
+    Args:
+        minimum_cost: cost when the connection is not loaded
+        max_buffered_packets: queue depth considered as full load (0 to ignore)
+        max_delay_without_publish: delay without publish in s considered as
+                                   full load (0 to ignore)
+        maximum_cost: cost at full load
+        smoothing: weight of a new load sample, between 0 (frozen) and 1
+                   (no smoothing)
+        max_step: maximum cost change at each update
+        growth_horizon_s: the queue growth is projected over this horizon
+    """
+
+    def __init__(
+        self,
+        minimum_cost,
+        max_buffered_packets,
+        max_delay_without_publish,
+        maximum_cost=254,
+        smoothing=0.3,
+        max_step=16,
+        growth_horizon_s=5,
+    ):
+        if not 0 < smoothing <= 1:
+            raise ValueError("Smoothing must be in ]0, 1]")
+
+        if max_step <= 0:
+            raise ValueError("Maximum cost step must be positive")
+
+        self.minimum_cost = minimum_cost
+        self.maximum_cost = maximum_cost
+        self.max_buffered_packets = max_buffered_packets
+        self.max_delay_without_publish = max_delay_without_publish
+        self.smoothing = smoothing
+        self.max_step = max_step
+        self.growth_horizon_s = growth_horizon_s
+
+        self.cost = minimum_cost
+        self.load = 0.0
+
+        # Previous sample to estimate the queue growth rate
+        self._last_queue_size = 0
+        self._last_time = None
+
+    def _instant_load(self, queue_size, waiting_time_s, now):
+        load = 0.0
+
+        if self.max_buffered_packets > 0:
+            projected_size = queue_size
+            if self._last_time is not None and now > self._last_time:
+                # Negative when the queue is draining
+                growth_rate = (queue_size - self._last_queue_size) / (
+                    now - self._last_time
+                )
+                projected_size += growth_rate * self.growth_horizon_s
+
+            load = max(load, projected_size / self.max_buffered_packets)
+
+        if self.max_delay_without_publish > 0:
+            load = max(load, waiting_time_s / self.max_delay_without_publish)
+
+        return min(max(load, 0.0), 1.0)
+
+    def update(self, queue_size, waiting_time_s, now):
+        """ Update the cost with a new sample of the publish queue
+
+        Args:
+            queue_size: number of messages waiting to be published
+            waiting_time_s: time since last publish with messages waiting
+            now: time of the sample in s (monotonic time base)
+
+        Returns: The new sink cost
+        """
+        instant_load = self._instant_load(queue_size, waiting_time_s, now)
+        self._last_queue_size = queue_size
+        self._last_time = now
+
+        if queue_size == 0:
+            # Nothing waiting, connection is fine whatever the history
+            self.load = 0.0
+        else:
+            self.load += self.smoothing * (instant_load - self.load)
+
+        target = round(
+            self.minimum_cost + self.load * (self.maximum_cost - self.minimum_cost)
+        )
+
+        step = max(-self.max_step, min(self.max_step, target - self.cost))
+        self.cost += step
+
+        return self.cost
+
+    def is_settled(self):
+        """ Check if cost is back to its minimum and needs no more updates """
+        return self.cost == self.minimum_cost and self.load == 0.0
@@ -0,0 +1,150 @@
+"""
+    Timer wheel
+    ===========
+
+    Contains a hashed timer wheel to hold items until a given time.
+
+    .. Copyright:
+        Copyright 2019 Wirepas Ltd licensed under Apache License, Version 2.0
+        See file LICENSE for full license details.
+"""
+
+import math
+
+
+class TimerWheel:
+    """
+    Hashed timer wheel
+
+    Items are hashed by their expiration tick into a fixed number of slots,
+    so adding, cancelling and expiring an item are O(1) on average whatever
+    the number of pending items. Items expiring more than one wheel turn
+    ahead simply stay in their slot until the right turn.
+
+    This class is not thread safe, caller must protect it if needed.
+
+    Args:
+        tick_s: duration of a tick in seconds (resolution of the wheel)
+        slots: number of slots of the wheel
+        now: initial time of the wheel (same time base as deadlines)
+    """
+
+    def __init__(self, tick_s, slots=512, now=0):
+        if tick_s <= 0 or slots <= 0:
+            raise ValueError("Wrong timer wheel dimension")
+
+        self.tick_s = tick_s
+        self._slots = [dict() for _ in range(slots)]
+        # Key to slot index, to cancel an item without searching it
+        self._keys = dict()
+        self._current_tick = self._tick_of(now)
+
+    def _tick_of(self, t):
+        # Round up so that an item never expires before its deadline
+        return math.ceil(t / self.tick_s)
+
+    def __len__(self):
+        return len(self._keys)
+
+    def __contains__(self, key):
+        return key in self._keys
+
+    def add(self, key, deadline, item):
+        """ Add an item to the wheel
+
+        Args:
+            key: unique key of the item, used for cancellation
+            deadline: time at which the item expires
+            item: the item to hold
+
+        Raises:
+            KeyError: if an item with the same key is already in the wheel
+        """
+        if key in self._keys:
+            raise KeyError("Key {} already in timer wheel".format(key))
+
+        # An item already expired is served on next expiration check
+        tick = max(self._tick_of(deadline), self._current_tick)
+        index = tick % len(self._slots)
+        self._slots[index][key] = (tick, deadline, item)
+        self._keys[key] = index
+
+    def cancel(self, key):
+        """ Remove an item from the wheel
+
+        Args:
+            key: key of the item to remove
+
+        Returns: The item removed or None if not in the wheel
+        """
+        try:
+            index = self._keys.pop(key)
+        except KeyError:
+            return None
+
+        _, _, item = self._slots[index].pop(key)
+        return item
+
+    def items(self):
+        """ Get all pending items
+
+        Returns: A list of (key, deadline, item) sorted by deadline
+        """
+        pending = list()
+        for key, index in self._keys.items():
+            _, deadline, item = self._slots[index][key]
+            pending.append((key, deadline, item))
+
+        return sorted(pending, key=lambda entry: entry[1])
+
+    def pop_expired(self, now):
+        """ Remove the expired items from the wheel
+
+        Args:
+            now: current time
+
+        Returns: A list of (key, deadline, item) sorted by deadline
+        """
+        now_tick = math.floor(now / self.tick_s)
+        if now_tick < self._current_tick:
+            return []
+
+        if now_tick - self._current_tick >= len(self._slots):
+            # A full turn has elapsed, every slot must be checked
+            indexes = range(len(self._slots))
+        else:
+            indexes = (
+                tick % len(self._slots)
+                for tick in range(self._current_tick, now_tick + 1)
+            )
+
+        expired = list()
+        for index in indexes:
+            slot = self._slots[index]
+            for key in [k for k, (tick, _, _) in slot.items() if tick <= now_tick]:
+                _, deadline, item = slot.pop(key)
+                del self._keys[key]
+                expired.append((key, deadline, item))
+
+        self._current_tick = now_tick
+        return sorted(expired, key=lambda entry: entry[1])
+
+    def next_expiration(self):
+        """ Get the next expiration time
+
+        The result has the resolution of the wheel, it is only a hint on
+        when to check again for expired items.
+
+        Returns: The time of the first tick with an item to expire or None if empty
+        """
+        if not self._keys:
+            return None
+
+        for distance in range(len(self._slots)):
+            tick = self._current_tick + distance
+            slot = self._slots[tick % len(self._slots)]
+            if any(entry_tick <= tick for entry_tick, _, _ in slot.values()):
+                return tick * self.tick_s
+
+        # Only items planned for next turns, check again after this one
+        return (self._current_tick + len(self._slots)) * self.tick_s
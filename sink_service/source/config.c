@@ -7,10 +7,13 @@
 #include <stddef.h>
 #include <stdlib.h>
 #include <stdbool.h>
+#include <stdarg.h>
 #include <errno.h>
+#include <time.h>
 
 #include "config.h"
 #include "config_macros.h"
+#include "otap.h"
 #include "wpc.h"
 
 #define LOG_MODULE_NAME "Config"
@@ -48,6 +51,74 @@ static char * m_interface = NULL;
 /** Bus slot used to register the Vtable */
 static sd_bus_slot * m_slot = NULL;
 
+/** Max number of config data items read from node */
+#define MAX_CDD_ITEMS 64
+
+typedef struct
+{
+    uint16_t endpoint;
+    uint8_t size;
+    uint8_t payload[UINT8_MAX];
+} cdd_item_t;
+
+/** Config data items read from node, only accessed from bus loop */
+static struct
+{
+    /** Generation the items were read at */
+    uint32_t generation;
+    /** Monotonic time in s the items were read at */
+    time_t read_time_s;
+    bool valid;
+    uint8_t count;
+    cdd_item_t items[MAX_CDD_ITEMS];
+} m_cdd_cache;
+
+/** Incremented (from any thread) each time config data items may change */
+static uint32_t m_cdd_generation = 0;
+
+/** Max time in s the config data items are served from cache */
+static unsigned int m_cdd_cache_max_age_s = 0;
+
+static time_t get_monotonic_s()
+{
+    struct timespec now;
+    clock_gettime(CLOCK_MONOTONIC, &now);
+    return now.tv_sec;
+}
+
+static void invalidate_cdd_cache()
+{
+    __atomic_add_fetch(&m_cdd_generation, 1, __ATOMIC_SEQ_CST);
+}
+
+static bool is_cdd_cache_valid()
+{
+    /* Age is also checked as a change done by a remote node (ie through
+     * otap or a diagnostic) is not notified */
+    return m_cdd_cache.valid &&
+           m_cdd_cache.generation == __atomic_load_n(&m_cdd_generation, __ATOMIC_SEQ_CST) &&
+           get_monotonic_s() - m_cdd_cache.read_time_s < (time_t) m_cdd_cache_max_age_s;
+}
+
+/** Helper macro to notify that some properties read from node have changed */
+#define EMIT_PROPERTIES_CHANGED(...) \
+    emit_properties_changed((char *[]){__VA_ARGS__, NULL})
+
+/**
+ * \brief   Send a PropertiesChanged signal invalidating properties
+ * \param   names
+ *          NULL terminated list of property names, or NULL for all the
+ *          properties that can change
+ */
+static void emit_properties_changed(char ** names)
+{
+    int r = sd_bus_emit_properties_changed_strv(m_bus, m_object, m_interface, names);
+    if (r < 0)
+    {
+        LOGE("Cannot send properties changed signal: %s\n", strerror(-r));
+    }
+}
+
 /**********************************************************************
  *               DBUS Property handler definition (R/W)               *
  **********************************************************************/
@@ -243,6 +314,7 @@ static int set_cipher_key(sd_bus * bus,
         return -EINVAL;
     }
 
+    EMIT_PROPERTIES_CHANGED("CipherKeySet");
     return 0;
 }
 
@@ -266,6 +338,7 @@ static int set_authen_key(sd_bus * bus,
         return -EINVAL;
     }
 
+    EMIT_PROPERTIES_CHANGED("AuthenticationKeySet");
     return 0;
 }
 
@@ -321,6 +394,9 @@ static int set_stack_state(sd_bus_message * m, void * userdata, sd_bus_error * e
         return r;
     }
 
+    /* Items may be changed while the stack is stopped */
+    invalidate_cdd_cache();
+
     if (state)
     {
         res = WPC_start_stack();
@@ -346,6 +422,10 @@ static int set_stack_state(sd_bus_message * m, void * userdata, sd_bus_error * e
     {
         LOGE("Set stack state (%d) res = %d\n", state, res);
     }
+    else
+    {
+        EMIT_PROPERTIES_CHANGED("StackStatus");
+    }
 
     /* Reply with the response */
     return sd_bus_reply_method_return(m, "b", res == APP_RES_OK);
@@ -363,6 +443,8 @@ static int clear_cipher_key(sd_bus_message * m, void * userdata, sd_bus_error *
         SET_WPC_ERROR(error, "WPC_remove_cipher_key", res);
         return -EINVAL;
     }
+
+    EMIT_PROPERTIES_CHANGED("CipherKeySet");
     // No return code
     return sd_bus_reply_method_return(m, "");
 }
@@ -380,6 +462,8 @@ static int clear_authen_key(sd_bus_message * m, void * userdata, sd_bus_error *
         return -EINVAL;
     }
 
+    EMIT_PROPERTIES_CHANGED("AuthenticationKeySet");
+
     // No return code
     return sd_bus_reply_method_return(m, "");
 }
@@ -523,6 +607,8 @@ static int set_ac_range(sd_bus_message * m, void * userdata, sd_bus_error * erro
         return -EINVAL;
     }
 
+    EMIT_PROPERTIES_CHANGED("ACRangeMinCur", "ACRangeMaxCur", "CurrentAC");
+
     /* Reply with the response */
     return sd_bus_reply_method_return(m, "b", true);
 }
@@ -564,6 +650,7 @@ static int set_config_data_item(sd_bus_message *m, void *userdata, sd_bus_error
         return -EINVAL;
     }
 
+    invalidate_cdd_cache();
     const app_res_e wpc_res = WPC_set_config_data_item(endpoint, payload, (uint8_t) payload_size);
     if (APP_RES_OK != wpc_res) {
         SET_WPC_ERROR(error, "WPC_set_config_data_item", wpc_res);
@@ -594,6 +681,22 @@ static int get_cdd_item_and_append_payload_to_message(sd_bus_message *const mess
 {
     uint8_t payload[UINT8_MAX];
     uint8_t payload_size = 0;
+
+    if (is_cdd_cache_valid())
+    {
+        for (uint8_t i = 0; i < m_cdd_cache.count; i++)
+        {
+            if (m_cdd_cache.items[i].endpoint == endpoint)
+            {
+                return sd_bus_message_append_array(message,
+                                                   'y',
+                                                   m_cdd_cache.items[i].payload,
+                                                   m_cdd_cache.items[i].size);
+            }
+        }
+        /* Not in the list, let the node answer */
+    }
+
     const app_res_e wpc_res = WPC_get_config_data_item(endpoint, payload, sizeof(payload), &payload_size);
     if (APP_RES_OK != wpc_res)
     {
@@ -606,31 +709,40 @@ static int get_cdd_item_and_append_payload_to_message(sd_bus_message *const mess
 }
 
 /**
- * \brief   Append config data items to the given message
+ * \brief   Read the config data items from node if not cached
  *
- * Reads the config data items and appends them the given message as containers
- * (uint16_t endpoint + byte array for the payload).
+ * Items are kept until the cache is invalidated by a change of an item or a
+ * stack boot.
  *
- * \param   message
- *          Message to append the config data items to
  * \param   error
  *          Pointer to the sd_bus error of the request message
  * \return  On success, a non-negative value. On failure, a negative errno-style
  *          code consistent with other sd_bus methods.
  */
-static int get_cdd_items_and_append_to_message(sd_bus_message *const message,
-                                               sd_bus_error *const error)
+static int refresh_cdd_cache(sd_bus_error *const error)
 {
-    const size_t MAX_ENDPOINT_COUNT = 64;
-    uint16_t endpoints[MAX_ENDPOINT_COUNT];
+    uint16_t endpoints[MAX_CDD_ITEMS];
     uint8_t num_of_items;
+
+    if (is_cdd_cache_valid())
+    {
+        LOGD("Config data items read from cache\n");
+        return 0;
+    }
+
+    /* Items read after an invalidation must not be seen as valid */
+    const uint32_t generation = __atomic_load_n(&m_cdd_generation, __ATOMIC_SEQ_CST);
+    m_cdd_cache.valid = false;
+    m_cdd_cache.count = 0;
+    m_cdd_cache.read_time_s = get_monotonic_s();
+
     const app_res_e wpc_res = WPC_get_config_data_item_list(endpoints,
                                                             sizeof(endpoints),
                                                             &num_of_items);
     if (APP_RES_OPERATION_NOT_SUPPORTED == wpc_res)
     {
         LOGW("Stack doesn't support getting config data item list, returning empty list.\n");
-        return 0;
+        num_of_items = 0;
     }
     else if (APP_RES_OK != wpc_res)
     {
@@ -639,10 +751,55 @@ static int get_cdd_items_and_append_to_message(sd_bus_message *const message,
         return -EINVAL;
     }
 
-    int r = 0;
-    for (uint8_t i = 0; i < num_of_items && i < MAX_ENDPOINT_COUNT; i++)
+    for (uint8_t i = 0; i < num_of_items && i < MAX_CDD_ITEMS; i++)
     {
-        const uint16_t endpoint = endpoints[i];
+        cdd_item_t * item = &m_cdd_cache.items[i];
+        item->endpoint = endpoints[i];
+
+        const app_res_e item_res = WPC_get_config_data_item(item->endpoint,
+                                                             item->payload,
+                                                             sizeof(item->payload),
+                                                             &item->size);
+        if (APP_RES_OK != item_res)
+        {
+            SET_WPC_ERROR(error, "WPC_get_config_data_item", item_res);
+            LOGE("Cannot get config data item (ret=%d)\n", item_res);
+            return -EINVAL;
+        }
+        m_cdd_cache.count++;
+    }
+
+    m_cdd_cache.generation = generation;
+    m_cdd_cache.valid = true;
+
+    return 0;
+}
+
+/**
+ * \brief   Append config data items to the given message
+ *
+ * Reads the config data items (from cache if possible) and appends them the
+ * given message as containers (uint16_t endpoint + byte array for the payload).
+ *
+ * \param   message
+ *          Message to append the config data items to
+ * \param   error
+ *          Pointer to the sd_bus error of the request message
+ * \return  On success, a non-negative value. On failure, a negative errno-style
+ *          code consistent with other sd_bus methods.
+ */
+static int get_cdd_items_and_append_to_message(sd_bus_message *const message,
+                                               sd_bus_error *const error)
+{
+    int r = refresh_cdd_cache(error);
+    if (r < 0)
+    {
+        return r;
+    }
+
+    for (uint8_t i = 0; i < m_cdd_cache.count; i++)
+    {
+        const cdd_item_t * item = &m_cdd_cache.items[i];
         r = sd_bus_message_open_container(message, SD_BUS_TYPE_STRUCT, "qay");
         if (r < 0)
         {
@@ -651,7 +808,7 @@ static int get_cdd_items_and_append_to_message(sd_bus_message *const message,
             return r;
         }
 
-        r = sd_bus_message_append(message, "q", endpoint);
+        r = sd_bus_message_append(message, "q", item->endpoint);
         if (r < 0)
         {
             sd_bus_error_set_errno(error, r);
@@ -659,7 +816,7 @@ static int get_cdd_items_and_append_to_message(sd_bus_message *const message,
             return r;
         }
 
-        r = get_cdd_item_and_append_payload_to_message(message, error, endpoint);
+        r = sd_bus_message_append_array(message, 'y', item->payload, item->size);
         if (r < 0)
         {
             sd_bus_error_set_errno(error, r);
@@ -676,7 +833,7 @@ static int get_cdd_items_and_append_to_message(sd_bus_message *const message,
         }
     }
 
-    LOGD("Preparing response with %d config data items\n", num_of_items);
+    LOGD("Preparing response with %d config data items\n", m_cdd_cache.count);
 
     return r;
 }
@@ -781,6 +938,362 @@ static int get_config_data_content(sd_bus_message *m, void *userdata, sd_bus_err
     return sd_bus_send(sd_bus_message_get_bus(reply), reply, NULL);
 }
 
+/**
+ * \brief   Open a dictionary entry of a a{sv} container
+ * \param   m
+ *          Message with an opened a{sv} container
+ * \param   key
+ *          Key of the entry
+ * \param   type
+ *          Dbus type of the value
+ * \return  On success, a non-negative value. On failure, a negative errno-style code
+ * \note    Value must be appended before calling close_dict_entry
+ */
+static int open_dict_entry(sd_bus_message * m, const char * key, const char * type)
+{
+    int r = sd_bus_message_open_container(m, SD_BUS_TYPE_DICT_ENTRY, "sv");
+    if (r < 0)
+    {
+        return r;
+    }
+
+    r = sd_bus_message_append(m, "s", key);
+    if (r < 0)
+    {
+        return r;
+    }
+
+    return sd_bus_message_open_container(m, SD_BUS_TYPE_VARIANT, type);
+}
+
+/**
+ * \brief   Close a dictionary entry opened with open_dict_entry
+ */
+static int close_dict_entry(sd_bus_message * m)
+{
+    int r = sd_bus_message_close_container(m);
+    if (r < 0)
+    {
+        return r;
+    }
+
+    return sd_bus_message_close_container(m);
+}
+
+/**
+ * \brief   Append a dictionary entry with a basic value to a a{sv} container
+ * \param   ... value(s) of the entry, as for sd_bus_message_append
+ */
+static int append_dict_entry(sd_bus_message * m, const char * key, const char * type, ...)
+{
+    va_list ap;
+    int r = open_dict_entry(m, key, type);
+    if (r < 0)
+    {
+        return r;
+    }
+
+    va_start(ap, type);
+    r = sd_bus_message_appendv(m, type, ap);
+    va_end(ap);
+    if (r < 0)
+    {
+        return r;
+    }
+
+    return close_dict_entry(m);
+}
+
+/** Helper macro to append a value read from node, if it can be read */
+#define APPEND_NODE_VALUE(m, key, func, c_type, dbus_type)     \
+    do                                                         \
+    {                                                          \
+        c_type var;                                            \
+        if (func(&var) == APP_RES_OK)                          \
+        {                                                      \
+            int ret = append_dict_entry(m, key, dbus_type, var); \
+            if (ret < 0)                                       \
+            {                                                  \
+                return ret;                                    \
+            }                                                  \
+        }                                                      \
+    } while (0)
+
+/**
+ * \brief   Append the config values read from node to a a{sv} container
+ * \note    Values that cannot be read are not appended
+ */
+static int append_node_config(sd_bus_message * m)
+{
+    uint16_t min, max;
+    int r;
+
+    APPEND_NODE_VALUE(m, "StackStatus", WPC_get_stack_status, uint8_t, "y");
+    APPEND_NODE_VALUE(m, "NodeAddress", WPC_get_node_address, uint32_t, "u");
+    APPEND_NODE_VALUE(m, "NodeRole", WPC_get_role, uint8_t, "y");
+    APPEND_NODE_VALUE(m, "NetworkAddress", WPC_get_network_address, uint32_t, "u");
+    APPEND_NODE_VALUE(m, "NetworkChannel", WPC_get_network_channel, uint8_t, "y");
+    APPEND_NODE_VALUE(m, "CurrentAC", WPC_get_current_access_cycle, uint16_t, "q");
+    APPEND_NODE_VALUE(m, "CipherKeySet", WPC_is_cipher_key_set, bool, "b");
+    APPEND_NODE_VALUE(m, "AuthenticationKeySet", WPC_is_authentication_key_set, bool, "b");
+
+    if (m_sink_config.version[0] < 4)
+    {
+        /* No need to ask channel map if stack >= 4 */
+        APPEND_NODE_VALUE(m, "ChannelMap", WPC_get_channel_map, uint32_t, "u");
+    }
+
+    if (WPC_get_access_cycle_range(&min, &max) == APP_RES_OK)
+    {
+        r = append_dict_entry(m, "ACRangeMinCur", "q", min);
+        if (r < 0)
+        {
+            return r;
+        }
+
+        r = append_dict_entry(m, "ACRangeMaxCur", "q", max);
+        if (r < 0)
+        {
+            return r;
+        }
+    }
+
+    return 0;
+}
+
+/**
+ * \brief   Append the static config values to a a{sv} container
+ */
+static int append_static_config(sd_bus_message * m)
+{
+    int r;
+
+    r = append_dict_entry(m, "StackProfile", "q", m_sink_config.stack_profile);
+    if (r >= 0)
+        r = append_dict_entry(m, "HwMagic", "q", m_sink_config.hw_magic);
+    if (r >= 0)
+        r = append_dict_entry(m, "MaxMtu", "y", m_sink_config.max_mtu);
+    if (r >= 0)
+        r = append_dict_entry(m, "ChRangeMin", "y", m_sink_config.ch_range_min);
+    if (r >= 0)
+        r = append_dict_entry(m, "ChRangeMax", "y", m_sink_config.ch_range_max);
+    if (r >= 0)
+        r = append_dict_entry(m, "ACRangeMin", "q", m_sink_config.ac_range_min);
+    if (r >= 0)
+        r = append_dict_entry(m, "ACRangeMax", "q", m_sink_config.ac_range_max);
+    if (r >= 0)
+        r = append_dict_entry(m, "PDUBufferSize", "y", m_sink_config.pdu_buffer_size);
+    if (r >= 0)
+        r = append_dict_entry(m, "AppConfigMaxSize", "q", m_sink_config.app_config_max_size);
+    if (r < 0)
+    {
+        return r;
+    }
+
+    r = open_dict_entry(m, "FirmwareVersion", "aq");
+    if (r < 0)
+    {
+        return r;
+    }
+
+    r = sd_bus_message_append_array(m,
+                                    'q',
+                                    m_sink_config.version,
+                                    sizeof(m_sink_config.version));
+    if (r < 0)
+    {
+        return r;
+    }
+
+    return close_dict_entry(m);
+}
+
+/**
+ * \brief   Append the app config to a a{sv} container, if set
+ */
+static int append_app_config(sd_bus_message * m)
+{
+    uint8_t seq;
+    uint16_t interval;
+    uint8_t app_config[MAX_APP_CONFIG_SIZE];
+    uint8_t size;
+    int r;
+
+    if (WPC_get_app_config_data_size(&size) != APP_RES_OK || size > MAX_APP_CONFIG_SIZE)
+    {
+        LOGE("Cannot determine app config size\n");
+        return 0;
+    }
+
+    if (WPC_get_app_config_data(&seq, &interval, app_config, size) != APP_RES_OK)
+    {
+        /* No app config set */
+        return 0;
+    }
+
+    r = open_dict_entry(m, "AppConfig", "(yqay)");
+    if (r < 0)
+    {
+        return r;
+    }
+
+    r = sd_bus_message_open_container(m, SD_BUS_TYPE_STRUCT, "yqay");
+    if (r < 0)
+    {
+        return r;
+    }
+
+    r = sd_bus_message_append(m, "yq", seq, interval);
+    if (r < 0)
+    {
+        return r;
+    }
+
+    r = sd_bus_message_append_array(m, 'y', app_config, size);
+    if (r < 0)
+    {
+        return r;
+    }
+
+    r = sd_bus_message_close_container(m);
+    if (r < 0)
+    {
+        return r;
+    }
+
+    return close_dict_entry(m);
+}
+
+/**
+ * \brief   Append the scratchpad status to a a{sv} container
+ */
+static int append_scratchpad_status(sd_bus_message * m)
+{
+    const sink_otap_t * otap = Otap_Get_Status();
+    uint8_t target_seq;
+    uint16_t target_crc;
+    uint8_t action;
+    uint8_t param;
+    int r;
+
+    r = append_dict_entry(m, "StoredLen", "u", otap->stored_len);
+    if (r >= 0)
+        r = append_dict_entry(m, "StoredCrc", "q", otap->stored_crc);
+    if (r >= 0)
+        r = append_dict_entry(m, "StoredSeq", "y", otap->stored_seq);
+    if (r >= 0)
+        r = append_dict_entry(m, "StoredStatus", "y", otap->stored_status);
+    if (r >= 0)
+        r = append_dict_entry(m, "StoredType", "y", otap->stored_type);
+    if (r >= 0)
+        r = append_dict_entry(m, "ProcessedLen", "u", otap->processed_len);
+    if (r >= 0)
+        r = append_dict_entry(m, "ProcessedCrc", "q", otap->processed_crc);
+    if (r >= 0)
+        r = append_dict_entry(m, "ProcessedSeq", "y", otap->processed_seq);
+    if (r >= 0)
+        r = append_dict_entry(m, "FirmwareAreaId", "u", otap->firmware_area_id);
+    if (r < 0)
+    {
+        return r;
+    }
+
+    /* Target scratchpad is only supported from 5.1 */
+    if (m_sink_config.version[0] < 5 ||
+        (m_sink_config.version[0] == 5 && m_sink_config.version[1] == 0))
+    {
+        return 0;
+    }
+
+    if (WPC_read_target_scratchpad(&target_seq, &target_crc, &action, &param) != APP_RES_OK)
+    {
+        LOGE("Cannot read target scratchpad\n");
+        return 0;
+    }
+
+    r = open_dict_entry(m, "TargetScratchpad", "(yqyy)");
+    if (r < 0)
+    {
+        return r;
+    }
+
+    r = sd_bus_message_append(m, "(yqyy)", target_seq, target_crc, action, param);
+    if (r < 0)
+    {
+        return r;
+    }
+
+    return close_dict_entry(m);
+}
+
+/**
+ * \brief   Get full config handler
+ *
+ * The reply message contains a dictionary of all the values exposed
+ * individually as properties (with same names) plus AppConfig,
+ * ConfigDataContent and TargetScratchpad as returned by their dedicated
+ * methods. Values that cannot be read from node are not part of it.
+ *
+ * \param   ... (from sd_bus function signature)
+ */
+static int get_full_config(sd_bus_message * m, void * userdata, sd_bus_error * error)
+{
+    __attribute__((cleanup(sd_bus_message_unrefp))) sd_bus_message *reply = NULL;
+
+    int r = sd_bus_message_new_method_return(m, &reply);
+    if (r < 0)
+    {
+        sd_bus_error_set_errno(error, r);
+        LOGE("Cannot create response message: %s\n", strerror(-r));
+        return r;
+    }
+
+    r = sd_bus_message_open_container(reply, SD_BUS_TYPE_ARRAY, "{sv}");
+    if (r >= 0)
+        r = append_node_config(reply);
+    if (r >= 0)
+        r = append_static_config(reply);
+    if (r >= 0)
+        r = append_app_config(reply);
+    if (r >= 0)
+        r = append_scratchpad_status(reply);
+    if (r < 0)
+    {
+        sd_bus_error_set_errno(error, r);
+        LOGE("Cannot append config to response: %s\n", strerror(-r));
+        return r;
+    }
+
+    if (is_cdd_api_supported())
+    {
+        r = open_dict_entry(reply, "ConfigDataContent", "a(qay)");
+        if (r >= 0)
+            r = sd_bus_message_open_container(reply, SD_BUS_TYPE_ARRAY, "(qay)");
+        if (r >= 0)
+            r = get_cdd_items_and_append_to_message(reply, error);
+        if (r >= 0)
+            r = sd_bus_message_close_container(reply);
+        if (r >= 0)
+            r = close_dict_entry(reply);
+        if (r < 0)
+        {
+            sd_bus_error_set_errno(error, r);
+            LOGE("Cannot add CDD items to response: %s\n", strerror(-r));
+            return r;
+        }
+    }
+
+    r = sd_bus_message_close_container(reply);
+    if (r < 0)
+    {
+        sd_bus_error_set_errno(error, r);
+        LOGE("Cannot close container in response: %s\n", strerror(-r));
+        return r;
+    }
+
+    return sd_bus_send(sd_bus_message_get_bus(reply), reply, NULL);
+}
+
 /**
  * \brief Read security keys from the message
  *
@@ -873,6 +1386,8 @@ static int set_network_security_keys(sd_bus_message *m, void *userdata, sd_bus_e
         return -EINVAL;
     }
 
+    EMIT_PROPERTIES_CHANGED("CipherKeySet", "AuthenticationKeySet");
+
     return sd_bus_reply_method_return(m, "");
 }
 
@@ -910,37 +1425,39 @@ static int set_management_security_keys(sd_bus_message *m, void *userdata, sd_bu
 static const sd_bus_vtable config_vtable[] = {
     SD_BUS_VTABLE_START(0),
 
-    /* Read only parameters backup-ed with a table (Read at boot up) */
-    SD_BUS_PROPERTY("StackProfile", "q", NULL, offsetof(sink_config_t, stack_profile), 0),
-    SD_BUS_PROPERTY("HwMagic", "q", NULL, offsetof(sink_config_t, hw_magic), 0),
-    SD_BUS_PROPERTY("MaxMtu", "y", NULL, offsetof(sink_config_t, max_mtu), 0),
-    SD_BUS_PROPERTY("ChRangeMin", "y", NULL, offsetof(sink_config_t, ch_range_min), 0),
-    SD_BUS_PROPERTY("ChRangeMax", "y", NULL, offsetof(sink_config_t, ch_range_max), 0),
-    SD_BUS_PROPERTY("ACRangeMin", "q", NULL, offsetof(sink_config_t, ac_range_min), 0),
-    SD_BUS_PROPERTY("ACRangeMax", "q", NULL, offsetof(sink_config_t, ac_range_max), 0),
-    SD_BUS_PROPERTY("PDUBufferSize", "y", NULL, offsetof(sink_config_t, pdu_buffer_size), 0),
-    SD_BUS_PROPERTY("AppConfigMaxSize", "q", NULL, offsetof(sink_config_t, app_config_max_size), 0),
-    SD_BUS_PROPERTY("FirmwareVersion", "aq", get_firmware_version, 0, 0),
+    /* Read only parameters backup-ed with a table (Read at boot up).
+     * They are constant for a given stack boot, clients must read them
+     * again on StackStarted/StackStopped signals */
+    SD_BUS_PROPERTY("StackProfile", "q", NULL, offsetof(sink_config_t, stack_profile), SD_BUS_VTABLE_PROPERTY_CONST),
+    SD_BUS_PROPERTY("HwMagic", "q", NULL, offsetof(sink_config_t, hw_magic), SD_BUS_VTABLE_PROPERTY_CONST),
+    SD_BUS_PROPERTY("MaxMtu", "y", NULL, offsetof(sink_config_t, max_mtu), SD_BUS_VTABLE_PROPERTY_CONST),
+    SD_BUS_PROPERTY("ChRangeMin", "y", NULL, offsetof(sink_config_t, ch_range_min), SD_BUS_VTABLE_PROPERTY_CONST),
+    SD_BUS_PROPERTY("ChRangeMax", "y", NULL, offsetof(sink_config_t, ch_range_max), SD_BUS_VTABLE_PROPERTY_CONST),
+    SD_BUS_PROPERTY("ACRangeMin", "q", NULL, offsetof(sink_config_t, ac_range_min), SD_BUS_VTABLE_PROPERTY_CONST),
+    SD_BUS_PROPERTY("ACRangeMax", "q", NULL, offsetof(sink_config_t, ac_range_max), SD_BUS_VTABLE_PROPERTY_CONST),
+    SD_BUS_PROPERTY("PDUBufferSize", "y", NULL, offsetof(sink_config_t, pdu_buffer_size), SD_BUS_VTABLE_PROPERTY_CONST),
+    SD_BUS_PROPERTY("AppConfigMaxSize", "q", NULL, offsetof(sink_config_t, app_config_max_size), SD_BUS_VTABLE_PROPERTY_CONST),
+    SD_BUS_PROPERTY("FirmwareVersion", "aq", get_firmware_version, 0, SD_BUS_VTABLE_PROPERTY_CONST),
 
     /* Read parameters with node interrogation */
-    SD_BUS_PROPERTY("CurrentAC", "q", current_ac_read_handler, 0, 0),
-    SD_BUS_PROPERTY("CipherKeySet", "b", cipher_key_read_handler, 0, 0),
-    SD_BUS_PROPERTY("AuthenticationKeySet", "b", authen_key_read_handler, 0, 0),
-    SD_BUS_PROPERTY("StackStatus", "y", stack_status_read_handler, 0, 0),
-    SD_BUS_PROPERTY("ACRangeMinCur", "q", cur_ac_range_handler, 0, 0),
-    SD_BUS_PROPERTY("ACRangeMaxCur", "q", cur_ac_range_handler, 0, 0),
+    SD_BUS_PROPERTY("CurrentAC", "q", current_ac_read_handler, 0, SD_BUS_VTABLE_PROPERTY_EMITS_INVALIDATION),
+    SD_BUS_PROPERTY("CipherKeySet", "b", cipher_key_read_handler, 0, SD_BUS_VTABLE_PROPERTY_EMITS_INVALIDATION),
+    SD_BUS_PROPERTY("AuthenticationKeySet", "b", authen_key_read_handler, 0, SD_BUS_VTABLE_PROPERTY_EMITS_INVALIDATION),
+    SD_BUS_PROPERTY("StackStatus", "y", stack_status_read_handler, 0, SD_BUS_VTABLE_PROPERTY_EMITS_INVALIDATION),
+    SD_BUS_PROPERTY("ACRangeMinCur", "q", cur_ac_range_handler, 0, SD_BUS_VTABLE_PROPERTY_EMITS_INVALIDATION),
+    SD_BUS_PROPERTY("ACRangeMaxCur", "q", cur_ac_range_handler, 0, SD_BUS_VTABLE_PROPERTY_EMITS_INVALIDATION),
 
     /* Read/Write parameters with node interrogation */
-    SD_BUS_WRITABLE_PROPERTY("NodeAddress", "u", node_add_read_handler, node_add_write_handler, 0, 0),
-    SD_BUS_WRITABLE_PROPERTY("NodeRole", "y", node_role_read_handler, node_role_write_handler, 0, 0),
-    SD_BUS_WRITABLE_PROPERTY("NetworkAddress", "u", network_add_read_handler, network_add_write_handler, 0, 0),
-    SD_BUS_WRITABLE_PROPERTY("NetworkChannel", "y", network_channel_read_handler, network_channel_write_handler, 0, 0),
-    SD_BUS_WRITABLE_PROPERTY("SinkCost", "y", sink_cost_read_handler, sink_cost_write_handler, 0, 0),
-    SD_BUS_WRITABLE_PROPERTY("ChannelMap", "u", channel_map_read_handler_wrapper, channel_map_write_handler, 0, 0),
+    SD_BUS_WRITABLE_PROPERTY("NodeAddress", "u", node_add_read_handler, node_add_write_handler, 0, SD_BUS_VTABLE_PROPERTY_EMITS_INVALIDATION),
+    SD_BUS_WRITABLE_PROPERTY("NodeRole", "y", node_role_read_handler, node_role_write_handler, 0, SD_BUS_VTABLE_PROPERTY_EMITS_INVALIDATION),
+    SD_BUS_WRITABLE_PROPERTY("NetworkAddress", "u", network_add_read_handler, network_add_write_handler, 0, SD_BUS_VTABLE_PROPERTY_EMITS_INVALIDATION),
+    SD_BUS_WRITABLE_PROPERTY("NetworkChannel", "y", network_channel_read_handler, network_channel_write_handler, 0, SD_BUS_VTABLE_PROPERTY_EMITS_INVALIDATION),
+    SD_BUS_WRITABLE_PROPERTY("SinkCost", "y", sink_cost_read_handler, sink_cost_write_handler, 0, SD_BUS_VTABLE_PROPERTY_EMITS_INVALIDATION),
+    SD_BUS_WRITABLE_PROPERTY("ChannelMap", "u", channel_map_read_handler_wrapper, channel_map_write_handler, 0, SD_BUS_VTABLE_PROPERTY_EMITS_INVALIDATION),
 
     /* Write only parameters (no write only concept so handled in read handler) */
-    SD_BUS_WRITABLE_PROPERTY("CipherKey", "ay", read_key, set_cipher_key, 0, 0),
-    SD_BUS_WRITABLE_PROPERTY("AuthenticationKey", "ay", read_key, set_authen_key, 0, 0),
+    SD_BUS_WRITABLE_PROPERTY("CipherKey", "ay", read_key, set_cipher_key, 0, SD_BUS_VTABLE_PROPERTY_EMITS_INVALIDATION),
+    SD_BUS_WRITABLE_PROPERTY("AuthenticationKey", "ay", read_key, set_authen_key, 0, SD_BUS_VTABLE_PROPERTY_EMITS_INVALIDATION),
 
     /* Methods related to config */
     SD_BUS_METHOD("SetStackState", "b", "b", set_stack_state, SD_BUS_VTABLE_UNPRIVILEGED),
@@ -952,6 +1469,7 @@ static const sd_bus_vtable config_vtable[] = {
     SD_BUS_METHOD("SetConfigDataItem", "qay", "", set_config_data_item, SD_BUS_VTABLE_UNPRIVILEGED),
     SD_BUS_METHOD("GetConfigDataItem", "q", "ay", get_config_data_item, SD_BUS_VTABLE_UNPRIVILEGED),
     SD_BUS_METHOD("GetConfigDataContent", "", "a(qay)", get_config_data_content, SD_BUS_VTABLE_UNPRIVILEGED),
+    SD_BUS_METHOD("GetFullConfig", "", "a{sv}", get_full_config, SD_BUS_VTABLE_UNPRIVILEGED),
     SD_BUS_METHOD("SetNetworkSecurityKeys", "ayayy", "", set_network_security_keys, SD_BUS_VTABLE_UNPRIVILEGED),
     SD_BUS_METHOD("SetManagementSecurityKeys", "ayayy", "", set_management_security_keys, SD_BUS_VTABLE_UNPRIVILEGED),
 
@@ -1048,6 +1566,10 @@ static void on_stack_boot_status(uint8_t status)
      * of an otap and variables may change
      */
     initialize_unmodifiable_variables();
+    invalidate_cdd_cache();
+
+    /* Any value read from the node may have changed */
+    emit_properties_changed(NULL);
 
     if (status == 0)
     {
@@ -1060,7 +1582,10 @@ static void on_stack_boot_status(uint8_t status)
     }
 }
 
-int Config_Init(sd_bus * bus, char * object, char * interface)
+int Config_Init(sd_bus * bus,
+                char * object,
+                char * interface,
+                unsigned int cdd_cache_max_age_s)
 {
     int r;
     uint8_t status;
@@ -1068,6 +1593,7 @@ int Config_Init(sd_bus * bus, char * object, char * interface)
     m_bus = bus;
     m_object = object;
     m_interface = interface;
+    m_cdd_cache_max_age_s = cdd_cache_max_age_s;
 
     /* Register for stack status */
     if (WPC_register_for_stack_status(on_stack_boot_status) != APP_RES_OK)
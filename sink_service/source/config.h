@@ -15,10 +15,16 @@
  *          The sd_bus instance to publish the config interface
  * \param   object
  * \param   interface
+ * \param   cdd_cache_max_age_s
+ *          Max time in s config data items are served from cache, they are
+ *          read again from the node after. 0 disables the cache
  * \return  0 if initialization succeed, an error code otherwise
  * \note    Connection with sink must be ready before calling this module
  */
-int Config_Init(sd_bus * bus, char * object, char * interface);
+int Config_Init(sd_bus * bus,
+                char * object,
+                char * interface,
+                unsigned int cdd_cache_max_age_s);
 
 void Config_Close();
 
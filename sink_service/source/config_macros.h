@@ -82,6 +82,8 @@ static char error_message[100];
             return -EINVAL;                                         \
         }                                                           \
         LOGD("Value %d written for %s\n", var, #name);              \
+        sd_bus_emit_properties_changed(bus, path, interface,        \
+                                       property, NULL);             \
         return 0;                                                   \
     }
 
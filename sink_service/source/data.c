@@ -9,8 +9,14 @@
 #include <stdbool.h>
 #include <errno.h>
 #include <time.h>
+#include <string.h>
+#include <unistd.h>
+#include <pthread.h>
+#include <sys/epoll.h>
+#include <sys/eventfd.h>
 
 #include "data.h"
+#include "uplink_ring.h"
 #include "wpc.h"
 
 #define LOG_MODULE_NAME "Data"
@@ -35,20 +41,444 @@ static size_t m_max_mtu;
 /* Max number of downlink packet being sent in parallel */
 static size_t m_downlink_limit;
 
+/* If set, signals are not sent while an uplink ring is opened */
+static bool m_uplink_ring_exclusive = false;
+
 /**********************************************************************
- *                   DBUS Methods implementation                      *
+ *                   Statistics                                       *
+ **********************************************************************/
+
+/** Send results above are counted with the last one */
+#define MAX_COUNTED_APP_RES 64
+
+/** Traffic counters, updated from several threads */
+static struct
+{
+    uint64_t received_packets[256];
+    uint64_t received_bytes[256];
+    /** Received packets that could not be sent on bus */
+    uint64_t uplink_signal_failures;
+    uint64_t sent_packets;
+    uint64_t send_failures[MAX_COUNTED_APP_RES];
+    /** Max weight of downlink messages queued at the same time */
+    uint32_t downlink_queue_high_water_mark;
+    /** Failed attempts to open the serial connection with the sink */
+    uint32_t connection_failures;
+    /** Received packets sent on bus and their delay since reception */
+    uint64_t uplink_emitted_packets;
+    uint64_t uplink_latency_total_us;
+    uint32_t uplink_latency_max_us;
+} m_stats;
+
+#define STAT_ADD(_counter, _value) __atomic_add_fetch(&(_counter), (_value), __ATOMIC_RELAXED)
+#define STAT_GET(_counter) __atomic_load_n(&(_counter), __ATOMIC_RELAXED)
+
+static void count_send_result(app_res_e res)
+{
+    if (res == APP_RES_OK)
+    {
+        STAT_ADD(m_stats.sent_packets, 1);
+    }
+    else
+    {
+        STAT_ADD(m_stats.send_failures[res < MAX_COUNTED_APP_RES ? res : MAX_COUNTED_APP_RES - 1], 1);
+    }
+}
+
+static void update_max(uint32_t * max, uint32_t value)
+{
+    uint32_t current = STAT_GET(*max);
+    while (value > current &&
+           !__atomic_compare_exchange_n(max,
+                                        &current,
+                                        value,
+                                        false,
+                                        __ATOMIC_RELAXED,
+                                        __ATOMIC_RELAXED))
+        ;
+}
+
+static void update_downlink_high_water_mark(uint32_t weight)
+{
+    update_max(&m_stats.downlink_queue_high_water_mark, weight);
+}
+
+/**
+ * \brief   Count received packets sent on bus
+ * \param   packets
+ *          Number of packets sent
+ * \param   timestamps_sum_ms
+ *          Sum of the reception timestamps of the packets
+ * \param   oldest_timestamp_ms
+ *          Reception timestamp of the oldest packet
+ */
+static void count_uplink_emission(size_t packets,
+                                  unsigned long long timestamps_sum_ms,
+                                  unsigned long long oldest_timestamp_ms)
+{
+    struct timespec now;
+    uint64_t now_us;
+    uint64_t total_us = 0;
+    uint64_t max_us = 0;
+
+    /* Reception timestamps are taken by c-mesh-api from the realtime clock */
+    clock_gettime(CLOCK_REALTIME, &now);
+    now_us = (uint64_t) now.tv_sec * 1000000 + now.tv_nsec / 1000;
+
+    /* Clock may have been set backward since reception */
+    if (now_us * packets > timestamps_sum_ms * 1000)
+    {
+        total_us = now_us * packets - timestamps_sum_ms * 1000;
+    }
+    if (now_us > oldest_timestamp_ms * 1000)
+    {
+        max_us = now_us - oldest_timestamp_ms * 1000;
+    }
+
+    STAT_ADD(m_stats.uplink_emitted_packets, packets);
+    STAT_ADD(m_stats.uplink_latency_total_us, total_us);
+    update_max(&m_stats.uplink_latency_max_us, max_us > UINT32_MAX ? UINT32_MAX : max_us);
+}
+
+static uint64_t sum_counters(const uint64_t * counters, size_t count)
+{
+    uint64_t sum = 0;
+    for (size_t i = 0; i < count; i++)
+    {
+        sum += STAT_GET(counters[i]);
+    }
+    return sum;
+}
+
+void Data_count_connection_failures(unsigned int failures)
+{
+    STAT_ADD(m_stats.connection_failures, failures);
+}
+
+/**********************************************************************
+ *                   Uplink batching                                  *
+ **********************************************************************/
+
+/** Max number of packets in a MessagesReceived signal (batching disabled if <= 1) */
+static size_t m_batch_size = 0;
+
+/** Max delay to send a batch after its first packet is received */
+static uint64_t m_batch_delay_us = 0;
+
+/** Batch being filled, NULL if no packet is pending */
+static sd_bus_message * m_batch_message = NULL;
+
+/** Number of packets in the batch being filled */
+static size_t m_batch_count = 0;
+
+/** Reception timestamps of the packets in the batch, for statistics */
+static unsigned long long m_batch_timestamps_sum_ms = 0;
+static unsigned long long m_batch_oldest_timestamp_ms = 0;
+
+/** Protects the batch, filled from c-mesh-api thread and flushed from bus loop */
+static pthread_mutex_t m_batch_mutex = PTHREAD_MUTEX_INITIALIZER;
+
+/** Eventfd used to start the batch timer from the bus loop */
+static int m_batch_fd = -1;
+static sd_event_source * m_batch_fd_source = NULL;
+
+/** Timer to send a batch that is not full in time */
+static sd_event_source * m_batch_timer = NULL;
+
+/** Priority of uplink event sources, lower is handled first (bus is at 0) */
+static int64_t m_uplink_priority = SD_EVENT_PRIORITY_IMPORTANT;
+
+/**********************************************************************
+ *                   Downlink requests handling                       *
  **********************************************************************/
 
+/** Downlink request waiting to be sent or to be answered */
+typedef struct downlink_request
+{
+    /** Method call to answer, referenced until answered */
+    sd_bus_message * m;
+    /** Message to send, its payload points into the method call */
+    app_message_t message;
+    /** Weight of the message in sink queue (0 if not tracked) */
+    size_t weight;
+    /** Result of the send */
+    app_res_e res;
+    struct downlink_request * next;
+} downlink_request_t;
+
+typedef struct
+{
+    downlink_request_t * head;
+    downlink_request_t * tail;
+} request_fifo_t;
+
+/** Requests waiting to be sent by the downlink thread */
+static request_fifo_t m_pending_requests = {NULL, NULL};
+
+/** Requests sent and waiting to be answered from the bus loop */
+static request_fifo_t m_done_requests = {NULL, NULL};
+
+/** Protects both request fifos and the thread state */
+static pthread_mutex_t m_requests_mutex = PTHREAD_MUTEX_INITIALIZER;
+
+/** Signaled when a request is added to pending fifo */
+static pthread_cond_t m_pending_cond = PTHREAD_COND_INITIALIZER;
+
+static pthread_t m_downlink_thread;
+static bool m_downlink_thread_running = false;
+
+/** Eventfd used to wake up the bus loop when requests are done */
+static int m_done_fd = -1;
+static sd_event_source * m_done_source = NULL;
+
+/** Weight of messages queued in the sink (updated from several threads) */
 static uint8_t m_message_queued_in_sink = 0;
 
+/** Weight of messages accepted but not yet given to the sink */
+static size_t m_message_pending_weight = 0;
+
+/** Occupancy thresholds (sorted), last one is the downlink limit */
+static unsigned int m_thresholds[MAX_DOWNLINK_THRESHOLDS + 1];
+static size_t m_thresholds_count = 0;
+
+/** Number of thresholds reached by occupancy (updated from several threads) */
+static uint32_t m_downlink_level = 0;
+
+/** Serialize the level checks, so last computed level is the one kept */
+static pthread_mutex_t m_level_mutex = PTHREAD_MUTEX_INITIALIZER;
+
+/** Eventfd used to signal a level change from the bus loop */
+static int m_level_fd = -1;
+static sd_event_source * m_level_source = NULL;
+
+static void fifo_push(request_fifo_t * fifo, downlink_request_t * req)
+{
+    req->next = NULL;
+    if (fifo->tail == NULL)
+    {
+        fifo->head = req;
+    }
+    else
+    {
+        fifo->tail->next = req;
+    }
+    fifo->tail = req;
+}
+
+static downlink_request_t * fifo_pop(request_fifo_t * fifo)
+{
+    downlink_request_t * req = fifo->head;
+    if (req != NULL)
+    {
+        fifo->head = req->next;
+        if (fifo->head == NULL)
+        {
+            fifo->tail = NULL;
+        }
+    }
+    return req;
+}
+
+static void free_request(downlink_request_t * req)
+{
+    sd_bus_message_unref(req->m);
+    free(req);
+}
+
+static size_t get_downlink_weight()
+{
+    return __atomic_load_n(&m_message_queued_in_sink, __ATOMIC_SEQ_CST) +
+           __atomic_load_n(&m_message_pending_weight, __ATOMIC_SEQ_CST);
+}
+
+/**
+ * \brief   Check if occupancy crossed a threshold since last check
+ * \note    Can be called from any thread, change is signaled from bus loop
+ */
+static void check_downlink_level()
+{
+    const uint64_t one = 1;
+    size_t occupancy;
+    uint32_t level = 0;
+
+    if (m_level_fd < 0)
+    {
+        return;
+    }
+
+    /* Occupancy is read and its level stored under the lock, otherwise
+     * a thread reading an older occupancy could store its level last */
+    pthread_mutex_lock(&m_level_mutex);
+    occupancy = get_downlink_weight();
+    while (level < m_thresholds_count && occupancy >= m_thresholds[level])
+    {
+        level++;
+    }
+
+    if (__atomic_exchange_n(&m_downlink_level, level, __ATOMIC_SEQ_CST) != level)
+    {
+        if (write(m_level_fd, &one, sizeof(one)) < 0)
+        {
+            LOGE("Cannot notify bus loop: %s\n", strerror(errno));
+        }
+    }
+    pthread_mutex_unlock(&m_level_mutex);
+}
+
+/**
+ * \brief   Send the downlink level change signal
+ * \param   ... (from sd_event io handler signature)
+ */
+static int on_downlink_level_changed(sd_event_source * s, int fd, uint32_t revents, void * userdata)
+{
+    uint64_t count;
+    int r;
+
+    if (read(fd, &count, sizeof(count)) < 0 && errno != EAGAIN)
+    {
+        LOGE("Cannot read level changed event: %s\n", strerror(errno));
+    }
+
+    /* Several changes may be merged, current state is sent */
+    r = sd_bus_emit_signal(m_bus,
+                           m_object,
+                           m_interface,
+                           "DownlinkQueueLevelChanged",
+                           "uuu",
+                           __atomic_load_n(&m_downlink_level, __ATOMIC_SEQ_CST),
+                           (uint32_t) get_downlink_weight(),
+                           (uint32_t) m_downlink_limit);
+    if (r < 0)
+    {
+        LOGE("Cannot send level changed signal: %s\n", strerror(-r));
+    }
+
+    return 0;
+}
+
 static void on_data_sent_cb(uint16_t pduid, uint32_t buffering_delay, uint8_t result)
 {
-    m_message_queued_in_sink -= (uint8_t) (pduid >> 8);
-    LOGD("Message sent %d, Message_queued: %d\n", pduid, m_message_queued_in_sink);
+    uint8_t queued = __atomic_sub_fetch(&m_message_queued_in_sink,
+                                        (uint8_t) (pduid >> 8),
+                                        __ATOMIC_SEQ_CST);
+    LOGD("Message sent %d, Message_queued: %d\n", pduid, queued);
+    check_downlink_level();
+}
+
+/**
+ * \brief   Thread sending the requests to the sink
+ * \note    Serial exchanges with the node are done here, so the bus loop
+ *          is never blocked by them
+ */
+static void * downlink_thread(void * arg)
+{
+    downlink_request_t * req;
+    const uint64_t one = 1;
+
+    pthread_mutex_lock(&m_requests_mutex);
+    while (m_downlink_thread_running)
+    {
+        req = fifo_pop(&m_pending_requests);
+        if (req == NULL)
+        {
+            pthread_cond_wait(&m_pending_cond, &m_requests_mutex);
+            continue;
+        }
+        pthread_mutex_unlock(&m_requests_mutex);
+
+        if (req->weight > 0)
+        {
+            /* Account it before sending, as sent callback may be called
+             * before WPC_send_data_with_options returns */
+            __atomic_add_fetch(&m_message_queued_in_sink,
+                               (uint8_t) req->weight,
+                               __ATOMIC_SEQ_CST);
+        }
+
+        req->res = WPC_send_data_with_options(&req->message);
+        count_send_result(req->res);
+
+        if (req->weight > 0)
+        {
+            if (req->res != APP_RES_OK)
+            {
+                __atomic_sub_fetch(&m_message_queued_in_sink,
+                                   (uint8_t) req->weight,
+                                   __ATOMIC_SEQ_CST);
+            }
+            __atomic_sub_fetch(&m_message_pending_weight, req->weight, __ATOMIC_SEQ_CST);
+            check_downlink_level();
+        }
+
+        pthread_mutex_lock(&m_requests_mutex);
+        fifo_push(&m_done_requests, req);
+
+        /* Wake up the bus loop to send the answer */
+        if (write(m_done_fd, &one, sizeof(one)) < 0)
+        {
+            LOGE("Cannot notify bus loop: %s\n", strerror(errno));
+        }
+    }
+    pthread_mutex_unlock(&m_requests_mutex);
+
+    return NULL;
+}
+
+/**
+ * \brief   Answer the requests handled by the downlink thread
+ * \param   ... (from sd_event io handler signature)
+ */
+static int on_requests_done(sd_event_source * s, int fd, uint32_t revents, void * userdata)
+{
+    downlink_request_t * req;
+    uint64_t count;
+    int r;
+
+    if (read(fd, &count, sizeof(count)) < 0 && errno != EAGAIN)
+    {
+        LOGE("Cannot read done requests event: %s\n", strerror(errno));
+    }
+
+    while (true)
+    {
+        pthread_mutex_lock(&m_requests_mutex);
+        req = fifo_pop(&m_done_requests);
+        pthread_mutex_unlock(&m_requests_mutex);
+
+        if (req == NULL)
+        {
+            break;
+        }
+
+        if (req->res != APP_RES_OK)
+        {
+            LOGE("Cannot send data: %d\n", req->res);
+        }
+        else if (req->weight > 0)
+        {
+            LOGI("Message_queued: %d\n", get_downlink_weight());
+        }
+
+        r = sd_bus_reply_method_return(req->m, "u", req->res);
+        if (r < 0)
+        {
+            LOGE("Cannot answer send request: %s\n", strerror(-r));
+        }
+
+        free_request(req);
+    }
+
+    return 0;
 }
 
+/**********************************************************************
+ *                   DBUS Methods implementation                      *
+ **********************************************************************/
+
 /**
  * \brief   Send a message handler
+ * \note    Request is only queued here, answer is sent once the message
+ *          is given to the sink
  * \param   ... (from sd_bus function signature)
  */
 static int send_message(sd_bus_message * m, void * userdata, sd_bus_error * error)
@@ -56,7 +486,7 @@ static int send_message(sd_bus_message * m, void * userdata, sd_bus_error * erro
     static uint8_t m_pdu_id = 0;
 
     app_message_t message;
-    app_res_e res;
+    downlink_request_t * req;
     const void * data;
     size_t n;
     int r;
@@ -99,9 +529,10 @@ static int send_message(sd_bus_message * m, void * userdata, sd_bus_error * erro
     {
         /* Check if message can be queued */
         weight = (n + m_max_mtu - 1) / m_max_mtu;
-        if (m_message_queued_in_sink + weight > m_downlink_limit)
+        if (get_downlink_weight() + weight > m_downlink_limit)
         {
             // No point to try sending data, queue is already full
+            count_send_result(APP_RES_OUT_OF_MEMORY);
             return sd_bus_reply_method_return(m, "u", APP_RES_OUT_OF_MEMORY);
         }
 
@@ -123,20 +554,551 @@ static int send_message(sd_bus_message * m, void * userdata, sd_bus_error * erro
          message.dst_addr,
          message.num_bytes);
 
+    req = malloc(sizeof(downlink_request_t));
+    if (req == NULL)
+    {
+        LOGE("Cannot allocate send request\n");
+        count_send_result(APP_RES_OUT_OF_MEMORY);
+        return sd_bus_reply_method_return(m, "u", APP_RES_OUT_OF_MEMORY);
+    }
+
+    /* Keep the method call, it holds the payload and must be answered */
+    req->m = sd_bus_message_ref(m);
+    req->message = message;
+    req->weight = weight;
+    req->res = APP_RES_INTERNAL_ERROR;
+
+    if (weight > 0)
+    {
+        __atomic_add_fetch(&m_message_pending_weight, weight, __ATOMIC_SEQ_CST);
+        update_downlink_high_water_mark(get_downlink_weight());
+        check_downlink_level();
+    }
+
+    pthread_mutex_lock(&m_requests_mutex);
+    fifo_push(&m_pending_requests, req);
+    pthread_cond_signal(&m_pending_cond);
+    pthread_mutex_unlock(&m_requests_mutex);
+
+    /* Answer will be sent from on_requests_done */
+    return 1;
+}
+
+/**********************************************************************
+ *                   DBUS Property handler definition                 *
+ **********************************************************************/
+/**
+ * \brief   Get the number of downlink messages queued in the sink
+ * \note    Weight of a message is its number of fragments
+ * \param   ... (from sd_bus property handler signature)
+ */
+static int get_downlink_queue_occupancy(sd_bus * bus,
+                                        const char * path,
+                                        const char * interface,
+                                        const char * property,
+                                        sd_bus_message * reply,
+                                        void * userdata,
+                                        sd_bus_error * error)
+{
+    return sd_bus_message_append(reply, "u", (uint32_t) get_downlink_weight());
+}
+
+/**
+ * \brief   Get the max number of downlink messages queued in the sink
+ * \note    0 means that queue occupancy is not tracked
+ * \param   ... (from sd_bus property handler signature)
+ */
+static int get_downlink_queue_limit(sd_bus * bus,
+                                    const char * path,
+                                    const char * interface,
+                                    const char * property,
+                                    sd_bus_message * reply,
+                                    void * userdata,
+                                    sd_bus_error * error)
+{
+    return sd_bus_message_append(reply, "u", (uint32_t) m_downlink_limit);
+}
+
+/**
+ * \brief   Get the number of received packets, for all endpoints
+ * \param   ... (from sd_bus property handler signature)
+ */
+static int get_received_packets(sd_bus * bus,
+                                const char * path,
+                                const char * interface,
+                                const char * property,
+                                sd_bus_message * reply,
+                                void * userdata,
+                                sd_bus_error * error)
+{
+    return sd_bus_message_append(reply, "t", sum_counters(m_stats.received_packets, 256));
+}
+
+/**
+ * \brief   Get the number of received bytes, for all endpoints
+ * \param   ... (from sd_bus property handler signature)
+ */
+static int get_received_bytes(sd_bus * bus,
+                              const char * path,
+                              const char * interface,
+                              const char * property,
+                              sd_bus_message * reply,
+                              void * userdata,
+                              sd_bus_error * error)
+{
+    return sd_bus_message_append(reply, "t", sum_counters(m_stats.received_bytes, 256));
+}
+
+/**
+ * \brief   Get the number of packets given to the sink
+ * \param   ... (from sd_bus property handler signature)
+ */
+static int get_sent_packets(sd_bus * bus,
+                            const char * path,
+                            const char * interface,
+                            const char * property,
+                            sd_bus_message * reply,
+                            void * userdata,
+                            sd_bus_error * error)
+{
+    return sd_bus_message_append(reply, "t", STAT_GET(m_stats.sent_packets));
+}
+
+/**
+ * \brief   Get the max downlink queue occupancy seen
+ * \param   ... (from sd_bus property handler signature)
+ */
+static int get_downlink_queue_high_water_mark(sd_bus * bus,
+                                              const char * path,
+                                              const char * interface,
+                                              const char * property,
+                                              sd_bus_message * reply,
+                                              void * userdata,
+                                              sd_bus_error * error)
+{
+    return sd_bus_message_append(reply, "u", STAT_GET(m_stats.downlink_queue_high_water_mark));
+}
+
+/**
+ * \brief   Append a counter to a GetStatistics answer
+ */
+static int append_statistic(sd_bus_message * reply, const char * name, char type, uint64_t value)
+{
+    int r;
+
+    r = sd_bus_message_open_container(reply, 'e', "sv");
+    if (r < 0)
+        return r;
 
+    r = sd_bus_message_append(reply, "s", name);
+    if (r < 0)
+        return r;
 
-    res = WPC_send_data_with_options(&message);
-    if (res != APP_RES_OK)
+    if (type == 't')
     {
-        LOGE("Cannot send data: %d\n", res);
+        r = sd_bus_message_append(reply, "v", "t", value);
     }
-    else if (m_downlink_limit > 0)
+    else
     {
-        m_message_queued_in_sink += weight;
-        LOGI("Message_queued: %d\n", m_message_queued_in_sink);
+        r = sd_bus_message_append(reply, "v", "u", (uint32_t) value);
     }
+    if (r < 0)
+        return r;
 
-    return sd_bus_reply_method_return(m, "u", res);
+    return sd_bus_message_close_container(reply);
+}
+
+/**
+ * \brief   Append non null counters of an array to a GetStatistics answer
+ * \note    Key type is y for endpoints and u for results
+ */
+static int append_statistics_map(sd_bus_message * reply,
+                                 const char * name,
+                                 char key_type,
+                                 const uint64_t * counters,
+                                 size_t count)
+{
+    const char * map_type = key_type == 'y' ? "a{yt}" : "a{ut}";
+    uint64_t value;
+    int r;
+
+    r = sd_bus_message_open_container(reply, 'e', "sv");
+    if (r < 0)
+        return r;
+
+    r = sd_bus_message_append(reply, "s", name);
+    if (r < 0)
+        return r;
+
+    r = sd_bus_message_open_container(reply, 'v', map_type);
+    if (r < 0)
+        return r;
+
+    r = sd_bus_message_open_container(reply, 'a', map_type + 1);
+    if (r < 0)
+        return r;
+
+    for (size_t i = 0; i < count; i++)
+    {
+        value = STAT_GET(counters[i]);
+        if (value == 0)
+        {
+            continue;
+        }
+
+        if (key_type == 'y')
+        {
+            r = sd_bus_message_append(reply, "{yt}", (uint8_t) i, value);
+        }
+        else
+        {
+            r = sd_bus_message_append(reply, "{ut}", (uint32_t) i, value);
+        }
+        if (r < 0)
+            return r;
+    }
+
+    r = sd_bus_message_close_container(reply);
+    if (r < 0)
+        return r;
+
+    r = sd_bus_message_close_container(reply);
+    if (r < 0)
+        return r;
+
+    return sd_bus_message_close_container(reply);
+}
+
+/**
+ * \brief   Get all the traffic counters in a single call
+ * \param   ... (from sd_bus function signature)
+ */
+static int get_statistics(sd_bus_message * m, void * userdata, sd_bus_error * error)
+{
+    __attribute__((cleanup(sd_bus_message_unrefp))) sd_bus_message * reply = NULL;
+    int r;
+
+    r = sd_bus_message_new_method_return(m, &reply);
+    if (r < 0)
+        return r;
+
+    r = sd_bus_message_open_container(reply, 'a', "{sv}");
+    if (r < 0)
+        return r;
+
+    // clang-format off
+    if ((r = append_statistic(reply, "received_packets", 't',
+                              sum_counters(m_stats.received_packets, 256))) < 0
+        || (r = append_statistic(reply, "received_bytes", 't',
+                                 sum_counters(m_stats.received_bytes, 256))) < 0
+        || (r = append_statistics_map(reply, "received_packets_per_ep", 'y',
+                                      m_stats.received_packets, 256)) < 0
+        || (r = append_statistics_map(reply, "received_bytes_per_ep", 'y',
+                                      m_stats.received_bytes, 256)) < 0
+        || (r = append_statistic(reply, "uplink_signal_failures", 't',
+                                 STAT_GET(m_stats.uplink_signal_failures))) < 0
+        || (r = append_statistic(reply, "sent_packets", 't',
+                                 STAT_GET(m_stats.sent_packets))) < 0
+        || (r = append_statistics_map(reply, "send_failures", 'u',
+                                      m_stats.send_failures, MAX_COUNTED_APP_RES)) < 0
+        || (r = append_statistic(reply, "downlink_queue_high_water_mark", 'u',
+                                 STAT_GET(m_stats.downlink_queue_high_water_mark))) < 0
+        || (r = append_statistic(reply, "connection_failures", 'u',
+                                 STAT_GET(m_stats.connection_failures))) < 0
+        || (r = append_statistic(reply, "uplink_emitted_packets", 't',
+                                 STAT_GET(m_stats.uplink_emitted_packets))) < 0
+        || (r = append_statistic(reply, "uplink_latency_total_us", 't',
+                                 STAT_GET(m_stats.uplink_latency_total_us))) < 0
+        || (r = append_statistic(reply, "uplink_latency_max_us", 'u',
+                                 STAT_GET(m_stats.uplink_latency_max_us))) < 0)
+    {
+        LOGE("Cannot append statistics: %s\n", strerror(-r));
+        return r;
+    }
+    // clang-format on
+
+    r = sd_bus_message_close_container(reply);
+    if (r < 0)
+        return r;
+
+    return sd_bus_send(NULL, reply, NULL);
+}
+
+/**********************************************************************
+ *                   Uplink batching implementation                   *
+ **********************************************************************/
+
+/**
+ * \brief   Send the batch being filled, if any
+ * \note    m_batch_mutex must be locked
+ */
+static void flush_batch_locked()
+{
+    int r;
+
+    if (m_batch_message == NULL)
+    {
+        return;
+    }
+
+    r = sd_bus_message_close_container(m_batch_message);
+    if (r < 0)
+    {
+        LOGE("Cannot close batch error=%s\n", strerror(-r));
+    }
+    else
+    {
+        LOGD("Sending batch of %d packets\n", m_batch_count);
+        r = sd_bus_send(m_bus, m_batch_message, NULL);
+    }
+
+    if (r < 0)
+    {
+        STAT_ADD(m_stats.uplink_signal_failures, m_batch_count);
+    }
+    else
+    {
+        count_uplink_emission(m_batch_count,
+                              m_batch_timestamps_sum_ms,
+                              m_batch_oldest_timestamp_ms);
+    }
+    m_batch_timestamps_sum_ms = 0;
+
+    m_batch_message = sd_bus_message_unref(m_batch_message);
+    m_batch_count = 0;
+}
+
+/**
+ * \brief   Add a received packet to the batch being filled
+ * \note    Batch is sent when full, or by the batch timer
+ * \param   ... (from c-mesh api onDataReceived callback)
+ */
+static bool add_to_batch(const uint8_t * bytes,
+                         size_t num_bytes,
+                         app_addr_t src_addr,
+                         app_addr_t dst_addr,
+                         app_qos_e qos,
+                         uint8_t src_ep,
+                         uint8_t dst_ep,
+                         uint32_t travel_time,
+                         uint8_t hop_count,
+                         unsigned long long timestamp_ms)
+{
+    const uint64_t one = 1;
+    bool first = false;
+    int r;
+
+    pthread_mutex_lock(&m_batch_mutex);
+
+    if (m_batch_message == NULL)
+    {
+        r = sd_bus_message_new_signal(m_bus,
+                                      &m_batch_message,
+                                      m_object,
+                                      m_interface,
+                                      "MessagesReceived");
+        if (r < 0)
+        {
+            LOGE("Cannot create batch signal error=%s\n", strerror(-r));
+            goto error;
+        }
+
+        r = sd_bus_message_open_container(m_batch_message, 'a', "(tuuyyuyyay)");
+        if (r < 0)
+        {
+            LOGE("Cannot open batch error=%s\n", strerror(-r));
+            goto error;
+        }
+        first = true;
+    }
+
+    r = sd_bus_message_open_container(m_batch_message, 'r', "tuuyyuyyay");
+    if (r < 0)
+    {
+        LOGE("Cannot open packet error=%s\n", strerror(-r));
+        goto error;
+    }
+
+    // clang-format off
+    r = sd_bus_message_append(m_batch_message,
+                              "tuuyyuyy",
+                              timestamp_ms,
+                              src_addr,
+                              dst_addr,
+                              src_ep,
+                              dst_ep,
+                              travel_time,
+                              qos,
+                              hop_count);
+    // clang-format on
+    if (r < 0)
+    {
+        LOGE("Cannot append info error=%s\n", strerror(-r));
+        goto error;
+    }
+
+    r = sd_bus_message_append_array(m_batch_message, 'y', bytes, num_bytes);
+    if (r < 0)
+    {
+        LOGE("Cannot append array error=%s\n", strerror(-r));
+        goto error;
+    }
+
+    r = sd_bus_message_close_container(m_batch_message);
+    if (r < 0)
+    {
+        LOGE("Cannot close packet error=%s\n", strerror(-r));
+        goto error;
+    }
+
+    if (m_batch_count == 0)
+    {
+        m_batch_oldest_timestamp_ms = timestamp_ms;
+    }
+    m_batch_timestamps_sum_ms += timestamp_ms;
+    m_batch_count++;
+    if (m_batch_count >= m_batch_size)
+    {
+        flush_batch_locked();
+    }
+    else if (first)
+    {
+        /* Start the batch timer from the bus loop */
+        if (write(m_batch_fd, &one, sizeof(one)) < 0)
+        {
+            LOGE("Cannot notify bus loop: %s\n", strerror(errno));
+        }
+    }
+
+    pthread_mutex_unlock(&m_batch_mutex);
+    return true;
+
+error:
+    /* Message cannot be completed, packets already in it are lost */
+    if (m_batch_count > 0)
+    {
+        LOGE("Dropping batch of %d packets\n", m_batch_count);
+    }
+    STAT_ADD(m_stats.uplink_signal_failures, m_batch_count + 1);
+    m_batch_message = sd_bus_message_unref(m_batch_message);
+    m_batch_count = 0;
+    m_batch_timestamps_sum_ms = 0;
+    pthread_mutex_unlock(&m_batch_mutex);
+    return false;
+}
+
+/**
+ * \brief   Start the batch timer when a new batch is started
+ * \param   ... (from sd_event io handler signature)
+ */
+static int on_batch_started(sd_event_source * s, int fd, uint32_t revents, void * userdata)
+{
+    uint64_t count;
+    uint64_t now;
+    int r;
+
+    if (read(fd, &count, sizeof(count)) < 0 && errno != EAGAIN)
+    {
+        LOGE("Cannot read batch started event: %s\n", strerror(errno));
+    }
+
+    r = sd_event_now(sd_event_source_get_event(s), CLOCK_MONOTONIC, &now);
+    if (r < 0)
+    {
+        LOGE("Cannot get time: %s\n", strerror(-r));
+        return 0;
+    }
+
+    r = sd_event_source_set_time(m_batch_timer, now + m_batch_delay_us);
+    if (r >= 0)
+    {
+        r = sd_event_source_set_enabled(m_batch_timer, SD_EVENT_ONESHOT);
+    }
+
+    if (r < 0)
+    {
+        LOGE("Cannot start batch timer: %s\n", strerror(-r));
+    }
+
+    return 0;
+}
+
+/**
+ * \brief   Send the batch not full in time
+ * \note    It may be a batch started after the one that armed the timer,
+ *          it is then only sent earlier
+ * \param   ... (from sd_event time handler signature)
+ */
+static int on_batch_timeout(sd_event_source * s, uint64_t usec, void * userdata)
+{
+    pthread_mutex_lock(&m_batch_mutex);
+    flush_batch_locked();
+    pthread_mutex_unlock(&m_batch_mutex);
+
+    return 0;
+}
+
+static int init_batch(sd_event * event)
+{
+    int ret;
+
+    m_batch_fd = eventfd(0, EFD_NONBLOCK | EFD_CLOEXEC);
+    if (m_batch_fd < 0)
+    {
+        LOGE("Cannot create batch eventfd: %s\n", strerror(errno));
+        return -errno;
+    }
+
+    ret = sd_event_add_io(event, &m_batch_fd_source, m_batch_fd, EPOLLIN, on_batch_started, NULL);
+    if (ret < 0)
+    {
+        LOGE("Cannot add batch event source: %s\n", strerror(-ret));
+        return ret;
+    }
+
+    ret = sd_event_add_time(event,
+                            &m_batch_timer,
+                            CLOCK_MONOTONIC,
+                            0,
+                            0,
+                            on_batch_timeout,
+                            NULL);
+    if (ret < 0)
+    {
+        LOGE("Cannot add batch timer: %s\n", strerror(-ret));
+        return ret;
+    }
+
+    /* Batches are sent before pending method calls are handled */
+    ret = sd_event_source_set_priority(m_batch_fd_source, m_uplink_priority);
+    if (ret >= 0)
+    {
+        ret = sd_event_source_set_priority(m_batch_timer, m_uplink_priority);
+    }
+    if (ret < 0)
+    {
+        LOGE("Cannot set batch priority: %s\n", strerror(-ret));
+        return ret;
+    }
+
+    /* Only armed when a batch is started */
+    return sd_event_source_set_enabled(m_batch_timer, SD_EVENT_OFF);
+}
+
+static void close_batch()
+{
+    /* Do not lose the packets already received */
+    pthread_mutex_lock(&m_batch_mutex);
+    flush_batch_locked();
+    pthread_mutex_unlock(&m_batch_mutex);
+
+    m_batch_timer = sd_event_source_unref(m_batch_timer);
+    m_batch_fd_source = sd_event_source_unref(m_batch_fd_source);
+    if (m_batch_fd >= 0)
+    {
+        close(m_batch_fd);
+        m_batch_fd = -1;
+    }
 }
 
 /**********************************************************************
@@ -167,12 +1129,46 @@ static bool onDataReceived(const uint8_t * bytes,
          src_addr,
          dst_addr);
 
+    STAT_ADD(m_stats.received_packets[dst_ep], 1);
+    STAT_ADD(m_stats.received_bytes[dst_ep], num_bytes);
+
+    /* Other bus clients still get the signals, unless rings are exclusive */
+    if (Uplink_ring_write(bytes,
+                          num_bytes,
+                          src_addr,
+                          dst_addr,
+                          qos,
+                          src_ep,
+                          dst_ep,
+                          travel_time,
+                          hop_count,
+                          timestamp_ms) &&
+        m_uplink_ring_exclusive)
+    {
+        return true;
+    }
+
+    if (m_batch_size > 1)
+    {
+        return add_to_batch(bytes,
+                            num_bytes,
+                            src_addr,
+                            dst_addr,
+                            qos,
+                            src_ep,
+                            dst_ep,
+                            travel_time,
+                            hop_count,
+                            timestamp_ms);
+    }
+
     /* Create a new signal to be generated on Dbus */
     r = sd_bus_message_new_signal(m_bus, &m, m_object, m_interface, "MessageReceived");
 
     if (r < 0)
     {
         LOGE("Cannot create signal error=%s\n", strerror(-r));
+        STAT_ADD(m_stats.uplink_signal_failures, 1);
         return false;
     }
 
@@ -192,6 +1188,7 @@ static bool onDataReceived(const uint8_t * bytes,
     if (r < 0)
     {
         LOGE("Cannot append info error=%s\n", strerror(-r));
+        STAT_ADD(m_stats.uplink_signal_failures, 1);
         return false;
     }
 
@@ -199,11 +1196,19 @@ static bool onDataReceived(const uint8_t * bytes,
     if (r < 0)
     {
         LOGE("Cannot append array error=%s\n", strerror(-r));
+        STAT_ADD(m_stats.uplink_signal_failures, 1);
         return false;
     }
 
     /* Send the signal on bus */
-    sd_bus_send(m_bus, m, NULL);
+    if (sd_bus_send(m_bus, m, NULL) < 0)
+    {
+        STAT_ADD(m_stats.uplink_signal_failures, 1);
+    }
+    else
+    {
+        count_uplink_emission(1, timestamp_ms, timestamp_ms);
+    }
 
     return true;
 }
@@ -227,6 +1232,43 @@ static const sd_bus_vtable data_vtable[] = {
      */
     SD_BUS_METHOD("SendMessage", "uyyuybyay", "u", send_message, SD_BUS_VTABLE_UNPRIVILEGED),
 
+    /* Method to receive packets through a shared memory ring instead of signals */
+    /* Returns:
+     *  h -> memfd of the ring (see uplink_ring.h for its layout)
+     *  h -> eventfd signaled when packets are written
+     */
+    SD_BUS_METHOD("OpenUplinkRing", "", "hh", Uplink_ring_open, SD_BUS_VTABLE_UNPRIVILEGED),
+
+    /* Downlink queue occupancy, only tracked if a downlink limit is set */
+    SD_BUS_PROPERTY("DownlinkQueueOccupancy", "u", get_downlink_queue_occupancy, 0, 0),
+    SD_BUS_PROPERTY("DownlinkQueueLimit", "u", get_downlink_queue_limit, 0, 0),
+
+    /* Signal generated when downlink queue occupancy crosses a threshold */
+    /* Parameters are:
+     *  u -> number of thresholds reached (the last one is the limit)
+     *  u -> occupancy
+     *  u -> limit
+     */
+    SD_BUS_SIGNAL("DownlinkQueueLevelChanged", "uuu", 0),
+
+    /* Traffic counters since sink service start */
+    SD_BUS_PROPERTY("ReceivedPackets", "t", get_received_packets, 0, 0),
+    SD_BUS_PROPERTY("ReceivedBytes", "t", get_received_bytes, 0, 0),
+    SD_BUS_PROPERTY("SentPackets", "t", get_sent_packets, 0, 0),
+    SD_BUS_PROPERTY("DownlinkQueueHighWaterMark", "u", get_downlink_queue_high_water_mark, 0, 0),
+
+    /* Method to get all the traffic counters */
+    /* Returns a dictionary of counters:
+     *  received_packets, received_bytes -> t
+     *  received_packets_per_ep, received_bytes_per_ep -> a{yt} by destination endpoint
+     *  uplink_signal_failures -> t, received packets not sent on bus
+     *  sent_packets -> t
+     *  send_failures -> a{ut} by app_res_e result
+     *  downlink_queue_high_water_mark -> u
+     *  connection_failures -> u, failed attempts to open serial connection
+     */
+    SD_BUS_METHOD("GetStatistics", "", "a{sv}", get_statistics, SD_BUS_VTABLE_UNPRIVILEGED),
+
     /* Signal generated on message received */
     /* Parameters are:
      *  t -> timestamp_ms
@@ -241,9 +1283,24 @@ static const sd_bus_vtable data_vtable[] = {
      */
     SD_BUS_SIGNAL("MessageReceived", "tuuyyuyyay", 0),
 
+    /* Signal generated instead of MessageReceived if uplink batching is set */
+    /* Parameter is an array of packets with MessageReceived parameters */
+    SD_BUS_SIGNAL("MessagesReceived", "a(tuuyyuyyay)", 0),
+
     SD_BUS_VTABLE_END};
 
-int Data_Init(sd_bus * bus, char * object, char * interface, size_t downlink_limit)
+int Data_Init(sd_bus * bus,
+              sd_event * event,
+              char * object,
+              char * interface,
+              size_t downlink_limit,
+              size_t uplink_batch_size,
+              unsigned int uplink_batch_delay_ms,
+              size_t uplink_ring_size,
+              bool uplink_ring_exclusive,
+              const unsigned int * downlink_thresholds,
+              size_t downlink_thresholds_count,
+              int uplink_priority)
 {
     int ret;
 
@@ -251,6 +1308,28 @@ int Data_Init(sd_bus * bus, char * object, char * interface, size_t downlink_lim
     m_object = object;
     m_interface = interface;
     m_downlink_limit = downlink_limit;
+    m_uplink_ring_exclusive = uplink_ring_exclusive;
+    m_batch_size = uplink_batch_size;
+    m_batch_delay_us = (uint64_t) uplink_batch_delay_ms * 1000;
+    m_uplink_priority = uplink_priority;
+
+    if (m_batch_size > 1)
+    {
+        ret = init_batch(event);
+        if (ret < 0)
+        {
+            return ret;
+        }
+    }
+
+    if (uplink_ring_size > 0)
+    {
+        ret = Uplink_ring_init(bus, uplink_ring_size);
+        if (ret < 0)
+        {
+            return ret;
+        }
+    }
 
     /* Register for all data */
     WPC_register_for_data(onDataReceived);
@@ -261,6 +1340,67 @@ int Data_Init(sd_bus * bus, char * object, char * interface, size_t downlink_lim
         m_max_mtu = 102;
     }
 
+    if (m_downlink_limit > 0)
+    {
+        /* Limit is always a threshold, so reaching it is signaled */
+        for (size_t i = 0; i < downlink_thresholds_count && i < MAX_DOWNLINK_THRESHOLDS; i++)
+        {
+            if (downlink_thresholds[i] == 0 || downlink_thresholds[i] >= m_downlink_limit ||
+                (m_thresholds_count > 0 &&
+                 downlink_thresholds[i] <= m_thresholds[m_thresholds_count - 1]))
+            {
+                LOGW("Downlink threshold %u ignored (must be sorted and below limit)\n",
+                     downlink_thresholds[i]);
+                continue;
+            }
+            m_thresholds[m_thresholds_count++] = downlink_thresholds[i];
+        }
+        m_thresholds[m_thresholds_count++] = m_downlink_limit;
+
+        m_level_fd = eventfd(0, EFD_NONBLOCK | EFD_CLOEXEC);
+        if (m_level_fd < 0)
+        {
+            LOGE("Cannot create level eventfd: %s\n", strerror(errno));
+            return -errno;
+        }
+
+        ret = sd_event_add_io(event,
+                              &m_level_source,
+                              m_level_fd,
+                              EPOLLIN,
+                              on_downlink_level_changed,
+                              NULL);
+        if (ret < 0)
+        {
+            LOGE("Cannot add level event source: %s\n", strerror(-ret));
+            return ret;
+        }
+    }
+
+    /* Requests are answered from the bus loop once sent */
+    m_done_fd = eventfd(0, EFD_NONBLOCK | EFD_CLOEXEC);
+    if (m_done_fd < 0)
+    {
+        LOGE("Cannot create eventfd: %s\n", strerror(errno));
+        return -errno;
+    }
+
+    ret = sd_event_add_io(event, &m_done_source, m_done_fd, EPOLLIN, on_requests_done, NULL);
+    if (ret < 0)
+    {
+        LOGE("Cannot add done requests event source: %s\n", strerror(-ret));
+        return ret;
+    }
+
+    m_downlink_thread_running = true;
+    ret = pthread_create(&m_downlink_thread, NULL, downlink_thread, NULL);
+    if (ret != 0)
+    {
+        LOGE("Cannot create downlink thread: %s\n", strerror(ret));
+        m_downlink_thread_running = false;
+        return -ret;
+    }
+
     /* Install the data vtable */
     ret = sd_bus_add_object_vtable(bus, &m_slot, object, interface, data_vtable, NULL);
     if (ret < 0)
@@ -274,8 +1414,54 @@ int Data_Init(sd_bus * bus, char * object, char * interface, size_t downlink_lim
 
 void Data_Close()
 {
+    downlink_request_t * req;
+
     if (m_slot != NULL)
     {
         sd_bus_slot_unref(m_slot);
     }
+
+    pthread_mutex_lock(&m_requests_mutex);
+    if (m_downlink_thread_running)
+    {
+        m_downlink_thread_running = false;
+        pthread_cond_signal(&m_pending_cond);
+        pthread_mutex_unlock(&m_requests_mutex);
+        pthread_join(m_downlink_thread, NULL);
+    }
+    else
+    {
+        pthread_mutex_unlock(&m_requests_mutex);
+    }
+
+    /* Requests still there will never be answered */
+    while ((req = fifo_pop(&m_pending_requests)) != NULL)
+    {
+        free_request(req);
+    }
+    while ((req = fifo_pop(&m_done_requests)) != NULL)
+    {
+        free_request(req);
+    }
+
+    m_done_source = sd_event_source_unref(m_done_source);
+    if (m_done_fd >= 0)
+    {
+        close(m_done_fd);
+        m_done_fd = -1;
+    }
+
+    if (m_batch_size > 1)
+    {
+        close_batch();
+    }
+
+    m_level_source = sd_event_source_unref(m_level_source);
+    if (m_level_fd >= 0)
+    {
+        close(m_level_fd);
+        m_level_fd = -1;
+    }
+
+    Uplink_ring_close();
 }
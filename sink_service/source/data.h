@@ -8,20 +8,66 @@
 #define SINK_MANAGER_SOURCE_DATA_H_
 
 #include <systemd/sd-bus.h>
+#include <systemd/sd-event.h>
+
+/** Max number of downlink occupancy thresholds, in addition to the limit */
+#define MAX_DOWNLINK_THRESHOLDS 8
 
 /**
  * \brief   Initialize the data module
  * \param   bus
  *          The sd_bus instance to publish the config interface
+ * \param   event
+ *          The event loop the bus is attached to, used to answer
+ *          send requests once handled
  *\param    object
  *\param    interface
  *\param    downlink_limit
             If > 0, max number of downlink messages being queued in parallel
+ *\param    uplink_batch_size
+            If > 1, received packets are sent by batches of this size in a
+            MessagesReceived signal instead of one MessageReceived signal each
+ *\param    uplink_batch_delay_ms
+            Max delay to send a batch that is not full
+ *\param    uplink_ring_size
+            If > 0, clients can open a shared memory ring of this size to
+            receive packets
+ *\param    uplink_ring_exclusive
+            If true, signals are not sent while a ring is opened. Only
+            relevant if ring readers are the only clients of the uplink
+ *\param    downlink_thresholds
+            Sorted downlink occupancy thresholds, a signal is sent when one
+            is crossed. Downlink limit is always one of them
+ *\param    downlink_thresholds_count
+            Number of thresholds (at most MAX_DOWNLINK_THRESHOLDS)
+ *\param    uplink_priority
+            sd-event priority of uplink batch sending. Bus is handled at
+            SD_EVENT_PRIORITY_NORMAL, so a lower value sends pending batches
+            before method calls
  * \return  0 if initialization succeed, an error code otherwise
  * \note    Connection with sink must be ready before calling this module
  */
-int Data_Init(sd_bus * bus, char * object, char * interface, size_t downlink_limit);
+int Data_Init(sd_bus * bus,
+              sd_event * event,
+              char * object,
+              char * interface,
+              size_t downlink_limit,
+              size_t uplink_batch_size,
+              unsigned int uplink_batch_delay_ms,
+              size_t uplink_ring_size,
+              bool uplink_ring_exclusive,
+              const unsigned int * downlink_thresholds,
+              size_t downlink_thresholds_count,
+              int uplink_priority);
 
 void Data_Close();
 
+/**
+ * \brief   Count failed attempts to open the serial connection with the sink
+ * \param   failures
+ *          Number of failed attempts to add
+ * \note    Can be called before Data_Init
+ */
+void Data_count_connection_failures(unsigned int failures);
+
 #endif /* SINK_MANAGER_SOURCE_DATA_H_ */
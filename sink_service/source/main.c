@@ -8,11 +8,15 @@
 #include <stdlib.h>
 #include <stdbool.h>
 #include <errno.h>
+#include <string.h>
+#include <time.h>
+#include <limits.h>
 #include <unistd.h>
 #include <libgen.h>
 #include <signal.h>
 
 #include <systemd/sd-bus.h>
+#include <systemd/sd-event.h>
 
 #include "wpc.h"
 #include "config.h"
@@ -38,9 +42,23 @@ static char * port_name = "/dev/ttyACM0";
    not answearing during that time */
 #define DEFAULT_MAX_POLL_FAIL_DURATION_S   120
 
+/* max default delay to send an uplink batch that is not full */
+#define DEFAULT_UPLINK_BATCH_DELAY_MS      20
+/* max number of packets in an uplink batch */
+#define MAX_UPLINK_BATCH_SIZE              256
+
+/* max default time to serve config data items from cache */
+#define DEFAULT_CDD_CACHE_MAX_AGE_S        60
+
+/* max number of baudrates to test in automatic mode */
+#define MAX_AUTO_BAUDRATES                 8
+
 /* Dbus bus instance*/
 static sd_bus * m_bus = NULL;
 
+/* Event loop instance */
+static sd_event * m_event = NULL;
+
 /**
  * \brief   Generate a unique service name based on port name
  * \param   service_name
@@ -80,13 +98,40 @@ static bool get_service_name(char service_name[MAX_SIZE_SERVICE_NAME], unsigned
  *          Pointer where to store fragment_max_duration_s value (if any)
  * \param   downlink_limit
  *          Pointer where to store downlink_limit value (if any)
+ * \param   uplink_batch_size
+ *          Pointer where to store uplink_batch_size value (if any)
+ * \param   uplink_batch_delay_ms
+ *          Pointer where to store uplink_batch_delay_ms value (if any)
+ * \param   uplink_ring_size
+ *          Pointer where to store uplink_ring_size value (if any)
+ * \param   uplink_ring_exclusive
+ *          Pointer where to store uplink_ring_exclusive value (if any)
+ * \param   downlink_thresholds
+ *          Pointer where to store downlink_thresholds list (if any)
+ * \param   baudrate_list
+ *          Pointer where to store baudrate_list (if any)
+ * \param   baudrate_dir
+ *          Pointer where to store baudrate_dir value (if any)
+ * \param   uplink_priority
+ *          Pointer where to store uplink_priority value (if any)
+ * \param   cdd_cache_max_age_s
+ *          Pointer where to store cdd_cache_max_age_s value (if any)
  */
 static void get_env_parameters(unsigned long * baudrate,
                                char ** port_name,
                                unsigned int * sink_id,
                                unsigned int * max_poll_fail_duration,
                                unsigned int * fragment_max_duration_s,
-                               unsigned int * downlink_limit)
+                               unsigned int * downlink_limit,
+                               unsigned int * uplink_batch_size,
+                               unsigned int * uplink_batch_delay_ms,
+                               unsigned int * uplink_ring_size,
+                               unsigned int * uplink_ring_exclusive,
+                               char ** downlink_thresholds,
+                               char ** baudrate_list,
+                               char ** baudrate_dir,
+                               int * uplink_priority,
+                               unsigned int * cdd_cache_max_age_s)
 {
     char * ptr;
 
@@ -122,6 +167,93 @@ static void get_env_parameters(unsigned long * baudrate,
         *downlink_limit = strtoul(ptr, NULL, 0);
         LOGI("WM_GW_SINK_DOWNLINK_LIMIT: %lu\n", *downlink_limit);
     }
+    if ((ptr = getenv("WM_GW_SINK_UPLINK_BATCH_SIZE")) != NULL)
+    {
+        *uplink_batch_size = strtoul(ptr, NULL, 0);
+        LOGI("WM_GW_SINK_UPLINK_BATCH_SIZE: %lu\n", *uplink_batch_size);
+    }
+    if ((ptr = getenv("WM_GW_SINK_UPLINK_BATCH_DELAY_MS")) != NULL)
+    {
+        *uplink_batch_delay_ms = strtoul(ptr, NULL, 0);
+        LOGI("WM_GW_SINK_UPLINK_BATCH_DELAY_MS: %lu\n", *uplink_batch_delay_ms);
+    }
+    if ((ptr = getenv("WM_GW_SINK_UPLINK_RING_SIZE")) != NULL)
+    {
+        *uplink_ring_size = strtoul(ptr, NULL, 0);
+        LOGI("WM_GW_SINK_UPLINK_RING_SIZE: %lu\n", *uplink_ring_size);
+    }
+    if ((ptr = getenv("WM_GW_SINK_UPLINK_RING_EXCLUSIVE")) != NULL)
+    {
+        *uplink_ring_exclusive = strtoul(ptr, NULL, 0);
+        LOGI("WM_GW_SINK_UPLINK_RING_EXCLUSIVE: %lu\n", *uplink_ring_exclusive);
+    }
+    if ((ptr = getenv("WM_GW_SINK_DOWNLINK_THRESHOLDS")) != NULL)
+    {
+        *downlink_thresholds = ptr;
+        LOGI("WM_GW_SINK_DOWNLINK_THRESHOLDS: %s\n", *downlink_thresholds);
+    }
+    if ((ptr = getenv("WM_GW_SINK_BAUDRATE_LIST")) != NULL)
+    {
+        *baudrate_list = ptr;
+        LOGI("WM_GW_SINK_BAUDRATE_LIST: %s\n", *baudrate_list);
+    }
+    if ((ptr = getenv("WM_GW_SINK_BAUDRATE_DIR")) != NULL)
+    {
+        *baudrate_dir = ptr;
+        LOGI("WM_GW_SINK_BAUDRATE_DIR: %s\n", *baudrate_dir);
+    }
+    if ((ptr = getenv("WM_GW_SINK_UPLINK_PRIORITY")) != NULL)
+    {
+        *uplink_priority = strtol(ptr, NULL, 0);
+        LOGI("WM_GW_SINK_UPLINK_PRIORITY: %d\n", *uplink_priority);
+    }
+    if ((ptr = getenv("WM_GW_SINK_CDD_CACHE_MAX_AGE_S")) != NULL)
+    {
+        *cdd_cache_max_age_s = strtoul(ptr, NULL, 0);
+        LOGI("WM_GW_SINK_CDD_CACHE_MAX_AGE_S: %lu\n", *cdd_cache_max_age_s);
+    }
+}
+
+/**
+ * \brief   Parse a comma separated list of non-negative integers
+ * \param   list
+ *          The list to parse, like "4,8,12"
+ * \param   values
+ *          Array of max_count entries to store the values
+ * \param   max_count
+ *          Max number of values in the list
+ * \param   name
+ *          Name of the list, for logs
+ * \return  Number of values or -1 if list is invalid
+ */
+static int parse_uint_list(const char * list,
+                           unsigned int * values,
+                           int max_count,
+                           const char * name)
+{
+    const char * ptr = list;
+    char * end;
+    int count = 0;
+
+    while (*ptr != '\0')
+    {
+        if (count == max_count)
+        {
+            LOGE("Max %d %s\n", max_count, name);
+            return -1;
+        }
+
+        values[count++] = strtoul(ptr, &end, 0);
+        if (end == ptr || (*end != ',' && *end != '\0'))
+        {
+            LOGE("Invalid %s: %s\n", name, list);
+            return -1;
+        }
+
+        ptr = (*end == ',') ? end + 1 : end;
+    }
+
+    return count;
 }
 
 /**
@@ -253,7 +385,7 @@ static void set_module_log_levels()
 // Usual baudrate to test in automatic mode
 // They are the ones frequently used in dual mcu application
 // 125000 is first as it was the original default value
-static const unsigned long auto_baudrate_list[] = {125000, 115200, 1000000};
+static const unsigned int default_baudrate_list[] = {125000, 115200, 1000000};
 
 static int open_and_check_connection(unsigned long baudrate, char * port_name)
 {
@@ -276,30 +408,174 @@ static int open_and_check_connection(unsigned long baudrate, char * port_name)
     return 0;
 }
 
-static volatile sig_atomic_t m_stop_requested = 0;
+static unsigned long long get_monotonic_ms()
+{
+    struct timespec now;
+
+    clock_gettime(CLOCK_MONOTONIC, &now);
+    return (unsigned long long) now.tv_sec * 1000 + now.tv_nsec / 1000000;
+}
+
+/**
+ * \brief   Get the file storing the last baudrate found on a port
+ * \param   path
+ *          Where to store the file path
+ * \param   dir
+ *          Directory of the file
+ * \param   port_name
+ *          Port the baudrate is for, only its last component is used
+ * \return  True if successful, false if path is too long
+ */
+static bool get_baudrate_path(char path[PATH_MAX], const char * dir, const char * port_name)
+{
+    const char * port = strrchr(port_name, '/');
+    int len;
+
+    port = (port == NULL) ? port_name : port + 1;
+    len = snprintf(path, PATH_MAX, "%s/%s.baudrate", dir, port);
+    return len > 0 && len < PATH_MAX;
+}
+
+static unsigned long read_last_baudrate(const char * path)
+{
+    unsigned long baudrate = 0;
+    FILE * f = fopen(path, "r");
 
-static void stop_signal_handler(const int signum)
+    if (f == NULL)
+    {
+        if (errno != ENOENT)
+        {
+            LOGW("Cannot open %s: %s\n", path, strerror(errno));
+        }
+        return 0;
+    }
+
+    if (fscanf(f, "%lu", &baudrate) != 1)
+    {
+        LOGW("Invalid baudrate in %s\n", path);
+        baudrate = 0;
+    }
+
+    fclose(f);
+    return baudrate;
+}
+
+static void write_last_baudrate(const char * path, unsigned long baudrate)
 {
-    m_stop_requested = 1;
+    char tmp_path[PATH_MAX + 4];
+    FILE * f;
+
+    /* Written aside and renamed, so a partial file is never read */
+    snprintf(tmp_path, sizeof(tmp_path), "%s.tmp", path);
+    f = fopen(tmp_path, "w");
+    if (f == NULL)
+    {
+        LOGW("Cannot create %s: %s\n", tmp_path, strerror(errno));
+        return;
+    }
+
+    fprintf(f, "%lu\n", baudrate);
+    if (fclose(f) != 0 || rename(tmp_path, path) != 0)
+    {
+        LOGW("Cannot write %s: %s\n", path, strerror(errno));
+        unlink(tmp_path);
+    }
 }
 
-static bool setup_signal_handlers_for_stopping()
+/**
+ * \brief   Test baudrates until the sink answers
+ * \param   baudrates
+ *          Baudrates to test, in order
+ * \param   count
+ *          Number of baudrates
+ * \param   last_baudrate
+ *          Baudrate found last time, tested first (0 if unknown)
+ * \param   port_name
+ *          Port the sink is connected to
+ * \return  The baudrate found or 0 if sink doesn't answer
+ */
+static unsigned long auto_baudrate(const unsigned int * baudrates,
+                                   size_t count,
+                                   unsigned long last_baudrate,
+                                   char * port_name)
 {
-    // Handle SIGINT and SIGTERM signals for graceful shutdown
-    if (signal(SIGINT, stop_signal_handler) == SIG_ERR)
+    unsigned long long start;
+    unsigned long baudrate;
+    int res;
+
+    /* Index -1 is the last baudrate */
+    for (int i = (last_baudrate != 0) ? -1 : 0; i < (int) count; i++)
     {
-        LOGE("Could not set SIGINT signal handler: %s\n", strerror(errno));
-        return false;
+        if (i >= 0 && baudrates[i] == last_baudrate)
+        {
+            /* Already tested */
+            continue;
+        }
+        baudrate = (i < 0) ? last_baudrate : baudrates[i];
+
+        start = get_monotonic_ms();
+        res = open_and_check_connection(baudrate, port_name);
+        LOGI("Auto baudrate: %lu bps %s in %llu ms\n",
+             baudrate,
+             res == 0 ? "answered" : "failed",
+             get_monotonic_ms() - start);
+
+        if (res == 0)
+        {
+            return baudrate;
+        }
+        Data_count_connection_failures(1);
     }
-    if (signal(SIGTERM, stop_signal_handler) == SIG_ERR)
+
+    return 0;
+}
+
+static int stop_signal_handler(sd_event_source * s,
+                               const struct signalfd_siginfo * si,
+                               void * userdata)
+{
+    LOGI("Stop requested by signal %d\n", si->ssi_signo);
+    return sd_event_exit(sd_event_source_get_event(s), 0);
+}
+
+static bool block_signals_for_stopping()
+{
+    sigset_t mask;
+
+    // SIGINT and SIGTERM are handled by the event loop for graceful
+    // shutdown. They must be blocked before any thread is created so that
+    // all threads inherit the mask
+    if (sigemptyset(&mask) < 0 || sigaddset(&mask, SIGINT) < 0 ||
+        sigaddset(&mask, SIGTERM) < 0 || sigprocmask(SIG_BLOCK, &mask, NULL) < 0)
     {
-        LOGE("Could not set SIGTERM signal handler: %s\n", strerror(errno));
+        LOGE("Could not block stop signals: %s\n", strerror(errno));
         return false;
     }
 
     return true;
 }
 
+static int setup_signal_handlers_for_stopping(sd_event * event)
+{
+    int r;
+
+    r = sd_event_add_signal(event, NULL, SIGINT, stop_signal_handler, NULL);
+    if (r < 0)
+    {
+        LOGE("Could not set SIGINT signal handler: %s\n", strerror(-r));
+        return r;
+    }
+
+    r = sd_event_add_signal(event, NULL, SIGTERM, stop_signal_handler, NULL);
+    if (r < 0)
+    {
+        LOGE("Could not set SIGTERM signal handler: %s\n", strerror(-r));
+        return r;
+    }
+
+    return 0;
+}
+
 int main(int argc, char * argv[])
 {
     unsigned long baudrate = 0;
@@ -310,21 +586,40 @@ int main(int argc, char * argv[])
     unsigned int max_poll_fail_duration = DEFAULT_MAX_POLL_FAIL_DURATION_S;
     unsigned int fragment_max_duration_s = DEFAULT_FRAGMENT_MAX_DURATION_S;
     unsigned int downlink_limit = 0;
+    unsigned int uplink_batch_size = 0;
+    unsigned int uplink_batch_delay_ms = DEFAULT_UPLINK_BATCH_DELAY_MS;
+    unsigned int uplink_ring_size = 0;
+    unsigned int uplink_ring_exclusive = 0;
+    char * downlink_thresholds_list = NULL;
+    unsigned int downlink_thresholds[MAX_DOWNLINK_THRESHOLDS];
+    int downlink_thresholds_count = 0;
+    char * baudrate_list_str = NULL;
+    char * baudrate_dir = NULL;
+    int uplink_priority = SD_EVENT_PRIORITY_IMPORTANT;
+    unsigned int cdd_cache_max_age_s = DEFAULT_CDD_CACHE_MAX_AGE_S;
+    char baudrate_path[PATH_MAX];
+    unsigned int baudrate_list[MAX_AUTO_BAUDRATES];
+    int baudrate_count = sizeof(default_baudrate_list) / sizeof(default_baudrate_list[0]);
 
     set_global_log_level();
     set_module_log_levels();
 
-    if (!setup_signal_handlers_for_stopping())
+    if (!block_signals_for_stopping())
     {
         return EXIT_FAILURE;
     }
 
     /* Acquires environment parameters */
     get_env_parameters(&baudrate, &port_name, &sink_id, &max_poll_fail_duration,
-                       &fragment_max_duration_s, &downlink_limit);
+                       &fragment_max_duration_s, &downlink_limit,
+                       &uplink_batch_size, &uplink_batch_delay_ms,
+                       &uplink_ring_size, &uplink_ring_exclusive,
+                       &downlink_thresholds_list,
+                       &baudrate_list_str, &baudrate_dir,
+                       &uplink_priority, &cdd_cache_max_age_s);
 
     /* Parse command line arguments - take precedence over environmental ones */
-    while ((c = getopt(argc, argv, "b:p:i:d:f:l:")) != -1)
+    while ((c = getopt(argc, argv, "b:p:i:d:f:l:B:T:R:E:o:a:s:U:C:")) != -1)
     {
         switch (c)
         {
@@ -350,10 +645,37 @@ int main(int argc, char * argv[])
             case 'l':
                 downlink_limit = strtoul(optarg, NULL, 0);
                 break;
+            case 'B':
+                uplink_batch_size = strtoul(optarg, NULL, 0);
+                break;
+            case 'T':
+                uplink_batch_delay_ms = strtoul(optarg, NULL, 0);
+                break;
+            case 'R':
+                uplink_ring_size = strtoul(optarg, NULL, 0);
+                break;
+            case 'E':
+                uplink_ring_exclusive = strtoul(optarg, NULL, 0);
+                break;
+            case 'o':
+                downlink_thresholds_list = optarg;
+                break;
+            case 'a':
+                baudrate_list_str = optarg;
+                break;
+            case 's':
+                baudrate_dir = optarg;
+                break;
+            case 'U':
+                uplink_priority = strtol(optarg, NULL, 0);
+                break;
+            case 'C':
+                cdd_cache_max_age_s = strtoul(optarg, NULL, 0);
+                break;
             case '?':
             default:
                 LOGE("Error in argument parsing\n");
-                LOGE("Parameters are: -b <baudrate> -p <port> -i <sink_id> -f <fragment max duration> -l <downlink limit>\n");
+                LOGE("Parameters are: -b <baudrate> -p <port> -i <sink_id> -f <fragment max duration> -l <downlink limit> -B <uplink batch size> -T <uplink batch delay ms> -R <uplink ring size> -E <uplink ring exclusive> -o <downlink thresholds> -a <auto baudrate list> -s <baudrate dir> -U <uplink priority> -C <cdd cache max age>\n");
                 return EXIT_FAILURE;
         }
     }
@@ -364,6 +686,50 @@ int main(int argc, char * argv[])
         return EXIT_FAILURE;
     }
 
+    if (downlink_thresholds_list != NULL)
+    {
+        downlink_thresholds_count = parse_uint_list(downlink_thresholds_list,
+                                                    downlink_thresholds,
+                                                    MAX_DOWNLINK_THRESHOLDS,
+                                                    "downlink thresholds");
+        if (downlink_thresholds_count < 0)
+        {
+            return EXIT_FAILURE;
+        }
+    }
+
+    memcpy(baudrate_list, default_baudrate_list, sizeof(default_baudrate_list));
+    if (baudrate_list_str != NULL)
+    {
+        baudrate_count = parse_uint_list(baudrate_list_str,
+                                         baudrate_list,
+                                         MAX_AUTO_BAUDRATES,
+                                         "auto baudrates");
+        if (baudrate_count <= 0)
+        {
+            LOGE("At least one auto baudrate is needed\n");
+            return EXIT_FAILURE;
+        }
+    }
+
+    if (baudrate_dir != NULL && !get_baudrate_path(baudrate_path, baudrate_dir, port_name))
+    {
+        LOGE("Baudrate dir path is too long\n");
+        return EXIT_FAILURE;
+    }
+
+    if (uplink_batch_size > MAX_UPLINK_BATCH_SIZE)
+    {
+        LOGE("Max uplink batch size is %d (%d)\n", MAX_UPLINK_BATCH_SIZE, uplink_batch_size);
+        return EXIT_FAILURE;
+    }
+
+    if (uplink_batch_size > 1 && uplink_batch_delay_ms == 0)
+    {
+        LOGE("Uplink batch delay must be set if batching is enabled\n");
+        return EXIT_FAILURE;
+    }
+
     /* Generate full service name */
     if (!get_service_name(full_service_name, sink_id))
     {
@@ -381,6 +747,21 @@ int main(int argc, char * argv[])
         LOGI("Downlink limit is set to %d\n", downlink_limit);
     }
 
+    if (uplink_batch_size > 1)
+    {
+        LOGI("Uplink batching is set to %d packets or %d ms (priority %d)\n",
+             uplink_batch_size,
+             uplink_batch_delay_ms,
+             uplink_priority);
+    }
+
+    if (uplink_ring_size > 0)
+    {
+        LOGI("Uplink ring is enabled with %d bytes%s\n",
+             uplink_ring_size,
+             uplink_ring_exclusive ? " (signals not sent while opened)" : "");
+    }
+
     if (baudrate != 0)
     {
         // The baudrate to use is given
@@ -392,30 +773,26 @@ int main(int argc, char * argv[])
     }
     else
     {
-        // Automatic baudrate, test the list one by one
-        size_t number_of_baudrates =
-            sizeof(auto_baudrate_list) / sizeof(auto_baudrate_list[0]);
-        size_t i;
-        for (i = 0; i < number_of_baudrates; i++)
+        // Automatic baudrate, test the last one found then the list one by one
+        unsigned long last_baudrate = 0;
+        if (baudrate_dir != NULL)
         {
-            LOGI("Auto baudrate: testing %d bps\n", auto_baudrate_list[i]);
-            if (open_and_check_connection(auto_baudrate_list[i], port_name) != 0)
-            {
-                LOGD("Cannot establish communication with sink\n");
-            }
-            else
-            {
-                LOGI("Uart baudrate found: %d bps\n", auto_baudrate_list[i]);
-                break;
-            }
+            last_baudrate = read_last_baudrate(baudrate_path);
         }
 
-        if (i == number_of_baudrates)
+        baudrate = auto_baudrate(baudrate_list, baudrate_count, last_baudrate, port_name);
+        if (baudrate == 0)
         {
             LOGE("Cannot establish communication with sink with different "
                  "tested baudrate\n");
             return EXIT_FAILURE;
         }
+
+        LOGI("Uart baudrate found: %lu bps\n", baudrate);
+        if (baudrate_dir != NULL && baudrate != last_baudrate)
+        {
+            write_last_baudrate(baudrate_path, baudrate);
+        }
     }
 
     if (WPC_set_max_poll_fail_duration(max_poll_fail_duration))
@@ -430,6 +807,19 @@ int main(int argc, char * argv[])
         return EXIT_FAILURE;
     }
 
+    r = sd_event_default(&m_event);
+    if (r < 0)
+    {
+        LOGE("Failed to create event loop: %s\n", strerror(-r));
+        goto finish;
+    }
+
+    r = setup_signal_handlers_for_stopping(m_event);
+    if (r < 0)
+    {
+        goto finish;
+    }
+
     /* Connect to the user bus */
     r = sd_bus_open_system(&m_bus);
     if (r < 0)
@@ -438,14 +828,35 @@ int main(int argc, char * argv[])
         goto finish;
     }
 
-    if (Config_Init(m_bus, "/com/wirepas/sink", "com.wirepas.sink.config1") < 0)
+    r = sd_bus_attach_event(m_bus, m_event, SD_EVENT_PRIORITY_NORMAL);
+    if (r < 0)
+    {
+        LOGE("Failed to attach bus to event loop: %s\n", strerror(-r));
+        goto finish;
+    }
+
+    if (Config_Init(m_bus,
+                    "/com/wirepas/sink",
+                    "com.wirepas.sink.config1",
+                    cdd_cache_max_age_s) < 0)
     {
         LOGE("Cannot initialize config module\n");
         r = -1;
         goto finish;
     }
 
-    if (Data_Init(m_bus, "/com/wirepas/sink", "com.wirepas.sink.data1", downlink_limit) < 0)
+    if (Data_Init(m_bus,
+                  m_event,
+                  "/com/wirepas/sink",
+                  "com.wirepas.sink.data1",
+                  downlink_limit,
+                  uplink_batch_size,
+                  uplink_batch_delay_ms,
+                  uplink_ring_size,
+                  uplink_ring_exclusive != 0,
+                  downlink_thresholds,
+                  downlink_thresholds_count,
+                  uplink_priority) < 0)
     {
         LOGE("Cannot initialize data module\n");
         r = -1;
@@ -467,29 +878,11 @@ int main(int argc, char * argv[])
         goto finish;
     }
 
-    while (!m_stop_requested)
+    /* Process bus requests and internal events until a stop is requested */
+    r = sd_event_loop(m_event);
+    if (r < 0)
     {
-        /* Process requests */
-        r = sd_bus_process(m_bus, NULL);
-        if (r < 0)
-        {
-            LOGE("Failed to process bus: %s\n", strerror(-r));
-            goto finish;
-        }
-
-        /* we processed a request, try to process another one, right-away */
-        if (r > 0)
-            continue;
-
-        /* Wait for the next request to process */
-        /* sd_bus_wait uses ppoll() internally, and also returns if a signal is */
-        /* caught. */
-        r = sd_bus_wait(m_bus, (uint64_t) -1);
-        if (r < 0)
-        {
-            LOGE("Failed to wait on bus: %s\n", strerror(-r));
-            goto finish;
-        }
+        LOGE("Failed to run event loop: %s\n", strerror(-r));
     }
 
 finish:
@@ -497,7 +890,8 @@ finish:
     Otap_Close();
     Data_Close();
     Config_Close();
-    sd_bus_unref(m_bus);
+    sd_bus_flush_close_unref(m_bus);
+    sd_event_unref(m_event);
     WPC_close();
 
     return r < 0 ? EXIT_FAILURE : EXIT_SUCCESS;
@@ -8,6 +8,9 @@
 #include <stdlib.h>
 #include <stdbool.h>
 #include <errno.h>
+#include <string.h>
+#include <unistd.h>
+#include <sys/stat.h>
 
 #include "otap.h"
 //TODO: must be splitted in config and error
@@ -18,20 +21,6 @@
 #define MAX_LOG_LEVEL DEBUG_LOG_LEVEL
 #include "logger.h"
 
-/** Structure to hold unmodifiable configs from node */
-typedef struct
-{
-    uint32_t stored_len;
-    uint32_t processed_len;
-    uint32_t firmware_area_id;
-    uint16_t stored_crc;
-    uint16_t processed_crc;
-    uint8_t stored_status;
-    uint8_t stored_type;
-    uint8_t stored_seq;
-    uint8_t processed_seq;
-} sink_otap_t;
-
 /** Sink static values read at init time */
 static sink_otap_t m_sink_otap;
 
@@ -47,6 +36,9 @@ static char * m_interface = NULL;
 /** Bus slot used to register the Vtable */
 static sd_bus_slot * m_slot = NULL;
 
+/** Size of the blocks read from a scratchpad file descriptor */
+#define SCRATCHPAD_READ_BLOCK_SIZE 4096
+
 static bool initialize_unmodifiable_variables();
 
 /**********************************************************************
@@ -113,6 +105,93 @@ static int upload_scratchpad(sd_bus_message * m, void * userdata, sd_bus_error *
     return sd_bus_reply_method_return(m, "");
 }
 
+/**
+ * \brief   Upload local scratchpad read from a file descriptor
+ * \param   ... (from sd_bus function signature)
+ * \note    The file is read block by block from offset 0, so the
+ *          scratchpad is never fully held in memory
+ */
+static int upload_scratchpad_fd(sd_bus_message * m, void * userdata, sd_bus_error * error)
+{
+    static uint8_t block[SCRATCHPAD_READ_BLOCK_SIZE];
+    app_res_e res;
+    struct stat st;
+    uint32_t offset = 0;
+    uint32_t size;
+    int fd;
+    int r;
+    uint8_t seq;
+
+    /* Read the parameters (seq of scratchpad and fd owned by message) */
+    r = sd_bus_message_read(m, "yh", &seq, &fd);
+    if (r < 0)
+    {
+        sd_bus_error_set_errno(error, r);
+        LOGE("Fail to parse parameters: %s\n", strerror(-r));
+        return r;
+    }
+
+    if (fstat(fd, &st) < 0)
+    {
+        r = -errno;
+        sd_bus_error_set_errno(error, r);
+        LOGE("Cannot get scratchpad file size: %s\n", strerror(-r));
+        return r;
+    }
+
+    size = (uint32_t) st.st_size;
+    LOGD("Upload scratchpad from fd: with seq %d of size %u\n", seq, size);
+
+    res = WPC_start_local_scratchpad_update(size, seq);
+    if (res != APP_RES_OK)
+    {
+        LOGE("Cannot start local scratchpad update\n");
+        SET_WPC_ERROR(error, "WPC_start_local_scratchpad_update", res);
+        return -EINVAL;
+    }
+
+    while (offset < size)
+    {
+        ssize_t n = pread(fd, block, sizeof(block), offset);
+        if (n <= 0)
+        {
+            r = (n < 0) ? -errno : -EIO;
+            sd_bus_error_set_errno(error, r);
+            LOGE("Cannot read scratchpad file at %u: %s\n", offset, strerror(-r));
+            return r;
+        }
+
+        res = WPC_upload_local_block_scratchpad((uint32_t) n, block, offset);
+        if (res != APP_RES_OK)
+        {
+            LOGE("Cannot upload local scratchpad block at %u\n", offset);
+            SET_WPC_ERROR(error, "WPC_upload_local_block_scratchpad", res);
+            return -EINVAL;
+        }
+
+        offset += (uint32_t) n;
+    }
+
+    /* New scratchpad uploaded, update parameters values exposed on bus */
+    initialize_unmodifiable_variables();
+
+    /* Do some sanity check: Do not generate error for that */
+    if (m_sink_otap.stored_len != size)
+    {
+        LOGE("Scratchpad is not loaded correctly (wrong size) %d vs %d\n",
+             m_sink_otap.stored_len,
+             size);
+    }
+
+    if (m_sink_otap.stored_seq != seq)
+    {
+        LOGE("Wrong seq number after loading a scratchpad image \n");
+    }
+
+    /* Reply with the response */
+    return sd_bus_reply_method_return(m, "");
+}
+
 /**
  * \brief   Clear local scratchpad
  * \param   ... (from sd_bus function signature)
@@ -259,15 +338,15 @@ static const sd_bus_vtable otap_vtable[] =
     SD_BUS_VTABLE_START(0),
 
     /* Read only parameters backup-ed with a table (Read each time stack starts) */
-    SD_BUS_PROPERTY("StoredLen",       "u", NULL, offsetof(sink_otap_t, stored_len), 0),
-    SD_BUS_PROPERTY("StoredCrc",       "q", NULL, offsetof(sink_otap_t, stored_crc), 0),
-    SD_BUS_PROPERTY("StoredSeq",       "y", NULL, offsetof(sink_otap_t, stored_seq), 0),
-    SD_BUS_PROPERTY("StoredStatus",    "y", NULL, offsetof(sink_otap_t, stored_status), 0),
-    SD_BUS_PROPERTY("StoredType",      "y", NULL, offsetof(sink_otap_t, stored_type), 0),
-    SD_BUS_PROPERTY("ProcessedLen",    "u", NULL, offsetof(sink_otap_t, processed_len), 0),
-    SD_BUS_PROPERTY("ProcessedCrc",    "q", NULL, offsetof(sink_otap_t, processed_crc), 0),
-    SD_BUS_PROPERTY("ProcessedSeq",    "y", NULL, offsetof(sink_otap_t, processed_seq), 0),
-    SD_BUS_PROPERTY("FirmwareAreaId",  "u", NULL, offsetof(sink_otap_t, firmware_area_id), 0),
+    SD_BUS_PROPERTY("StoredLen",       "u", NULL, offsetof(sink_otap_t, stored_len), SD_BUS_VTABLE_PROPERTY_EMITS_INVALIDATION),
+    SD_BUS_PROPERTY("StoredCrc",       "q", NULL, offsetof(sink_otap_t, stored_crc), SD_BUS_VTABLE_PROPERTY_EMITS_INVALIDATION),
+    SD_BUS_PROPERTY("StoredSeq",       "y", NULL, offsetof(sink_otap_t, stored_seq), SD_BUS_VTABLE_PROPERTY_EMITS_INVALIDATION),
+    SD_BUS_PROPERTY("StoredStatus",    "y", NULL, offsetof(sink_otap_t, stored_status), SD_BUS_VTABLE_PROPERTY_EMITS_INVALIDATION),
+    SD_BUS_PROPERTY("StoredType",      "y", NULL, offsetof(sink_otap_t, stored_type), SD_BUS_VTABLE_PROPERTY_EMITS_INVALIDATION),
+    SD_BUS_PROPERTY("ProcessedLen",    "u", NULL, offsetof(sink_otap_t, processed_len), SD_BUS_VTABLE_PROPERTY_EMITS_INVALIDATION),
+    SD_BUS_PROPERTY("ProcessedCrc",    "q", NULL, offsetof(sink_otap_t, processed_crc), SD_BUS_VTABLE_PROPERTY_EMITS_INVALIDATION),
+    SD_BUS_PROPERTY("ProcessedSeq",    "y", NULL, offsetof(sink_otap_t, processed_seq), SD_BUS_VTABLE_PROPERTY_EMITS_INVALIDATION),
+    SD_BUS_PROPERTY("FirmwareAreaId",  "u", NULL, offsetof(sink_otap_t, firmware_area_id), SD_BUS_VTABLE_PROPERTY_EMITS_INVALIDATION),
 
     /* Methods related to config */
     SD_BUS_METHOD("ProcessScratchpad",  "", "", process_scratchpad, SD_BUS_VTABLE_UNPRIVILEGED),
@@ -276,6 +355,11 @@ static const sd_bus_vtable otap_vtable[] =
      *  ay -> byte array containing the scratchpad to upload
      */
     SD_BUS_METHOD("UploadScratchpad","yay", "", upload_scratchpad, SD_BUS_VTABLE_UNPRIVILEGED),
+    /* Parameters are:
+     *  y -> sequence
+     *  h -> file descriptor of the scratchpad to upload (read from offset 0)
+     */
+    SD_BUS_METHOD("UploadScratchpadFd","yh", "", upload_scratchpad_fd, SD_BUS_VTABLE_UNPRIVILEGED),
     SD_BUS_METHOD("ClearLocalScratchpad", "", "", clear_local_scratchpad, SD_BUS_VTABLE_UNPRIVILEGED),
     SD_BUS_METHOD("SetTargetScratchpad","yqyy", "b", set_target_scratchpad, SD_BUS_VTABLE_UNPRIVILEGED),
     SD_BUS_METHOD("GetTargetScratchpad", "", "yqyy", get_target_scratchpad, SD_BUS_VTABLE_UNPRIVILEGED),
@@ -306,6 +390,16 @@ static bool initialize_unmodifiable_variables()
 
     m_sink_otap.firmware_area_id = status.firmware_memory_area_id;
 
+    /* Notify clients caching the values, once exposed on bus */
+    if (m_slot != NULL)
+    {
+        int r = sd_bus_emit_properties_changed_strv(m_bus, m_object, m_interface, NULL);
+        if (r < 0)
+        {
+            LOGE("Cannot send properties changed signal: %s\n", strerror(-r));
+        }
+    }
+
     return true;
 }
 
@@ -332,6 +426,11 @@ int Otap_Init(sd_bus * bus, char * object, char * interface)
     return 0;
 }
 
+const sink_otap_t * Otap_Get_Status()
+{
+    return &m_sink_otap;
+}
+
 void Otap_Close()
 {
     if (m_slot != NULL)
@@ -7,8 +7,23 @@
 #ifndef SINK_MANAGER_SOURCE_OTAP_H_
 #define SINK_MANAGER_SOURCE_OTAP_H_
 
+#include <stdint.h>
 #include <systemd/sd-bus.h>
 
+/** Structure to hold scratchpad status read from node */
+typedef struct
+{
+    uint32_t stored_len;
+    uint32_t processed_len;
+    uint32_t firmware_area_id;
+    uint16_t stored_crc;
+    uint16_t processed_crc;
+    uint8_t stored_status;
+    uint8_t stored_type;
+    uint8_t stored_seq;
+    uint8_t processed_seq;
+} sink_otap_t;
+
 /**
  * \brief   Initialize the otap module
  * \param   bus
@@ -20,6 +35,12 @@
  */
 int Otap_Init(sd_bus * bus, char * object, char * interface);
 
+/**
+ * \brief   Get the scratchpad status exposed on bus
+ * \return  Pointer to the last scratchpad status read from node
+ */
+const sink_otap_t * Otap_Get_Status();
+
 /**
  * \brief   Close the otap module
  */
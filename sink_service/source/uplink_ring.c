@@ -0,0 +1,347 @@
+/* Copyright 2019 Wirepas Ltd licensed under Apache License, Version 2.0
+ *
+ * See file LICENSE for full license details.
+ *
+ */
+#define _GNU_SOURCE
+#include <stdio.h>
+#include <stddef.h>
+#include <stdlib.h>
+#include <stdbool.h>
+#include <errno.h>
+#include <string.h>
+#include <unistd.h>
+#include <fcntl.h>
+#include <pthread.h>
+#include <sys/mman.h>
+#include <sys/eventfd.h>
+
+#include "uplink_ring.h"
+
+#define LOG_MODULE_NAME "Ring"
+#define MAX_LOG_LEVEL INFO_LOG_LEVEL
+#include "logger.h"
+
+/** Max number of clients with a ring at the same time */
+#define MAX_UPLINK_RINGS 4
+
+/** Smallest data area, big enough for any packet */
+#define MIN_UPLINK_RING_SIZE 4096
+
+/** Ring opened by a client */
+typedef struct uplink_ring
+{
+    /** Tracks the client, ring is freed when it leaves the bus */
+    sd_bus_track * track;
+    int mem_fd;
+    int event_fd;
+    uplink_ring_header_t * header;
+    uint8_t * data;
+    size_t map_size;
+    struct uplink_ring * next;
+} uplink_ring_t;
+
+/** Bus instance received at init and needed to track clients */
+static sd_bus * m_bus = NULL;
+
+/** Size of data area of the rings (0 if rings are disabled) */
+static size_t m_ring_size = 0;
+
+/** Opened rings, written from c-mesh-api thread */
+static uplink_ring_t * m_rings = NULL;
+static size_t m_rings_count = 0;
+
+/** Protects the ring list */
+static pthread_mutex_t m_rings_mutex = PTHREAD_MUTEX_INITIALIZER;
+
+static void free_ring(uplink_ring_t * ring)
+{
+    if (ring->header != NULL)
+    {
+        munmap(ring->header, ring->map_size);
+    }
+    if (ring->mem_fd >= 0)
+    {
+        close(ring->mem_fd);
+    }
+    if (ring->event_fd >= 0)
+    {
+        close(ring->event_fd);
+    }
+    sd_bus_track_unref(ring->track);
+    free(ring);
+}
+
+static void remove_ring(uplink_ring_t * ring)
+{
+    uplink_ring_t ** it;
+
+    pthread_mutex_lock(&m_rings_mutex);
+    for (it = &m_rings; *it != NULL; it = &(*it)->next)
+    {
+        if (*it == ring)
+        {
+            *it = ring->next;
+            m_rings_count--;
+            break;
+        }
+    }
+    pthread_mutex_unlock(&m_rings_mutex);
+}
+
+/**
+ * \brief   Called when the client of a ring leaves the bus
+ * \param   ... (from sd_bus_track handler signature)
+ */
+static int on_client_gone(sd_bus_track * track, void * userdata)
+{
+    uplink_ring_t * ring = userdata;
+
+    LOGI("Uplink ring client gone, %llu packets dropped\n",
+         (unsigned long long) __atomic_load_n(&ring->header->dropped, __ATOMIC_RELAXED));
+
+    remove_ring(ring);
+    free_ring(ring);
+
+    return 0;
+}
+
+static uplink_ring_t * create_ring()
+{
+    uplink_ring_t * ring;
+    int r;
+
+    ring = calloc(1, sizeof(uplink_ring_t));
+    if (ring == NULL)
+    {
+        LOGE("Cannot allocate ring\n");
+        return NULL;
+    }
+    ring->event_fd = -1;
+
+    ring->mem_fd = memfd_create("wirepas_uplink_ring", MFD_CLOEXEC | MFD_ALLOW_SEALING);
+    if (ring->mem_fd < 0)
+    {
+        LOGE("Cannot create memfd: %s\n", strerror(errno));
+        goto error;
+    }
+
+    ring->map_size = sizeof(uplink_ring_header_t) + m_ring_size;
+    if (ftruncate(ring->mem_fd, ring->map_size) < 0)
+    {
+        LOGE("Cannot size memfd: %s\n", strerror(errno));
+        goto error;
+    }
+
+    /* Client cannot resize it under our feet */
+    if (fcntl(ring->mem_fd, F_ADD_SEALS, F_SEAL_SHRINK | F_SEAL_GROW | F_SEAL_SEAL) < 0)
+    {
+        LOGE("Cannot seal memfd: %s\n", strerror(errno));
+        goto error;
+    }
+
+    ring->header = mmap(NULL, ring->map_size, PROT_READ | PROT_WRITE, MAP_SHARED, ring->mem_fd, 0);
+    if (ring->header == MAP_FAILED)
+    {
+        LOGE("Cannot map memfd: %s\n", strerror(errno));
+        ring->header = NULL;
+        goto error;
+    }
+    ring->data = (uint8_t *) ring->header + sizeof(uplink_ring_header_t);
+
+    ring->header->magic = UPLINK_RING_MAGIC;
+    ring->header->version = UPLINK_RING_VERSION;
+    ring->header->size = m_ring_size;
+
+    ring->event_fd = eventfd(0, EFD_NONBLOCK | EFD_CLOEXEC);
+    if (ring->event_fd < 0)
+    {
+        LOGE("Cannot create eventfd: %s\n", strerror(errno));
+        goto error;
+    }
+
+    r = sd_bus_track_new(m_bus, &ring->track, on_client_gone, ring);
+    if (r < 0)
+    {
+        LOGE("Cannot create bus track: %s\n", strerror(-r));
+        goto error;
+    }
+
+    return ring;
+
+error:
+    free_ring(ring);
+    return NULL;
+}
+
+int Uplink_ring_open(sd_bus_message * m, void * userdata, sd_bus_error * error)
+{
+    const char * sender = sd_bus_message_get_sender(m);
+    uplink_ring_t * ring;
+    int r;
+
+    if (m_ring_size == 0)
+    {
+        return sd_bus_error_set_const(error,
+                                      SD_BUS_ERROR_NOT_SUPPORTED,
+                                      "Uplink ring is not enabled");
+    }
+
+    /* A client opening it again gets the same ring */
+    pthread_mutex_lock(&m_rings_mutex);
+    for (ring = m_rings; ring != NULL; ring = ring->next)
+    {
+        if (sd_bus_track_count_name(ring->track, sender) > 0)
+        {
+            break;
+        }
+    }
+    pthread_mutex_unlock(&m_rings_mutex);
+
+    if (ring != NULL)
+    {
+        return sd_bus_reply_method_return(m, "hh", ring->mem_fd, ring->event_fd);
+    }
+
+    if (m_rings_count >= MAX_UPLINK_RINGS)
+    {
+        return sd_bus_error_set_const(error,
+                                      SD_BUS_ERROR_LIMITS_EXCEEDED,
+                                      "Too many uplink rings");
+    }
+
+    ring = create_ring();
+    if (ring == NULL)
+    {
+        return sd_bus_error_set_const(error,
+                                      SD_BUS_ERROR_NO_MEMORY,
+                                      "Cannot create uplink ring");
+    }
+
+    r = sd_bus_track_add_sender(ring->track, m);
+    if (r < 0)
+    {
+        LOGE("Cannot track ring client: %s\n", strerror(-r));
+        free_ring(ring);
+        return r;
+    }
+
+    pthread_mutex_lock(&m_rings_mutex);
+    ring->next = m_rings;
+    m_rings = ring;
+    m_rings_count++;
+    pthread_mutex_unlock(&m_rings_mutex);
+
+    LOGI("Uplink ring of %zu bytes opened for %s\n", m_ring_size, sender);
+
+    return sd_bus_reply_method_return(m, "hh", ring->mem_fd, ring->event_fd);
+}
+
+/**
+ * \brief   Copy bytes in ring data area, wrapping at its end
+ */
+static void ring_copy(uplink_ring_t * ring, uint64_t position, const void * src, size_t len)
+{
+    size_t offset = position & (m_ring_size - 1);
+    size_t first = m_ring_size - offset;
+
+    if (first > len)
+    {
+        first = len;
+    }
+
+    memcpy(ring->data + offset, src, first);
+    memcpy(ring->data, (const uint8_t *) src + first, len - first);
+}
+
+static void ring_push(uplink_ring_t * ring,
+                      const uplink_ring_record_t * record,
+                      const uint8_t * bytes)
+{
+    const uint64_t one = 1;
+    size_t needed = sizeof(uplink_ring_record_t) + record->data_size;
+    uint64_t head = __atomic_load_n(&ring->header->head, __ATOMIC_RELAXED);
+    uint64_t tail = __atomic_load_n(&ring->header->tail, __ATOMIC_ACQUIRE);
+
+    if (m_ring_size - (head - tail) < needed)
+    {
+        /* Client is not keeping up */
+        __atomic_add_fetch(&ring->header->dropped, 1, __ATOMIC_RELAXED);
+        return;
+    }
+
+    ring_copy(ring, head, record, sizeof(uplink_ring_record_t));
+    ring_copy(ring, head + sizeof(uplink_ring_record_t), bytes, record->data_size);
+
+    /* Packet is visible to client once head is updated */
+    __atomic_store_n(&ring->header->head, head + needed, __ATOMIC_RELEASE);
+
+    if (write(ring->event_fd, &one, sizeof(one)) < 0 && errno != EAGAIN)
+    {
+        LOGE("Cannot notify ring client: %s\n", strerror(errno));
+    }
+}
+
+bool Uplink_ring_write(const uint8_t * bytes,
+                       size_t num_bytes,
+                       app_addr_t src_addr,
+                       app_addr_t dst_addr,
+                       app_qos_e qos,
+                       uint8_t src_ep,
+                       uint8_t dst_ep,
+                       uint32_t travel_time,
+                       uint8_t hop_count,
+                       unsigned long long timestamp_ms)
+{
+    uplink_ring_record_t record;
+    uplink_ring_t * ring;
+    bool written;
+
+    record.timestamp_ms = timestamp_ms;
+    record.src_addr = src_addr;
+    record.dst_addr = dst_addr;
+    record.travel_time = travel_time;
+    record.data_size = num_bytes;
+    record.src_ep = src_ep;
+    record.dst_ep = dst_ep;
+    record.qos = qos;
+    record.hop_count = hop_count;
+
+    pthread_mutex_lock(&m_rings_mutex);
+    written = (m_rings != NULL);
+    for (ring = m_rings; ring != NULL; ring = ring->next)
+    {
+        ring_push(ring, &record, bytes);
+    }
+    pthread_mutex_unlock(&m_rings_mutex);
+
+    return written;
+}
+
+int Uplink_ring_init(sd_bus * bus, size_t ring_size)
+{
+    m_bus = bus;
+
+    /* Positions are wrapped with a mask */
+    m_ring_size = MIN_UPLINK_RING_SIZE;
+    while (m_ring_size < ring_size)
+    {
+        m_ring_size <<= 1;
+    }
+
+    return 0;
+}
+
+void Uplink_ring_close()
+{
+    uplink_ring_t * ring;
+
+    pthread_mutex_lock(&m_rings_mutex);
+    while ((ring = m_rings) != NULL)
+    {
+        m_rings = ring->next;
+        free_ring(ring);
+    }
+    m_rings_count = 0;
+    pthread_mutex_unlock(&m_rings_mutex);
+}
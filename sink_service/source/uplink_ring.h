@@ -0,0 +1,100 @@
+/* Copyright 2019 Wirepas Ltd licensed under Apache License, Version 2.0
+ *
+ * See file LICENSE for full license details.
+ *
+ */
+
+#ifndef SINK_MANAGER_SOURCE_UPLINK_RING_H_
+#define SINK_MANAGER_SOURCE_UPLINK_RING_H_
+
+#include <stdint.h>
+#include <stdbool.h>
+#include <systemd/sd-bus.h>
+
+#include "wpc.h"
+
+/**
+ * Shared memory layout of an uplink ring
+ *
+ * A ring is a memfd mapped by the sink service (single producer) and by one
+ * client (single consumer). It starts with a header followed by the data
+ * area. Positions are free running byte counters, the offset in data area
+ * is position modulo size. A packet is a record header followed by the
+ * packet bytes, and may wrap at the end of the data area.
+ *
+ * Producer writes the packet then publishes head (release), consumer reads
+ * the packet then publishes tail (release). Eventfd is signaled after each
+ * packet.
+ *
+ * This layout is duplicated in python_transport c-extension and must be
+ * kept in sync (bump UPLINK_RING_VERSION on any change).
+ */
+
+#define UPLINK_RING_MAGIC 0x57505552 /* "WPUR" */
+#define UPLINK_RING_VERSION 1
+
+typedef struct
+{
+    uint32_t magic;
+    uint32_t version;
+    /* Size of data area in bytes, power of 2 */
+    uint64_t size;
+    /* Packets dropped as ring was full */
+    uint64_t dropped;
+    /* Write position, only updated by producer */
+    uint64_t head __attribute__((aligned(64)));
+    /* Read position, only updated by consumer */
+    uint64_t tail __attribute__((aligned(64)));
+} uplink_ring_header_t;
+
+typedef struct __attribute__((packed))
+{
+    uint64_t timestamp_ms;
+    uint32_t src_addr;
+    uint32_t dst_addr;
+    uint32_t travel_time;
+    uint16_t data_size;
+    uint8_t src_ep;
+    uint8_t dst_ep;
+    uint8_t qos;
+    uint8_t hop_count;
+} uplink_ring_record_t;
+
+/**
+ * \brief   Initialize the uplink ring module
+ * \param   bus
+ *          The sd_bus instance clients are tracked on
+ * \param   ring_size
+ *          Size of the data area of each ring, rounded up to a power of 2
+ * \return  0 if initialization succeed, an error code otherwise
+ */
+int Uplink_ring_init(sd_bus * bus, size_t ring_size);
+
+/**
+ * \brief   OpenUplinkRing method handler
+ * \note    Caller gets the memfd and the eventfd of its ring. Ring is freed
+ *          when caller leaves the bus
+ * \param   ... (from sd_bus function signature)
+ */
+int Uplink_ring_open(sd_bus_message * m, void * userdata, sd_bus_error * error);
+
+/**
+ * \brief   Write a received packet in all the opened rings
+ * \note    Called from c-mesh-api thread
+ * \param   ... (from c-mesh api onDataReceived callback)
+ * \return  True if at least one ring is opened, false otherwise
+ */
+bool Uplink_ring_write(const uint8_t * bytes,
+                       size_t num_bytes,
+                       app_addr_t src_addr,
+                       app_addr_t dst_addr,
+                       app_qos_e qos,
+                       uint8_t src_ep,
+                       uint8_t dst_ep,
+                       uint32_t travel_time,
+                       uint8_t hop_count,
+                       unsigned long long timestamp_ms);
+
+void Uplink_ring_close();
+
+#endif /* SINK_MANAGER_SOURCE_UPLINK_RING_H_ */